@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Benchmark the CPU-side pipeline stages on synthetic long-form transcripts.
+
+    python -m benchmarks.run_benchmarks                      # 1h, 5h and 20h, compare to baseline
+    python -m benchmarks.run_benchmarks --hours 1 --save-baseline
+
+Each stage is timed (best of --repeat runs) and then run once under
+tracemalloc for its peak Python memory. Results are compared with the
+baseline file; the exit status is 1 if any stage got slower or bigger than
+the baseline by more than --threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import SEGMENT_SECONDS, MAX_SEG_TEXT_CHARS, VIDEO_FPS
+from benchmarks.synthetic import write_json, write_srt, write_txt
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+DEFAULT_HOURS = (1, 5, 20)
+DEFAULT_THRESHOLD = 0.25
+# Regressions smaller than this are treated as timer noise
+MIN_REGRESSION_SEC = 0.05
+MIN_REGRESSION_MB = 1.0
+
+class Stage(NamedTuple):
+    name: str
+    prepare: Callable[[Dict], Dict]  # Builds inputs outside the timed region
+    run: Callable[..., int]  # Returns the number of items processed
+
+def _stages() -> List[Stage]:
+    from core.captions import build_captions
+    from core.comfy_client import ComfyClient
+    from core.segmenter import segment_transcript
+    from core.transcript_parser import parse_transcript
+    from core.video_assembler import plan_chunks, write_concat_list
+
+    def parse(fmt):
+        return Stage(f"parse_{fmt}", lambda ctx: {"path": ctx[fmt]},
+                     lambda path: len(parse_transcript(None, str(path))))
+
+    def segments(ctx):
+        return segment_transcript(ctx["lines"], SEGMENT_SECONDS, MAX_SEG_TEXT_CHARS)
+
+    def graphs(segs, client):
+        for seg in segs:
+            client.build_graph(f"cinematic still of {seg.text[:200]}", "blurry, text", 1920, 1080, seg.index, 30, 6.5,
+                               "euler", "normal", seg.index)
+        return len(segs)
+
+    def concat_list(segs, images_dir, out):
+        chunks = plan_chunks(segs, images_dir, VIDEO_FPS)
+        write_concat_list(chunks, out, VIDEO_FPS)
+        return len(chunks)
+
+    return [
+        parse("srt"), parse("json"), parse("txt"),
+        Stage("segment_transcript", lambda ctx: {"lines": ctx["lines"]},
+              lambda lines: len(segment_transcript(lines, SEGMENT_SECONDS, MAX_SEG_TEXT_CHARS))),
+        Stage("build_captions",
+              lambda ctx: {"segs": segments(ctx), "out": ctx["dir"] / "captions.ass"},
+              lambda segs, out: build_captions(segs, [{"caption": s.text[:80]} for s in segs], out) or len(segs)),
+        Stage("comfy_build_graph",
+              lambda ctx: {"segs": segments(ctx),
+                           "client": ComfyClient("http://127.0.0.1:8188", ctx["dir"] / "images", use_websocket=False)},
+              graphs),
+        Stage("concat_list",
+              lambda ctx: {"segs": segments(ctx), "images_dir": ctx["dir"] / "images", "out": ctx["dir"] / "images.txt"},
+              concat_list),
+    ]
+
+def _measure(stage: Stage, inputs: Dict, repeat: int) -> Dict:
+    best = float('inf')
+    items = 0
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        items = stage.run(**inputs)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        stage.run(**inputs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(best, 6), "items": items, "items_per_sec": round(items / best, 1) if best > 0 else None,
+            "peak_mb": round(peak / 2 ** 20, 3)}
+
+def run_suite(hours_list, repeat: int = 5, stages: List[str] = None, workdir: Path = None) -> Dict[str, Dict]:
+    """ {"<stage>@<hours>h": {"seconds", "items", "items_per_sec", "peak_mb"}} for every stage and episode length """
+    from core.transcript_parser import parse_transcript
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for hours in hours_list:
+            ctx = {"dir": Path(tmp) / f"{hours}h"}
+            ctx["dir"].mkdir()
+            for fmt, write in (("srt", write_srt), ("json", write_json), ("txt", write_txt)):
+                ctx[fmt] = ctx["dir"] / f"transcript.{fmt}"
+                write(ctx[fmt], hours)
+            ctx["lines"] = parse_transcript(None, str(ctx["srt"]))
+            for stage in _stages():
+                if stages and stage.name not in stages:
+                    continue
+                key = f"{stage.name}@{hours:g}h"
+                results[key] = _measure(stage, stage.prepare(ctx), repeat)
+                print(f"{key:<28} {results[key]['seconds']:>9.3f}s {results[key]['items_per_sec'] or 0:>12,.0f} items/s "
+                      f"{results[key]['peak_mb']:>9.1f} MB peak")
+    return results
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """ Human-readable regressions of results against baseline (time or peak memory beyond threshold) """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if result["seconds"] > base["seconds"] * (1 + threshold) and result["seconds"] - base["seconds"] > MIN_REGRESSION_SEC:
+            regressions.append(f"{key}: {result['seconds']:.3f}s vs baseline {base['seconds']:.3f}s "
+                               f"(+{result['seconds'] / base['seconds'] - 1:.0%})")
+        if result["peak_mb"] > base["peak_mb"] * (1 + threshold) and result["peak_mb"] - base["peak_mb"] > MIN_REGRESSION_MB:
+            regressions.append(f"{key}: {result['peak_mb']:.1f} MB peak vs baseline {base['peak_mb']:.1f} MB "
+                               f"(+{result['peak_mb'] / base['peak_mb'] - 1:.0%})")
+    return regressions
+
+def machine_info() -> Dict[str, str]:
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "processor": platform.processor()}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on synthetic transcripts")
+    parser.add_argument("--hours", type=float, nargs='+', default=list(DEFAULT_HOURS), help="Episode lengths to generate")
+    parser.add_argument("--stage", action='append', help="Only run this stage (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage; the fastest counts")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="Write these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown / memory growth over the baseline (0.25 = 25%%)")
+    parser.add_argument("--out", type=Path, help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+    # A gate with nothing to compare against must not pass; baselines are per machine, so none is committed
+    if not args.save_baseline and not args.baseline.exists():
+        print(f"ERROR: No baseline at {args.baseline}; run with --save-baseline on this machine first")
+        return 2
+
+    results = run_suite(args.hours, args.repeat, args.stage)
+    report = {"machine": machine_info(), "results": results}
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {"results": {}}
+        baseline = {"machine": report["machine"], "results": {**baseline["results"], **results}}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("machine") != report["machine"]:
+        print(f"WARNING: Baseline was recorded on a different machine ({baseline.get('machine')})")
+    regressions = compare(results, baseline["results"], args.threshold)
+    for line in regressions:
+        print(f"REGRESSION: {line}")
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
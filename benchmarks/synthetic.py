@@ -0,0 +1,60 @@
+""" Synthetic long-form transcripts (SRT, JSON, speaker TXT) for benchmarks and tests """
+
+import json
+import random
+from pathlib import Path
+from typing import Iterator
+from core.transcript_parser import Line
+
+WORDS = ("the quantum mind of time and pension travel spiritual energy we think about consciousness really "
+         "future past listen story universe question because people world idea simple attention focus "
+         "frequency signal pattern memory dream light sound body breath moment reality shift").split()
+
+# Speaker TXT transcripts carry only a start time per turn; the parser assumes this per line
+TXT_LINE_MS = 3000
+
+def _sentence(rng: random.Random) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16))).capitalize() + '.'
+
+def synthetic_lines(hours: float, seed: int = 0) -> Iterator[Line]:
+    """ Caption-like lines (1.5-6 s, 4-16 words, short gaps) covering hours of audio """
+    rng = random.Random(seed)
+    end_of_episode = int(hours * 3600 * 1000)
+    t = 0
+    while t < end_of_episode:
+        duration = rng.randint(1500, 6000)
+        yield Line(t, min(t + duration, end_of_episode), _sentence(rng))
+        t += duration + rng.randint(0, 800)
+
+def _clock(ms: int, sep: str) -> str:
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}{sep}{ms % 1000:03d}"
+
+def write_srt(path: Path, hours: float, seed: int = 0) -> int:
+    """ Write an SRT transcript; returns the number of lines """
+    count = 0
+    with open(path, 'w') as f:
+        for count, line in enumerate(synthetic_lines(hours, seed), 1):
+            f.write(f"{count}\n{_clock(line.start_ms, ',')} --> {_clock(line.end_ms, ',')}\n{line.text}\n\n")
+    return count
+
+def write_json(path: Path, hours: float, seed: int = 0) -> int:
+    """ Write a Whisper-style JSON transcript ([{"start", "end", "text"}] in seconds) """
+    items = [{"start": line.start_ms / 1000, "end": line.end_ms / 1000, "text": f" {line.text}"}
+             for line in synthetic_lines(hours, seed)]
+    with open(path, 'w') as f:
+        json.dump(items, f)
+    return len(items)
+
+def write_txt(path: Path, hours: float, seed: int = 0) -> int:
+    """ Write a `[SPEAKER_XX] - HH:MM:SS.mmm` transcript of speaker turns, TXT_LINE_MS per line """
+    rng = random.Random(seed)
+    end_of_episode = int(hours * 3600 * 1000)
+    count = 0
+    t = 0
+    with open(path, 'w') as f:
+        while t < end_of_episode:
+            turn = [_sentence(rng) for _ in range(rng.randint(1, 6))]
+            f.write(f"[SPEAKER_{rng.randint(0, 2):02d}] - {_clock(t, '.')}\n" + '\n'.join(turn) + '\n\n')
+            count += len(turn)
+            t += len(turn) * TXT_LINE_MS + rng.randint(0, 1000)
+    return count
@@ -10,6 +10,11 @@ OUTPUT_ROOT = "output"
 # Segmentation
 SEGMENT_SECONDS = 12
 MAX_SEG_TEXT_CHARS = 900
+SEGMENT_MODE = "fixed"
+SEGMENT_MAX_SEC = 60
+SEGMENT_PAUSE_MS = 800
+SEGMENT_SIMILARITY = 0.3
+IMAGES_PER_HOUR = None
 
 # Captions (ASS)
 CAPTION_MAX_CHARS = 88
@@ -19,11 +24,29 @@ CAPTION_FONTSIZE = 42
 CAPTION_MARGIN = 60
 CAPTION_STROKE = 2
 CAPTION_BG_ALPHA = 0.35
+CAPTION_RENDER = "ass"
+
+# Transcription
+TRANSCRIBE_CHECKPOINT_SEC = 30
+TRANSCRIBE_MODE = "single"
+TRANSCRIBE_CHUNK_SEC = 300
+TRANSCRIBE_VAD_MIN_SILENCE_MS = 500
+TRANSCRIBE_THREADS_PER_WORKER = 4
+TRANSCRIBE_BATCH_SIZE = 16
+
+# Transcription worker
+WHISPER_WORKER_URL = "http://127.0.0.1:8765"
+WHISPER_WORKER_MAX_MODELS = 2
 
 # LLM
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = "gpt-4o-mini"
+LLM_BACKEND = "openai"
+LLM_BATCH_TOKENS = 6000
+LLM_MAX_WORKERS = 4
+PROMPT_CACHE_PATH = None
+PROMPT_CACHE_MAX_ENTRIES = 100000
 
 # Global visual style
 GLOBAL_STYLE = "cinematic, sacred geometry, cosmic-tech elegance, crisp detail, clean composition, dramatic lighting, high dynamic range"
@@ -41,14 +64,47 @@ BATCH_SIZE = 1
 COMFY_HOST = "127.0.0.1"
 COMFY_PORT = 8188
 COMFY_OUTPUT_DIR = "output"
+COMFY_MAX_IN_FLIGHT = 2
+COMFY_POLL_SEC = 0.5
+COMFY_URLS = None
+COMFY_HTTP_TIMEOUT_SEC = 30
+COMFY_QUEUE_PROBE_SEC = 1.0
+COMFY_HEALTH_SEC = 30
+IMAGE_LIBRARY_DIR = None
+IMAGE_REUSE_THRESHOLD = None
 
 # FFmpeg
 FFMPEG_EXE = "ffmpeg"
 VIDEO_FPS = 30
 VIDEO_BITRATE = "10M"
+VIDEO_ENCODE_MODE = "single"
+VIDEO_ENCODE_WORKERS = None
+VIDEO_PROFILE = "standard"
+VIDEO_STILL_FPS = 5
+VIDEO_CRF = 20
+VIDEO_KEYFRAME_SEC = 10
+
+# Preview (--preview)
+PREVIEW_WIDTH = 640
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 5
+PREVIEW_STEPS = 8
+PREVIEW_IMAGES = "render"
+PREVIEW_CRF = 30
 
 # Behaviour
 ALLOW_REUSE = True
+CACHE_DIR = None
 RETRY_LLM = 3
 RETRY_COMFY = 2
-TIMEOUT_COMFY_SEC = 600
\ No newline at end of file
+TIMEOUT_COMFY_SEC = 600
+
+# Pipeline
+PIPELINE_MODE = "sequential"
+PIPELINE_QUEUE_SIZE = 8
+
+# Batch mode
+BATCH_PARALLEL_EPISODES = 2
+
+# Metrics
+METRICS_TEXTFILE_DIR = None
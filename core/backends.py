@@ -0,0 +1,57 @@
+""" Backend registries: transcript parsers, transcription modes and LLM clients, imported only when selected """
+
+from importlib import import_module
+from typing import Any, Dict, List
+
+class Registry:
+    """
+    Maps backend names to "module:attribute" targets. Nothing is imported
+    until get() asks for a backend, so selecting one transcript format (or
+    none at all) never loads the dependencies of the others.
+    """
+
+    def __init__(self, kind: str, targets: Dict[str, str]):
+        self.kind = kind
+        self._targets = dict(targets)
+        self._loaded: Dict[str, Any] = {}
+
+    def register(self, name: str, target: str):
+        """ Add (or replace) a backend; target is "package.module:attribute" """
+        if ':' not in target:
+            raise ValueError(f"{self.kind} target must be module:attribute, got {target}")
+        self._targets[name] = target
+        self._loaded.pop(name, None)
+
+    def names(self) -> List[str]:
+        return list(self._targets)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._targets
+
+    def get(self, name: str) -> Any:
+        """ The backend registered as name, importing its module on first use """
+        if name not in self._loaded:
+            if name not in self._targets:
+                raise ValueError(f"Unknown {self.kind}: {name} (choose from {', '.join(self._targets)})")
+            module, attribute = self._targets[name].split(':')
+            self._loaded[name] = getattr(import_module(module), attribute)
+        return self._loaded[name]
+
+# Transcript file suffix -> Line iterator
+TRANSCRIPT_FORMATS = Registry("transcript format", {
+    ".srt": "core.transcript_parser:iter_srt",
+    ".json": "core.transcript_parser:iter_json_transcript",
+    ".txt": "core.transcript_parser:iter_text_transcript",
+})
+
+# --whisper-mode -> Line iterator over an audio file (faster-whisper loads with the first model)
+TRANSCRIBERS = Registry("transcription mode", {
+    "single": "core.transcript_parser:iter_transcription",
+    "parallel": "core.parallel_transcribe:iter_transcription_parallel",
+    "batched": "core.parallel_transcribe:iter_transcription_batched",
+})
+
+# LLM_BACKEND -> factory returning an OpenAI-compatible chat client
+LLM_CLIENTS = Registry("LLM backend", {
+    "openai": "core.prompt_generator:openai_client",
+})
@@ -0,0 +1,175 @@
+""" Batch mode: many episodes through shared transcription, LLM and ComfyUI pools """
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+from config import LLM_MAX_WORKERS, COMFY_MAX_IN_FLIGHT, TRANSCRIBE_THREADS_PER_WORKER
+from core.prompt_generator import LLMBudget
+from core.whisper_worker import ModelPool
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.aac', '.opus'}
+
+class Episode(NamedTuple):
+    audio: Path
+    srt: Optional[Path] = None
+
+    @property
+    def slug(self) -> str:
+        return self.audio.stem
+
+def load_manifest(path: Path) -> List[Episode]:
+    """
+    Episodes from a directory of audio files, a JSON list (paths or
+    {"audio", "srt"} objects) or a text file with one `audio[<TAB>srt]` per
+    line ('#' starts a comment). Relative paths are relative to the manifest.
+    """
+    path = Path(path)
+    if path.is_dir():
+        episodes = [Episode(p) for p in sorted(path.iterdir()) if p.suffix.lower() in AUDIO_EXTENSIONS]
+    else:
+        base = path.parent
+        if path.suffix == '.json':
+            with open(path) as f:
+                items = json.load(f)
+            if not isinstance(items, list):
+                raise ValueError(f"Manifest {path} must be a JSON list")
+            entries = [(item, None) if isinstance(item, str) else (item['audio'], item.get('srt')) for item in items]
+        else:
+            entries = []
+            with open(path) as f:
+                for raw in f:
+                    line = raw.split('#', 1)[0].strip()
+                    if line:
+                        audio, _, srt = line.partition('\t')
+                        entries.append((audio.strip(), srt.strip() or None))
+        episodes = [Episode(base / audio, base / srt if srt else None) for audio, srt in entries]
+
+    seen = {}
+    for episode in episodes:
+        if episode.slug in seen:
+            raise ValueError(f"Episodes {seen[episode.slug]} and {episode.audio} would share output/{episode.slug}/")
+        seen[episode.slug] = episode.audio
+    return episodes
+
+class SharedPools:
+    """
+    Worker pools shared by every episode in a batch: loaded Whisper models (or
+    one process pool for parallel mode), one LLM concurrency budget and one
+    ComfyUI scheduler (with an optional ImageLibrary), so concurrent episodes
+    queue on the same resources instead of each bringing their own.
+    """
+
+    def __init__(self, comfy_url: Union[str, List[str]] = None, output_root: Path = None, whisper_workers: int = None,
+                 llm_max_in_flight: int = LLM_MAX_WORKERS, comfy_max_in_flight: int = COMFY_MAX_IN_FLIGHT,
+                 library=None, **render_args):
+        self.models = ModelPool()
+        self.llm = LLMBudget(llm_max_in_flight)
+        self.comfy_url = comfy_url
+        self.output_root = output_root
+        self.whisper_workers = whisper_workers
+        self.comfy_max_in_flight = comfy_max_in_flight
+        self.library = library
+        self.render_args = render_args
+        self._lock = threading.Lock()
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._process_pool_model = None
+        self._scheduler = None
+
+    def transcribe(self, audio_path: Path, model_size: str, device: str, checkpoint: Path = None, mode: str = "single"):
+        """ Transcribe on a shared model; "parallel" chunks from all episodes share one process pool """
+        from core.transcript_parser import resolve_device, transcribe_audio
+        if mode == "parallel":
+            return transcribe_audio(audio_path, model_size, checkpoint=checkpoint, mode=mode,
+                                    workers=self._worker_count(), executor=self._parallel_pool(model_size))
+        key = (model_size, *resolve_device(device))
+        model, lock = self.models.get(key)
+        with lock:
+            return transcribe_audio(audio_path, model_size, key[1], model=model, checkpoint=checkpoint, mode=mode)
+
+    def _worker_count(self) -> int:
+        return self.whisper_workers or max(1, (os.cpu_count() or 1) // TRANSCRIBE_THREADS_PER_WORKER)
+
+    def _parallel_pool(self, model_size: str) -> ProcessPoolExecutor:
+        from core.parallel_transcribe import _init_chunk_worker
+        with self._lock:
+            if self._process_pool is not None and self._process_pool_model != model_size:
+                raise ValueError("All episodes in a parallel-mode batch must use the same Whisper model")
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(self._worker_count(), initializer=_init_chunk_worker,
+                                                         initargs=(model_size, TRANSCRIBE_THREADS_PER_WORKER))
+                self._process_pool_model = model_size
+            return self._process_pool
+
+    def comfy(self):
+        """ The shared ComfyScheduler, connected on first use """
+        from core.comfy_client import ComfyClient, ComfyScheduler
+        with self._lock:
+            if self._scheduler is None:
+                client = ComfyClient(self.comfy_url, self.output_root)
+                self._scheduler = ComfyScheduler(client, self.comfy_max_in_flight, library=self.library, **self.render_args)
+            return self._scheduler
+
+    def close(self):
+        with self._lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(cancel_futures=True)
+                self._process_pool = None
+            if self._scheduler is not None:
+                self._scheduler.close()
+                self._scheduler = None
+            if self.library is not None:
+                self.library.close()
+                self.library = None
+
+def run_batch(episodes: List[Episode], run_episode: Callable[[Episode], Dict], max_parallel: int = 1,
+              summary_file: Path = None) -> Dict:
+    """
+    Run episodes max_parallel at a time. run_episode returns a dict with at
+    least "output_dir" and "duration_ms"; an exception marks the episode failed
+    without stopping the batch. Returns (and optionally writes) a summary of
+    throughput and failures.
+    """
+    start = time.monotonic()
+    records = {}
+
+    def timed(episode: Episode) -> Dict:
+        t0 = time.monotonic()
+        try:
+            result = run_episode(episode)
+            return {"status": "ok", **result, "seconds": round(time.monotonic() - t0, 3)}
+        except Exception as e:
+            return {"status": "failed", "error": f"{type(e).__name__}: {e}", "seconds": round(time.monotonic() - t0, 3)}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel), thread_name_prefix='episode') as pool:
+        futures = {pool.submit(timed, episode): episode for episode in episodes}
+        for future in as_completed(futures):
+            episode = futures[future]
+            records[episode.slug] = {"audio": str(episode.audio), **future.result()}
+            print(f"{records[episode.slug]['status'].upper()}: {episode.slug} ({records[episode.slug]['seconds']:.1f}s)")
+
+    wall = time.monotonic() - start
+    ok = [r for r in records.values() if r["status"] == "ok"]
+    audio_sec = sum(r.get("duration_ms", 0) for r in ok) / 1000
+    summary = {
+        "episodes": len(episodes),
+        "succeeded": len(ok),
+        "failed": len(episodes) - len(ok),
+        "wall_seconds": round(wall, 3),
+        "audio_seconds": round(audio_sec, 3),
+        "realtime_factor": round(audio_sec / wall, 3) if wall > 0 else None,
+        "episodes_per_hour": round(len(ok) * 3600 / wall, 3) if wall > 0 else None,
+        "results": {episode.slug: records[episode.slug] for episode in episodes},
+    }
+    print(f"Batch: {summary['succeeded']}/{summary['episodes']} episodes in {wall:.1f}s "
+          f"({audio_sec / 60:.1f} min of audio, {summary['realtime_factor'] or 0:.1f}x realtime)")
+    for slug, record in summary["results"].items():
+        if record["status"] != "ok":
+            print(f"FAILED: {slug}: {record['error']}")
+    if summary_file:
+        with open(summary_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
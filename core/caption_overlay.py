@@ -0,0 +1,144 @@
+""" Pre-rendered captions: each distinct caption rasterized once into a transparent PNG and composited per segment """
+
+import math
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+import numpy as np
+from config import FFMPEG_EXE, VIDEO_ENCODE_WORKERS
+from core.captions import format_ms, read_ass, visible_events
+from core.metrics import bind, timed_call
+from core.stage_cache import digest_file, digest_json
+
+# Bump when overlay rendering changes so cached overlays are redrawn
+OVERLAY_VERSION = 1
+
+def _visible_captions(captions_file: Path, chunks: List, fps: int):
+    """ (header, {chunk index: Dialogue lines shown at the chunk's first frame, without their times}) """
+    header, events = read_ass(captions_file)
+    # A window from t to the next float after it holds exactly the events with start <= t < end
+    firsts = [chunk.start_frame * 1000 / fps for chunk in chunks]
+    shown = visible_events(events, [(t, math.nextafter(t, math.inf)) for t in firsts])
+    visible = {chunk.index: [events[i].line.split(',', 3)[::3] for i in positions] for chunk, positions in zip(chunks, shown)}
+    return header, visible
+
+def render_overlays(captions_file: Path, chunks: List, fps: int, width: int, height: int,
+                    overlay_dir: Path) -> Dict[int, Path]:
+    """
+    Rasterize the captions shown on each chunk into overlay_dir/overlay_<key>.png
+    (RGBA, width x height) and return {chunk index: overlay} for chunks that
+    show any. Captions are sampled at each chunk's first frame, so they must
+    only change on segment boundaries (as build_captions writes them).
+    Identical captions share one overlay, and overlays already in overlay_dir
+    are reused; the rest are drawn by a single ffmpeg run.
+    """
+    header, visible = _visible_captions(captions_file, chunks, fps)
+    overlays, missing = {}, {}
+    for index, lines in visible.items():
+        if not lines:
+            continue
+        key = digest_json({"version": OVERLAY_VERSION, "header": header, "lines": lines, "size": [width, height]})
+        overlays[index] = overlay_dir / f"overlay_{key[:16]}.png"
+        if not overlays[index].exists():
+            missing[overlays[index]] = lines
+    if missing:
+        overlay_dir.mkdir(parents=True, exist_ok=True)
+        _rasterize(header, missing, width, height, overlay_dir)
+    return overlays
+
+def _rasterize(header: List[str], captions: Dict[Path, List[List[str]]], width: int, height: int, overlay_dir: Path):
+    """
+    Draw caption k of captions at second k of a re-timed .ass file, once over
+    black and once over white (libass leaves the alpha channel alone), and
+    recover each overlay's alpha and colour from the difference.
+    """
+    script = overlay_dir / "overlays.ass"
+    with open(script, 'w') as f:
+        f.write('\n'.join(header) + '\n')
+        for k, lines in enumerate(captions.values()):
+            f.writelines(f"{prefix},{format_ms(k * 1000)},{format_ms(k * 1000 + 1000)},{rest}\n" for prefix, rest in lines)
+
+    count = len(captions)
+    source = f"s={width}x{height}:r=1:d={count}"
+    render = [FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', f"color=c=black:{source}",
+              '-f', 'lavfi', '-i', f"color=c=white:{source}",
+              '-filter_complex', f"[0:v]subtitles='{script}':fontsdir=.[b];[1:v]subtitles='{script}':fontsdir=.[w];[b][w]vstack",
+              '-frames:v', str(count), '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+    write = [FFMPEG_EXE, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f"{width}x{height}",
+             '-r', '1', '-i', '-', '-start_number', '0', str(overlay_dir / "tmp_%06d.png")]
+    frame_bytes = width * height * 3 * 2
+    with timed_call("ffmpeg", "overlays"):
+        renderer = subprocess.Popen(render, stdout=subprocess.PIPE)
+        writer = subprocess.Popen(write, stdin=subprocess.PIPE)
+        try:
+            for _ in range(count):
+                frame = renderer.stdout.read(frame_bytes)
+                if len(frame) != frame_bytes:
+                    break
+                pair = np.frombuffer(frame, dtype=np.uint8).reshape(2, height, width, 3).astype(np.int32)
+                writer.stdin.write(_unmix(pair[0], pair[1]).tobytes())
+            writer.stdin.close()
+        except BrokenPipeError:
+            pass  # The writer exited early; its return code says why
+        except BaseException:
+            renderer.kill()
+            writer.kill()
+            raise
+        finally:
+            renderer.stdout.close()
+            renderer.wait()
+            writer.wait()
+    if renderer.returncode or writer.returncode:
+        raise subprocess.CalledProcessError(renderer.returncode or writer.returncode, FFMPEG_EXE)
+    for k, path in enumerate(captions):
+        os.replace(overlay_dir / f"tmp_{k:06d}.png", path)
+    script.unlink()
+
+def _unmix(on_black: np.ndarray, on_white: np.ndarray) -> np.ndarray:
+    """ RGBA image that gives on_black / on_white when composited over black / white """
+    alpha = 255 - (on_white - on_black).mean(axis=2)
+    alpha = np.clip(np.rint(alpha), 0, 255)
+    colour = np.where(alpha[..., None] > 0, on_black * 255 / np.maximum(alpha, 1)[..., None], 0)
+    return np.dstack([np.clip(np.rint(colour), 0, 255), alpha]).astype(np.uint8)
+
+def overlay_filter(width: int, height: int) -> str:
+    """ Filtergraph scaling input 0 (image) and input 1 (overlay) to width x height and compositing them """
+    return f"[0:v]scale={width}:{height}[i];[1:v]scale={width}:{height}[o];[i][o]overlay=format=rgb"
+
+def composite_image(image: Path, overlay: Path, output: Path, width: int, height: int):
+    """ image with overlay drawn on top, as a width x height PNG """
+    with timed_call("ffmpeg", "composite"):
+        subprocess.run([FFMPEG_EXE, '-y', '-loglevel', 'error', '-i', str(image), '-i', str(overlay),
+                        '-filter_complex', overlay_filter(width, height), '-frames:v', '1', str(output)], check=True)
+
+def composite_frames(chunks: List, overlays: Dict[int, Path], frame_dir: Path, width: int, height: int,
+                     workers: Optional[int] = None) -> List:
+    """
+    Chunks whose image is replaced by frame_dir/seg_NNN_<key>.png, the image
+    with its caption overlay burned in (chunks without captions keep their
+    image). Frames are keyed on the image bytes and the overlay, so a re-run
+    only composites segments whose image or caption changed.
+    """
+    frame_dir.mkdir(parents=True, exist_ok=True)
+    frames = {}
+    for chunk in chunks:
+        if chunk.index in overlays:
+            key = digest_json({"image": digest_file(chunk.image), "overlay": overlays[chunk.index].name,
+                               "size": [width, height]})
+            frames[chunk.index] = frame_dir / f"seg_{chunk.index:03d}_{key[:16]}.png"
+    dirty = [chunk for chunk in chunks if chunk.index in frames and not frames[chunk.index].exists()]
+
+    def run(chunk):
+        tmp = frames[chunk.index].with_suffix('.part.png')
+        composite_image(chunk.image, overlays[chunk.index], tmp, width, height)
+        os.replace(tmp, frames[chunk.index])
+
+    workers = max(1, min(workers or VIDEO_ENCODE_WORKERS or os.cpu_count() or 1, len(dirty) or 1))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='composite') as pool:
+        for future in [pool.submit(bind(run), chunk) for chunk in dirty]:
+            future.result()
+    for stale in set(frame_dir.glob("seg_*.png")) - set(frames.values()):
+        stale.unlink()
+    return [chunk._replace(image=frames[chunk.index]) if chunk.index in frames else chunk for chunk in chunks]
@@ -1,18 +1,23 @@
 """ Captions module """
 
+import heapq
 from pathlib import Path
+import numpy as np
 from config import CAPTION_FONT, CAPTION_FONTSIZE, CAPTION_MARGIN, CAPTION_STROKE, CAPTION_BG_ALPHA, CAPTION_CASE, CAPTION_MAX_CHARS
-from typing import List, NamedTuple, Dict
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+from core.columnar import int_column
 from core.segmenter import Segment, Segment
 
+# Bump when the .ass output changes so cached captions are rebuilt
+CAPTIONS_VERSION = 2
+
 class PromptResult(NamedTuple):
     segment_index: int
     prompt: str
     negative_prompt: str
     caption: str
 
-def build_captions(segments: List[Segment], results: List[Dict], output_file: Path):
-    ass_script = """
+ASS_HEADER = """
 [Script Info]
 ScriptType: v4.00+
 Collisions: Normal
@@ -24,21 +29,91 @@ Style: Default,{fontname},{fontsize},&H00FFFFFF,&H00FFFFFF,&H00000000,&H{COLOR},
 
 [Events]
 Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
-""".format(fontname=CAPTION_FONT, fontsize=CAPTION_FONTSIZE, stroke=CAPTION_STROKE, margin=CAPTION_MARGIN, COLOR=f"{int(CAPTION_BG_ALPHA*255):02X}000000")
+"""
+
+class AssEvent(NamedTuple):
+    start_ms: int
+    end_ms: int
+    line: str  # The whole Dialogue line
 
-    for i, seg in enumerate(segments):
-        start_time = format_ms(seg.start_ms)
-        end_time = format_ms(seg.end_ms)
-        caption = results[i]['caption'][:CAPTION_MAX_CHARS]
-        if CAPTION_CASE == 'title':
-            caption = caption.title()
-        ass_script += f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{caption}\n"
+def ass_header() -> str:
+    """ Everything build_captions writes before the events, for the configured caption style """
+    return ASS_HEADER.format(fontname=CAPTION_FONT, fontsize=CAPTION_FONTSIZE, stroke=CAPTION_STROKE,
+                             margin=CAPTION_MARGIN, COLOR=f"{int(CAPTION_BG_ALPHA*255):02X}000000")
 
+def build_captions(segments: List[Segment], results: List[Dict], output_file: Path):
+    """ Write one Dialogue event per segment; events are streamed to the file as they are formatted """
     with open(output_file, 'w') as f:
-        f.write(ass_script)
+        f.write(ass_header())
+        f.writelines(_dialogue_lines(segments, results))
+
+def _caption_text(result: Dict) -> str:
+    caption = result['caption'][:CAPTION_MAX_CHARS]
+    return caption.title() if CAPTION_CASE == 'title' else caption
+
+def _dialogue_lines(segments: List[Segment], results: List[Dict]) -> Iterator[str]:
+    start_times = format_ms_many(int_column(segments, 'start_ms'))
+    end_times = format_ms_many(int_column(segments, 'end_ms'))
+    for result, start_time, end_time in zip(results, start_times, end_times):
+        yield f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{_caption_text(result)}\n"
+
+def dialogue_event(segment: Segment, result: Dict) -> AssEvent:
+    """ The event build_captions writes for one segment, as read_ass() would read it back """
+    start_time, end_time = format_ms(segment.start_ms), format_ms(segment.end_ms)
+    return AssEvent(parse_ass_time(start_time), parse_ass_time(end_time),
+                    f"Dialogue: 0,{start_time},{end_time},Default,,0,0,0,,{_caption_text(result)}")
+
+def read_ass(captions_file: Path) -> Tuple[List[str], List[AssEvent]]:
+    """ (header lines, Dialogue events) of an .ass file, timed the way libass reads them """
+    header, events = [], []
+    with open(captions_file) as f:
+        for line in f:
+            if line.startswith('Dialogue:'):
+                fields = line.split(',', 3)
+                events.append(AssEvent(parse_ass_time(fields[1]), parse_ass_time(fields[2]), line.rstrip('\n')))
+            else:
+                header.append(line.rstrip('\n'))
+    return header, events
+
+def visible_events(events: List[AssEvent], windows: List[Tuple[float, float]]) -> List[List[int]]:
+    """
+    For each (start_ms, end_ms) window, the positions of the events shown
+    during it (starting before its end and ending after its start), in file
+    order. Events are sorted by start once and swept together with the windows
+    in timeline order, so the cost is linear in events + windows (plus sorting)
+    rather than one scan of every event per window.
+    """
+    order = sorted(range(len(events)), key=lambda i: events[i].start_ms)
+    visible: List[List[int]] = [[] for _ in windows]
+    active: List[Tuple[int, int]] = []  # Heap of (end_ms, position) of started events
+    started = 0
+    for w in sorted(range(len(windows)), key=lambda w: windows[w]):
+        start_ms, end_ms = windows[w]
+        while started < len(order) and events[order[started]].start_ms < end_ms:
+            heapq.heappush(active, (events[order[started]].end_ms, order[started]))
+            started += 1
+        while active and active[0][0] <= start_ms:  # Over before this window, so before every later one
+            heapq.heappop(active)
+        visible[w] = sorted(i for _, i in active if events[i].start_ms < end_ms)
+    return visible
+
+def parse_ass_time(timestamp: str) -> int:
+    """ ASS time (H:MM:SS.cc) in ms """
+    h, m, rest = timestamp.split(':')
+    sec, _, frac = rest.partition('.')
+    return ((int(h) * 60 + int(m)) * 60 + int(sec)) * 1000 + int(frac or 0) * 10
 
 def format_ms(ms):
+    """ ASS timestamp H:MM:SS.cc (centiseconds) """
     seconds, ms = divmod(ms, 1000)
     minutes, seconds = divmod(seconds, 60)
     hours, minutes = divmod(minutes, 60)
-    return f"{hours}:{minutes:02}:{seconds:02}.{ms:02}"
\ No newline at end of file
+    return f"{hours}:{minutes:02}:{seconds:02}.{ms // 10:02}"
+
+def format_ms_many(ms: np.ndarray) -> List[str]:
+    """ format_ms over a whole column of timestamps: the divisions run on the array, only the formatting per item """
+    seconds, rest = np.divmod(np.asarray(ms, dtype=np.int64), 1000)
+    minutes, seconds = np.divmod(seconds, 60)
+    hours, minutes = np.divmod(minutes, 60)
+    return [f"{h}:{m:02}:{s:02}.{cs:02}" for h, m, s, cs in zip(hours.tolist(), minutes.tolist(), seconds.tolist(),
+                                                                (rest // 10).tolist())]
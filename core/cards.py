@@ -0,0 +1,33 @@
+""" Placeholder cards: solid-colour PNGs standing in for rendered images in previews """
+
+import colorsys
+import hashlib
+import os
+import struct
+import zlib
+from pathlib import Path
+from typing import Tuple
+
+# Bump when cards change so cached preview videos are rebuilt
+CARD_VERSION = 1
+
+def card_colour(text: str) -> Tuple[int, int, int]:
+    """ Muted colour picked by a hash of text, so segments with different prompts are told apart at a glance """
+    hue = int.from_bytes(hashlib.sha256(text.encode()).digest()[:2], 'big') / 65536
+    return tuple(round(c * 255) for c in colorsys.hsv_to_rgb(hue, 0.45, 0.55))
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def write_card(path: Path, width: int, height: int, colour: Tuple[int, int, int]):
+    """ Write a width x height PNG of one colour; replaces path rather than writing through a cache hard link """
+    row = b'\x00' + bytes(colour) * width  # Filter type 0 + RGB pixels
+    compressor = zlib.compressobj()
+    data = b''.join(compressor.compress(row) for _ in range(height)) + compressor.flush()
+    tmp = Path(path).with_suffix('.part.png')
+    with open(tmp, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(_chunk(b'IDAT', data))
+        f.write(_chunk(b'IEND', b''))
+    os.replace(tmp, path)
@@ -0,0 +1,108 @@
+""" Columnar stores: transcript Lines (and Segments, see segmenter) as packed int64 columns plus one text buffer """
+
+import io
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Iterator, List, Type, Union
+import numpy as np
+from core.transcript_parser import Line
+
+class TupleStore(Sequence):
+    """
+    Read-only sequence of NamedTuples (ITEM) stored column-wise: every field
+    but the last is an int64 NumPy array, the last (text) is a span
+    [text_start, text_end) of one shared string buffer. Stores packed by
+    from_items join the texts with single spaces, so the text of consecutive
+    items i..j is one slice of the buffer; other stores (segments) may point
+    into a buffer they share. Items are built on access; the store itself holds
+    a handful of objects however long it is.
+    """
+
+    ITEM: Type = None
+
+    def __init__(self, columns: List[np.ndarray], text: str, text_start: np.ndarray, text_end: np.ndarray):
+        self.columns = columns
+        self.buffer = text
+        self.text_start = text_start
+        self.text_end = text_end
+        for name, column in zip(self.ITEM._fields, columns):
+            setattr(self, name, column)
+
+    @classmethod
+    def from_items(cls, items: Iterable) -> 'TupleStore':
+        """ Pack items (any iterable of ITEM-like tuples); a store of this type is returned as is """
+        if isinstance(items, cls):
+            return items
+        width = len(cls.ITEM._fields) - 1
+        columns = [array('q') for _ in range(width)]
+        offsets = array('q', [0])
+        text = io.StringIO()
+        position = 0
+        for item in items:
+            for column, value in zip(columns, item):
+                column.append(value)
+            if position:
+                text.write(' ')
+            text.write(item[width])
+            position += len(item[width]) + 1
+            offsets.append(position)
+        offsets = np.frombuffer(offsets, dtype=np.int64)
+        return cls([np.frombuffer(column, dtype=np.int64) if column else np.zeros(0, dtype=np.int64)
+                    for column in columns], text.getvalue(), offsets[:-1], offsets[1:] - 1)
+
+    def __len__(self) -> int:
+        return len(self.text_start)
+
+    def text(self, i: int) -> str:
+        return self.buffer[self.text_start[i]:self.text_end[i]]
+
+    def joined_text(self, start: int, stop: int, limit: int = None) -> str:
+        """
+        ' '.join of the texts of items start..stop-1 (at most limit characters)
+        as one slice of the buffer; only for stores packed by from_items
+        """
+        end = self.text_end[stop - 1] if stop > start else self.text_start[start]
+        if limit is not None:
+            end = min(end, self.text_start[start] + limit)
+        return self.buffer[self.text_start[start]:end]
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(f"{type(self).__name__} index out of range")
+        return self.ITEM(*(int(column[i]) for column in self.columns), self.text(i))
+
+    def __iter__(self) -> Iterator:
+        buffer = self.buffer
+        for start, end, *values in zip(self.text_start.tolist(), self.text_end.tolist(),
+                                       *(column.tolist() for column in self.columns)):
+            yield self.ITEM(*values, buffer[start:end])
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (Sequence, TupleStore)) or isinstance(other, (str, bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({len(self)} items, {self.nbytes} bytes)"
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes held by the columns, the text spans and the (possibly shared) text buffer """
+        return (sum(column.nbytes for column in self.columns) + self.text_start.nbytes + self.text_end.nbytes
+                + len(self.buffer.encode('utf-8')))
+
+class LineStore(TupleStore):
+    """ Transcript Lines: start_ms / end_ms columns and the text buffer """
+    ITEM = Line
+
+def int_column(items: Iterable, field: str) -> np.ndarray:
+    """ One integer field of items as an int64 array (a view for stores) """
+    column = getattr(items, field, None)
+    if isinstance(column, np.ndarray):
+        return column
+    return np.fromiter((getattr(item, field) for item in items), dtype=np.int64)
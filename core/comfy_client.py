@@ -1,57 +1,496 @@
 """ ComfyUI client module """
 
 import json
-import requests
+import re
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from config import TIMEOUT_COMFY_SEC, BATCH_SIZE
-from typing import List, Dict
+from config import (TIMEOUT_COMFY_SEC, RETRY_COMFY, BATCH_SIZE, COMFY_MAX_IN_FLIGHT, COMFY_POLL_SEC, COMFY_HTTP_TIMEOUT_SEC,
+                    COMFY_QUEUE_PROBE_SEC, COMFY_HEALTH_SEC)
+from typing import Any, List, Dict, NamedTuple, Optional, Tuple, Union
+from core.metrics import bind, timed_call
+from core.stage_cache import digest_json, link_or_copy
 
-class ComfyClient:
-    def __init__(self, comfy_url: str, output_dir: Path):
-        self.url = comfy_url
-        self.output_dir = output_dir
-        self.output_dir.mkdir(exist_ok=True)
+# /queue health probes give up sooner than render requests
+PROBE_TIMEOUT_SEC = 5
+
+class ImageJob(NamedTuple):
+    segment_index: int
+    positive: str
+    negative: str
+    seed: int
+
+class WorkflowTemplate:
+    """
+    ComfyUI API graph compiled once into its placeholder slots.
+
+    A string input that is exactly "$NAME" takes the raw value (so "$WIDTH"
+    becomes a real number); "$NAME" inside a longer string is substituted as text.
+    """
+
+    PLACEHOLDER = re.compile(r'\$([A-Z_]+)')
+    # Loader inputs naming the checkpoint, VAE, LoRA... files a workflow renders with
+    MODEL_INPUTS = ('ckpt_name', 'unet_name', 'vae_name', 'clip_name', 'lora_name', 'control_net_name')
+
+    def __init__(self, graph: Dict):
+        self.graph = graph
+        # (node_id, input_key, [literal, name, literal, name, ..., literal])
+        self.slots: List[Tuple[str, str, List[str]]] = []
+        for node_id, node in graph.items():
+            for key, value in node.get('inputs', {}).items():
+                if isinstance(value, str) and '$' in value:
+                    parts = self.PLACEHOLDER.split(value)
+                    if len(parts) > 1:
+                        self.slots.append((node_id, key, parts))
+        self._node_ids = sorted({node_id for node_id, _, _ in self.slots})
+        self.digest = digest_json(graph)
+        self.models = sorted({value for node in graph.values() for key, value in node.get('inputs', {}).items()
+                              if key in self.MODEL_INPUTS and isinstance(value, str)})
+
+    @classmethod
+    def load(cls, path: Path) -> 'WorkflowTemplate':
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def fill(self, values: Dict[str, Any]) -> Dict:
+        """ Return a graph with every slot filled; nodes without slots are shared, not copied """
+        graph = dict(self.graph)
+        for node_id in self._node_ids:
+            node = graph[node_id] = dict(graph[node_id])
+            node['inputs'] = dict(node['inputs'])
+        for node_id, key, parts in self.slots:
+            if len(parts) == 3 and not parts[0] and not parts[2] and parts[1] in values:
+                value = values[parts[1]]
+            else:
+                value = ''.join(str(values[p]) if i % 2 and p in values else (p if i % 2 == 0 else f"${p}")
+                                for i, p in enumerate(parts))
+            graph[node_id]['inputs'][key] = value
+        return graph
+
+class _CompletionListener(threading.Thread):
+    """ Follows ComfyUI's /ws event stream and records finished prompt ids """
+
+    def __init__(self, ws):
+        super().__init__(daemon=True)
+        self.ws = ws
+        self.alive = True
+        self._lock = threading.Lock()
+        self._events: Dict[str, threading.Event] = {}
+
+    def _event(self, prompt_id: str) -> threading.Event:
+        with self._lock:
+            return self._events.setdefault(prompt_id, threading.Event())
+
+    def run(self):
+        try:
+            while True:
+                message = self.ws.recv()
+                if not isinstance(message, str):
+                    continue  # Binary preview frames
+                message = json.loads(message)
+                data = message.get('data') or {}
+                prompt_id = data.get('prompt_id')
+                if not prompt_id:
+                    continue
+                finished = (message.get('type') == 'executing' and data.get('node') is None) \
+                    or message.get('type') in ('execution_success', 'execution_error', 'execution_interrupted')
+                if finished:
+                    self._event(prompt_id).set()
+        except Exception:
+            pass
+        finally:
+            self.alive = False
+
+    def wait(self, prompt_id: str, timeout: float) -> bool:
+        return self._event(prompt_id).wait(timeout)
+
+    def forget(self, prompt_id: str):
+        with self._lock:
+            self._events.pop(prompt_id, None)
+
+    def close(self):
+        try:
+            self.ws.shutdown()  # close() would block waiting on the reader thread's socket
+        except Exception:
+            pass
+
+class ComfyNode:
+    """
+    One ComfyUI server: a keep-alive HTTP session, its /ws completion
+    listener, health (from /queue probes and failed requests) and throughput.
+    """
+
+    def __init__(self, url: str, client_id: str, use_websocket: bool = True, poll_interval: float = COMFY_POLL_SEC,
+                 pool_size: int = COMFY_MAX_IN_FLIGHT, http_timeout: float = COMFY_HTTP_TIMEOUT_SEC):
+        self.url = url.rstrip('/')
+        self.client_id = client_id
+        self.use_websocket = use_websocket
+        self.poll_interval = poll_interval
+        self.http_timeout = http_timeout
+        import requests  # Loaded with the first client, so ImageJob users (e.g. resumed runs) skip it
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size) + 2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self.healthy = True  # Until a probe or a request says otherwise
+        self.error: Optional[Exception] = None
+        self.checked = -float('inf')  # When /queue was last probed
+        self.queue_depth = 0  # Prompts queued or running at that probe
+        self.sent = 0  # Prompts sent since that probe
+        self.finished = 0  # ... and finished since
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.moved = 0  # Jobs moved to another node after this one went down
+        self.render_sec = 0.0
+        self.first_sent: Optional[float] = None
+        self._listener: Optional[_CompletionListener] = None
+        if use_websocket:
+            self._connect_websocket()
+
+    def _connect_websocket(self):
+        """ Subscribe to completion events; falls back to polling /history if unavailable """
+        try:
+            import websocket
+            ws_url = f"{self.url.replace('http', 'ws', 1)}/ws?clientId={self.client_id}"
+            ws = websocket.create_connection(ws_url, timeout=5)
+            ws.settimeout(None)
+        except Exception:
+            return
+        self._listener = _CompletionListener(ws)
+        self._listener.start()
+
+    def close(self):
+        if self._listener:
+            self._listener.close()
+            self._listener = None
+        self.session.close()
+
+    @property
+    def load(self) -> int:
+        """ Prompts on the server now: its last reported queue depth plus what was sent and finished since, at least ours in flight """
+        return max(self.queue_depth + self.sent - self.finished, self.in_flight)
+
+    def probe(self, timeout: float = PROBE_TIMEOUT_SEC) -> bool:
+        """ Refresh the queue depth from /queue; marks the node up or down """
+        import requests
+        try:
+            response = self.session.get(f"{self.url}/queue", timeout=timeout)
+            response.raise_for_status()
+            queue = response.json()
+            depth = len(queue.get('queue_running', [])) + len(queue.get('queue_pending', []))
+        except (requests.RequestException, ValueError) as e:
+            self.mark_down(e)
+            return False
+        with self._lock:
+            revived = not self.healthy
+            self.queue_depth, self.sent, self.finished = depth, 0, 0
+            self.healthy, self.error, self.checked = True, None, time.monotonic()
+        if revived and self.use_websocket and (self._listener is None or not self._listener.alive):
+            self._connect_websocket()
+        return True
+
+    def mark_down(self, error: Exception, moved: bool = False):
+        """ Take the node out of rotation until a probe succeeds; moved: a job on it goes to another node """
+        with self._lock:
+            self.healthy, self.error, self.checked = False, error, time.monotonic()
+            self.moved += moved
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.sent += 1
+            if self.first_sent is None:
+                self.first_sent = time.monotonic()
+
+    def end(self, ok: bool, seconds: float):
+        with self._lock:
+            self.in_flight -= 1
+            self.finished += 1
+            if ok:
+                self.completed += 1
+                self.render_sec += seconds
+            else:
+                self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = time.monotonic() - self.first_sent if self.first_sent is not None else 0
+            return {"url": self.url, "healthy": self.healthy, "completed": self.completed, "failed": self.failed,
+                    "moved": self.moved, "in_flight": self.in_flight, "render_sec": round(self.render_sec, 3),
+                    "images_per_min": round(self.completed * 60 / elapsed, 2) if elapsed > 0 else 0.0}
 
     def queue_prompt(self, prompt: Dict) -> str:
-        response = requests.post(f"{self.url}/prompt", json=prompt)
+        response = self.session.post(f"{self.url}/prompt", json=prompt, timeout=self.http_timeout)
+        response.raise_for_status()
         return response.json()['prompt_id']
 
-    def wait_for_completion(self, prompt_id: str, client_id: str) -> bool:
-        ws_url = f"{self.url.replace('http', 'ws')}/ws?clientId={client_id}"
-        # Note: WebSocket handling would require websocket-client lib, simplified for text.
-        # In real, use websocket-client to listen for 'execution_end'
-        time.sleep(5)  # Placeholder, simulate
-        return True
+    def get_history(self, prompt_id: str) -> Optional[Dict]:
+        """ History entry for prompt_id, or None while it is still queued/running """
+        response = self.session.get(f"{self.url}/history/{prompt_id}", timeout=self.http_timeout)
+        response.raise_for_status()
+        return response.json().get(prompt_id)
+
+    def wait_for_completion(self, prompt_id: str, timeout: float = TIMEOUT_COMFY_SEC) -> Dict:
+        """ Block until prompt_id finishes and return its history entry """
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"ComfyUI prompt {prompt_id} did not finish within {timeout}s")
+                listener = self._listener
+                signalled = False
+                if listener is not None and listener.alive:
+                    # Re-check history now and then in case an event was missed
+                    signalled = listener.wait(prompt_id, min(remaining, max(self.poll_interval, 1.0) * 10))
+                    if not signalled and not listener.alive:
+                        continue
+                else:
+                    time.sleep(min(remaining, self.poll_interval))
+                entry = self.get_history(prompt_id)
+                if entry is not None and self._is_finished(entry):
+                    return entry
+                if signalled:
+                    # The event stays set while history catches up; poll at the normal pace meanwhile
+                    time.sleep(min(max(0.0, deadline - time.monotonic()), self.poll_interval))
+        finally:
+            if self._listener is not None:
+                self._listener.forget(prompt_id)
+
+    @staticmethod
+    def _is_finished(entry: Dict) -> bool:
+        status = entry.get('status') or {}
+        if status.get('status_str') == 'error':
+            raise RuntimeError(f"ComfyUI execution failed: {status.get('messages')}")
+        return status.get('completed', True) or bool(entry.get('outputs'))
+
+    def download_image(self, image: Dict, dest: Path) -> Path:
+        """ Stream an output image from /view into dest """
+        params = {'filename': image['filename'], 'subfolder': image.get('subfolder', ''), 'type': image.get('type', 'output')}
+        tmp = dest.with_suffix(dest.suffix + '.part')
+        with self.session.get(f"{self.url}/view", params=params, stream=True, timeout=self.http_timeout) as response:
+            response.raise_for_status()
+            with open(tmp, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+        tmp.replace(dest)
+        return dest
+
+class ComfyClient:
+    """
+    Renders on one or more ComfyUI servers. Each image goes to the healthy
+    node with the shortest queue (from its /queue depth, refreshed at most
+    every probe_interval seconds, plus prompts sent since). A node that stops
+    answering is marked down and re-probed after health_interval seconds; a
+    job whose node goes down mid-render is moved to another one.
+    """
+
+    def __init__(self, comfy_url: Union[str, List[str]], output_dir: Path,
+                 template_path: Path = Path('workflows/comfy_template.json'), client_id: str = None,
+                 use_websocket: bool = True, poll_interval: float = COMFY_POLL_SEC,
+                 probe_interval: float = COMFY_QUEUE_PROBE_SEC, health_interval: float = COMFY_HEALTH_SEC,
+                 pool_size: int = COMFY_MAX_IN_FLIGHT):
+        urls = [comfy_url] if isinstance(comfy_url, str) else list(comfy_url)
+        if not urls:
+            raise ValueError("No ComfyUI URL given")
+        self.output_dir = output_dir
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.template = WorkflowTemplate.load(template_path)
+        self.client_id = client_id or uuid.uuid4().hex
+        self.probe_interval = probe_interval
+        self.health_interval = health_interval
+        self.nodes = [ComfyNode(url, self.client_id, use_websocket, poll_interval, pool_size) for url in urls]
+        self._lock = threading.Lock()
+
+    def close(self):
+        for node in self.nodes:
+            node.close()
+
+    def pick_node(self) -> ComfyNode:
+        """ The healthy node with the least load; raises ConnectionError when none answers """
+        now = time.monotonic()
+        for node in self.nodes:
+            if now - node.checked >= (self.probe_interval if node.healthy else self.health_interval):
+                node.probe()
+        healthy = [node for node in self.nodes if node.healthy]
+        if not healthy:
+            # All down: give each one another chance right away rather than failing on stale state
+            healthy = [node for node in self.nodes if node.probe()]
+        if not healthy:
+            import requests
+            raise requests.ConnectionError("No ComfyUI server reachable: " +
+                                           "; ".join(f"{node.url}: {node.error}" for node in self.nodes))
+        with self._lock:
+            node = min(healthy, key=lambda n: (n.load, n.in_flight))
+            node.begin()
+            return node
+
+    def node_stats(self) -> List[Dict[str, Any]]:
+        """ Health and throughput of each node """
+        return [node.stats() for node in self.nodes]
+
+    @staticmethod
+    def output_images(entry: Dict) -> List[Dict]:
+        return [img for node in entry.get('outputs', {}).values() for img in node.get('images', [])]
+
+    def image_path(self, segment_index: int) -> Path:
+        return self.output_dir / f"seg_{segment_index:03d}.png"
+
+    def generate_image(self, positive: str, negative: str, seed: int, segment_index: int = 0, width=1920, height=1080,
+                       steps=30, cfg=6.5, sampler="euler", scheduler="normal", timeout: float = TIMEOUT_COMFY_SEC,
+                       dest: Path = None) -> Path:
+        """ Render one image and save it as dest (default images/seg_NNN.png) """
+        import requests
+        graph = self.build_graph(positive, negative, width, height, seed, steps, cfg, sampler, scheduler, segment_index)
+        deadline = time.monotonic() + timeout
+        for attempt in range(len(self.nodes)):
+            node = self.pick_node()
+            t0 = time.monotonic()
+            try:
+                path = self._render(node, graph, dest or self.image_path(segment_index), deadline - t0)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # The node is gone (or hangs): take the job elsewhere while any other node answers
+                node.end(False, time.monotonic() - t0)
+                move = attempt < len(self.nodes) - 1 and any(n.healthy for n in self.nodes if n is not node)
+                node.mark_down(e, moved=move)
+                if not move:
+                    raise
+                continue
+            except Exception:
+                node.end(False, time.monotonic() - t0)
+                raise
+            node.end(True, time.monotonic() - t0)
+            return path
+
+    def _render(self, node: ComfyNode, graph: Dict, dest: Path, timeout: float) -> Path:
+        with timed_call("comfyui", "prompt"):
+            prompt_id = node.queue_prompt(graph)
+        with timed_call("comfyui", "render"):
+            entry = node.wait_for_completion(prompt_id, timeout)
+        images = self.output_images(entry)
+        if not images:
+            raise RuntimeError(f"ComfyUI prompt {prompt_id} produced no images")
+        with timed_call("comfyui", "view"):
+            return node.download_image(images[0], dest)
+
+    def build_graph(self, positive: str, negative: str, width, height, seed, steps, cfg, sampler, scheduler,
+                    segment_index=0, batch_size=BATCH_SIZE) -> Dict:
+        graph = self.template.fill({
+            'POSITIVE_PROMPT': positive,
+            'NEGATIVE_PROMPT': negative,
+            'WIDTH': width,
+            'HEIGHT': height,
+            'SEED': seed,
+            'STEPS': steps,
+            'CFG': cfg,
+            'SAMPLER_NAME': sampler,
+            'SCHEDULER': scheduler,
+            'BATCH_SIZE': batch_size,
+            'INDEX': f"{segment_index:03d}",
+        })
+        return {"prompt": graph, "client_id": self.client_id}
+
+class ComfyScheduler:
+    """ Keeps up to max_in_flight ComfyUI prompts queued per node so no GPU idles between segments """
+
+    def __init__(self, client: ComfyClient, max_in_flight: int = COMFY_MAX_IN_FLIGHT, retries: int = RETRY_COMFY,
+                 timeout: float = TIMEOUT_COMFY_SEC, library=None, **render_args):
+        self.client = client
+        self.max_in_flight = max(1, max_in_flight) * len(client.nodes)
+        self.retries = retries
+        self.timeout = timeout
+        self.library = library
+        self.render_args = render_args
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    def _run_job(self, job: ImageJob, output_dir: Optional[Path]) -> Path:
+        """ Render one job, retrying up to self.retries times within self.timeout seconds """
+        dest = output_dir / f"seg_{job.segment_index:03d}.png" if output_dir else None
+        deadline = time.monotonic() + self.timeout
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise TimeoutError(f"segment {job.segment_index} exceeded {self.timeout}s")
+                return self.client.generate_image(job.positive, job.negative, job.seed, job.segment_index,
+                                                  timeout=remaining, dest=dest, **self.render_args)
+            except Exception:
+                if attempt == self.retries or deadline - time.monotonic() <= 0:
+                    raise
+
+    def run(self, jobs: List[ImageJob], on_done=None, output_dir: Path = None,
+            scope: Dict = None) -> Tuple[Dict[int, Path], Dict[int, Exception]]:
+        """
+        Render all jobs into output_dir (default: the client's). Returns
+        ({segment_index: image_path}, {segment_index: error}); on_done(job, path, source)
+        is called as each image lands, with source "rendered", "duplicate" or "library".
+
+        Jobs with identical prompts are rendered once and the image copied to
+        the rest. With a library, a prompt similar enough to a stored image of
+        the same scope (render settings, workflow, models, negative prompt plus
+        scope, e.g. style) reuses it; new renders are added to it. Concurrent run() calls (e.g. one per
+        episode in batch mode) share the same max_in_flight slots.
+        """
+        dest_dir = output_dir or self.client.output_dir
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        groups: Dict[Tuple[str, str], List[ImageJob]] = {}
+        for job in jobs:
+            groups.setdefault((job.positive, job.negative), []).append(job)
+        leaders = [group[0] for group in groups.values()]
+        template = self.client.template
+        scope = {**self.render_args, "workflow": template.digest, "models": template.models, **(scope or {})}
+        matches = {}
+        if self.library is not None:
+            by_negative: Dict[str, List[ImageJob]] = {}
+            for leader in leaders:
+                by_negative.setdefault(leader.negative, []).append(leader)
+            for negative, group in by_negative.items():
+                found = self.library.find_many([job.positive for job in group], {**scope, "negative": negative})
+                matches.update(((job.positive, job.negative), match) for job, match in zip(group, found))
+        done, failed = {}, {}
+
+        def finish(leader: ImageJob, src: Path, source: str):
+            for job in groups[(leader.positive, leader.negative)]:
+                dest = dest_dir / f"seg_{job.segment_index:03d}.png"
+                if src != dest:
+                    link_or_copy(src, dest, copy=True)  # Run-dir images are user-editable
+                done[job.segment_index] = dest
+                if on_done:
+                    on_done(job, dest, source if job is leader else "duplicate")
+
+        to_render = []
+        for leader in leaders:
+            match = matches.get((leader.positive, leader.negative))
+            if match:
+                finish(leader, match.path, "library")
+            else:
+                to_render.append(leader)
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix='comfy')
+            futures = {self._pool.submit(bind(self._run_job), job, dest_dir): job for job in to_render}
+        for future in as_completed(futures):
+            leader = futures[future]
+            try:
+                path = future.result()
+            except Exception as e:
+                for job in groups[(leader.positive, leader.negative)]:
+                    failed[job.segment_index] = e
+                continue
+            if self.library is not None:
+                self.library.add(path, leader.positive, leader.negative, leader.seed, {**scope, "negative": leader.negative})
+            finish(leader, path, "rendered")
+        return done, failed
 
-    def generate_image(self, positive: str, negative: str, seed: int, width=1920, height=1080, steps=30, cfg=6.5):
-        with open('workflows/comfy_template.json') as f:
-            template = json.load(f)
-
-        graph = self.build_graph(positive, negative, width, height, seed, steps, cfg, "euler", "normal")
-        prompt_id = self.queue_prompt(graph)
-        self.wait_for_completion(prompt_id, "test_client")
-
-        # Copy generated images to output_dir
-        # Placeholder: Only build_graph is implemented
-
-    def build_graph(self, positive: str, negative: str, width, height, seed, steps, cfg, sampler, scheduler) -> Dict:
-        with open('workflows/comfy_template.json') as f:
-            graph = json.load(f)
-        # Replace variables
-        for node in graph.values():
-            if 'inputs' in node:
-                for key, value in node['inputs'].items():
-                    if isinstance(value, str):
-                        value = value.replace('$POSITIVE_PROMPT', positive)
-                        value = value.replace('$NEGATIVE_PROMPT', negative)
-                        value = value.replace('$WIDTH', str(width))
-                        value = value.replace('$HEIGHT', str(height))
-                        value = value.replace('$SEED', str(seed))
-                        value = value.replace('$STEPS', str(steps))
-                        value = value.replace('$CFG', str(cfg))
-                        value = value.replace('$SAMPLER_NAME', sampler)
-                        value = value.replace('$SCHEDULER', scheduler)
-                        value = value.replace('$INDEX', str(segment_index))  # Need to pass segment_index
-                        node['inputs'][key] = value
-        return {"prompt": graph, "client_id": "test_client"}
\ No newline at end of file
+    def close(self):
+        """ Stop the worker threads and the client's event stream """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+        self.client.close()
@@ -0,0 +1,159 @@
+""" Image library: every rendered image, searchable by prompt similarity across episodes """
+
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+from core.stage_cache import digest_file, digest_json, link_or_copy
+
+# Hashed TF-IDF feature space (unigrams + bigrams); stored images keep only their own buckets
+INDEX_DIM = 2048
+TOKEN = re.compile(r"[a-z0-9]+")
+# Prompts scored together; bounds the (prompts x stored features) products to a few MB per stored image batch
+QUERY_BATCH = 32
+
+class Match(NamedTuple):
+    path: Path
+    prompt: str
+    seed: int
+    score: float
+
+def _features(text: str) -> Dict[int, float]:
+    """ Sublinear term frequencies of the prompt's words and word pairs, hashed into INDEX_DIM buckets """
+    words = TOKEN.findall(text.lower())
+    counts: Dict[int, int] = {}
+    for term in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        bucket = zlib.crc32(term.encode()) % INDEX_DIM
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return {bucket: 1 + math.log(n) for bucket, n in counts.items()}
+
+class _ScopeIndex:
+    """ The stored images of one scope with their prompts' hashed features, kept sparse (bucket, weight) per row """
+
+    def __init__(self):
+        self.files: List[str] = []
+        self.prompts: List[str] = []
+        self.seeds: List[int] = []
+        self._rows: List[int] = []
+        self._buckets: List[int] = []
+        self._weights: List[float] = []
+        self._arrays = None  # (rows, buckets, weights, document frequencies) as arrays, rebuilt after an add
+
+    def add(self, file: str, prompt: str, seed: int):
+        row = len(self.files)
+        self.files.append(file)
+        self.prompts.append(prompt)
+        self.seeds.append(seed)
+        for bucket, weight in _features(prompt).items():
+            self._rows.append(row)
+            self._buckets.append(bucket)
+            self._weights.append(weight)
+        self._arrays = None
+
+    def scores(self, prompts: List[str]) -> np.ndarray:
+        """ (len(prompts), rows) cosine similarities of the TF-IDF vectors, idf taken over this scope's rows """
+        if self._arrays is None:
+            buckets = np.array(self._buckets, dtype=np.int64)
+            self._arrays = (np.array(self._rows, dtype=np.int64), buckets, np.array(self._weights, dtype=np.float32),
+                            np.bincount(buckets, minlength=INDEX_DIM))
+        rows, buckets, weights, df = self._arrays
+        idf = (np.log((1 + len(self.files)) / (1 + df)) + 1).astype(np.float32)
+        stored = weights * idf[buckets]
+        stored_norms = np.sqrt(np.bincount(rows, weights=stored * stored, minlength=len(self.files)))
+        queries = np.zeros((len(prompts), INDEX_DIM), dtype=np.float32)
+        for q, prompt in enumerate(prompts):
+            for bucket, weight in _features(prompt).items():
+                queries[q, bucket] = weight
+        queries *= idf
+        # Rows' buckets are stored row after row: a dot product is the sum over one row's run of entries
+        dots = np.zeros((len(prompts), len(self.files)), dtype=np.float32)
+        if len(rows):
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            for q in range(0, len(prompts), QUERY_BATCH):
+                products = queries[q:q + QUERY_BATCH][:, buckets] * stored
+                dots[q:q + QUERY_BATCH, rows[starts]] = np.add.reduceat(products, starts, axis=1)
+        return dots / np.maximum(stored_norms * np.linalg.norm(queries, axis=1)[:, None], 1e-12)
+
+class ImageLibrary:
+    """
+    Rendered images with their prompt, negative prompt, seed and render scope
+    (size, style, workflow, models, negative prompt, sampler settings...).
+    find_many() returns, per prompt, the most similar stored image from the
+    same scope whose cosine TF-IDF similarity reaches threshold; with no
+    threshold (the default) nothing is reused. A scope's rows are read from
+    SQLite the first time it is searched, so opening the library costs nothing
+    however many images it holds. With read=False (--force) nothing is found
+    but renders are still added. Safe to share between threads.
+    """
+
+    def __init__(self, root: Path, threshold: Optional[float] = None, read: bool = True):
+        self.root = Path(root)
+        self.threshold = threshold
+        self.read = read
+        self.hits = 0
+        (self.root / "images").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.root / "library.sqlite", check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS images ("
+                        "id INTEGER PRIMARY KEY, file TEXT NOT NULL, prompt TEXT NOT NULL, negative TEXT NOT NULL, "
+                        "seed INTEGER NOT NULL, scope TEXT NOT NULL, scope_key TEXT NOT NULL, created REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS images_scope ON images (scope_key)")
+        self.db.commit()
+        self._scopes: Dict[str, _ScopeIndex] = {}  # Loaded on first search
+
+    def _scope(self, scope_key: str) -> _ScopeIndex:
+        index = self._scopes.get(scope_key)
+        if index is None:
+            index = self._scopes[scope_key] = _ScopeIndex()
+            for file, prompt, seed in self.db.execute("SELECT file, prompt, seed FROM images WHERE scope_key = ? "
+                                                      "ORDER BY id", (scope_key,)):
+                index.add(file, prompt, seed)
+        return index
+
+    def find_many(self, prompts: List[str], scope: Dict) -> List[Optional[Match]]:
+        """ Best stored image per prompt within scope, or None below threshold """
+        if not self.read or self.threshold is None or not prompts:
+            return [None] * len(prompts)
+        with self._lock:
+            index = self._scope(digest_json(scope))
+            if not index.files:
+                return [None] * len(prompts)
+            scores = index.scores(prompts)
+            matches = []
+            for q, b in enumerate(scores.argmax(axis=1)):
+                score = float(scores[q, b])
+                if score < self.threshold:
+                    matches.append(None)
+                    continue
+                matches.append(Match(self.root / "images" / index.files[b], index.prompts[b], index.seeds[b], score))
+                self.hits += 1
+            return matches
+
+    def add(self, image: Path, prompt: str, negative: str, seed: int, scope: Dict):
+        """ Store a rendered image (content-addressed, so re-adding the same file is cheap) """
+        name = f"{digest_file(image)}{image.suffix}"
+        dest = self.root / "images" / name
+        if not dest.exists():
+            link_or_copy(image, dest, copy=True)  # image stays editable in the run directory
+        with self._lock:
+            scope_key = digest_json(scope)
+            self.db.execute("INSERT INTO images (file, prompt, negative, seed, scope, scope_key, created) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (name, prompt, negative, seed, json.dumps(scope, sort_keys=True), scope_key, time.time()))
+            self.db.commit()
+            if scope_key in self._scopes:
+                self._scopes[scope_key].add(name, prompt, seed)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self):
+        self.db.close()
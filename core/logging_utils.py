@@ -1,15 +1,15 @@
 """ Logging utilities """
 
-import json
 import logging
 from pathlib import Path
-from typing import Dict, Any
 
-def setup_logger(log_file: Path) -> logging.Logger:
-    logger = logging.getLogger('podcast_factory')
+def setup_logger(log_file: Path, name: str = 'podcast_factory') -> logging.Logger:
+    """ Logger writing to log_file; calling it again for the same file reuses the existing handler """
+    logger = logging.getLogger(name)
     logger.setLevel(logging.INFO)
-    handler = logging.FileHandler(log_file, mode='a')
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    logger.addHandler(handler)
-    # For JSONL, we could override but simplified
-    return logger
\ No newline at end of file
+    path = str(Path(log_file).resolve())
+    if not any(isinstance(h, logging.FileHandler) and h.baseFilename == path for h in logger.handlers):
+        handler = logging.FileHandler(path, mode='a')
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    return logger
@@ -0,0 +1,172 @@
+""" Run metrics: per-stage timing spans and external call latencies as JSONL and Prometheus text """
+
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_current: ContextVar[Optional['RunMetrics']] = ContextVar('run_metrics', default=None)
+_stage: ContextVar[Optional[str]] = ContextVar('run_stage', default=None)
+
+def _cpu_seconds() -> Tuple[float, float]:
+    """ (this process, waited-for child processes such as ffmpeg) CPU seconds """
+    t = os.times()
+    return t.user + t.system, t.children_user + t.children_system
+
+class RunMetrics:
+    """
+    Recorder for one pipeline run. Every span and external call is appended to
+    path as one JSON object per line, tagged with the run id and labels
+    (e.g. episode), and aggregated for summary() / write_prometheus().
+
+    CPU times are process-wide, so they overlap between episodes that run
+    concurrently in batch mode; child CPU only counts processes that have
+    exited (ffmpeg) within the span.
+    """
+
+    def __init__(self, path: Path, **labels):
+        self.path = Path(path)
+        self.labels = labels
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a')
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.calls: Dict[tuple, Dict[str, float]] = {}
+
+    def _write(self, event: Dict[str, Any]):
+        line = json.dumps({"run": self.run_id, **self.labels, "ts": round(time.time(), 3), **event})
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        """
+        Time a pipeline stage. Yields a dict for the stage to fill in counters
+        (items, cache_hits, ...); numeric ones are summed into the totals.
+        """
+        record: Dict[str, Any] = {"items": 0, "cache_hits": 0, **fields}
+        cpu0, child0 = _cpu_seconds()
+        t0 = time.monotonic()
+        token = _stage.set(stage)
+        status = "ok"
+        try:
+            yield record
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            _stage.reset(token)
+            cpu1, child1 = _cpu_seconds()
+            timing = {"wall_sec": round(time.monotonic() - t0, 6), "cpu_sec": round(cpu1 - cpu0, 6),
+                      "child_cpu_sec": round(child1 - child0, 6)}
+            self._write({"type": "span", "stage": stage, "status": status, **timing, **record})
+            with self._lock:
+                totals = self.stages.setdefault(stage, {})
+                for key, value in {**timing, **record}.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        totals[key] = round(totals.get(key, 0) + value, 6)
+
+    def record_call(self, service: str, operation: str, latency: float, ok: bool, stage: Optional[str] = None):
+        self._write({"type": "call", "service": service, "operation": operation, "stage": stage,
+                     "latency_sec": round(latency, 6), "ok": ok})
+        with self._lock:
+            totals = self.calls.setdefault((service, operation), {"count": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+            totals["count"] += 1
+            totals["errors"] += not ok
+            totals["seconds"] = round(totals["seconds"] + latency, 6)
+            totals["max"] = round(max(totals["max"], latency), 6)
+
+    def summary(self) -> Dict[str, Any]:
+        """ Totals per stage and per (service, operation); also written as the run's last JSONL line by close() """
+        with self._lock:
+            return {"wall_sec": round(time.monotonic() - self._t0, 6),
+                    "stages": {stage: dict(totals) for stage, totals in self.stages.items()},
+                    "calls": {f"{service}.{operation}": dict(totals) for (service, operation), totals in self.calls.items()}}
+
+    def write_prometheus(self, path: Path):
+        """ Write the totals in Prometheus text format (atomically, for node_exporter's textfile collector) """
+        def labels(**extra) -> str:
+            pairs = {**self.labels, **extra}
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in pairs.values())
+            return '{' + ','.join(f'{k}="{v}"' for k, v in zip(pairs, escaped)) + '}'
+
+        summary = self.summary()
+        out = []
+
+        def metric(name: str, help_text: str, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} gauge")
+            out.extend(f"{name}{label} {value:g}" for label, value in samples)
+
+        metric("podcast_episode_wall_seconds", "Wall time of the last pipeline run", [(labels(), summary["wall_sec"])])
+        metric("podcast_episode_last_run_timestamp_seconds", "Start time of the last pipeline run",
+               [(labels(), self.started)])
+        for key, name, help_text in (("wall_sec", "podcast_stage_wall_seconds", "Wall time per pipeline stage"),
+                                     ("cpu_sec", "podcast_stage_cpu_seconds", "Process CPU time per pipeline stage"),
+                                     ("child_cpu_sec", "podcast_stage_child_cpu_seconds",
+                                      "CPU time of child processes (ffmpeg) per pipeline stage"),
+                                     ("items", "podcast_stage_items", "Items processed per pipeline stage"),
+                                     ("cache_hits", "podcast_stage_cache_hits", "Items answered from a cache per pipeline stage")):
+            metric(name, help_text, [(labels(stage=stage), totals[key])
+                                     for stage, totals in summary["stages"].items() if key in totals])
+        calls = [(key.split('.', 1), totals) for key, totals in summary["calls"].items()]
+        for key, name, help_text in (("count", "podcast_external_calls", "External calls (OpenAI, ComfyUI, ffmpeg)"),
+                                     ("errors", "podcast_external_call_errors", "Failed external calls"),
+                                     ("seconds", "podcast_external_call_seconds", "Total latency of external calls"),
+                                     ("max", "podcast_external_call_max_seconds", "Slowest external call")):
+            metric(name, help_text, [(labels(service=service, operation=operation), totals[key])
+                                     for (service, operation), totals in calls])
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text('\n'.join(out) + '\n')
+        os.replace(tmp, path)
+
+    def close(self):
+        self._write({"type": "summary", **self.summary()})
+        with self._lock:
+            self._file.close()
+
+@contextmanager
+def activate(metrics: RunMetrics):
+    """ Make metrics the recorder for timed_call() in this context (and in threads started via bind()) """
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+def current() -> Optional[RunMetrics]:
+    return _current.get()
+
+@contextmanager
+def timed_call(service: str, operation: str):
+    """ Record the latency of one external call against the active run, if any """
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    t0 = time.monotonic()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        metrics.record_call(service, operation, time.monotonic() - t0, ok, _stage.get())
+
+def bind(fn: Callable) -> Callable:
+    """
+    Wrap fn to run in a copy of the caller's context, so work handed to a
+    thread pool still reports to the caller's run and stage.
+    """
+    context = copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
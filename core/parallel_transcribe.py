@@ -0,0 +1,99 @@
+""" Chunk-parallel and batched transcription """
+
+import os
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.audio import decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from config import (TRANSCRIBE_CHUNK_SEC, TRANSCRIBE_THREADS_PER_WORKER, TRANSCRIBE_BATCH_SIZE,
+                    TRANSCRIBE_VAD_MIN_SILENCE_MS)
+from core.transcript_parser import Line, checkpointed, resolve_device, segment_to_line
+
+SAMPLING_RATE = 16000
+SAMPLES_PER_MS = SAMPLING_RATE // 1000
+
+def plan_chunks(speech: List[Dict[str, int]], total_samples: int, target_samples: int) -> List[Tuple[int, int]]:
+    """
+    Split [0, total_samples) into chunks of roughly target_samples, cutting only
+    in the middle of silences between VAD speech regions (so no word is split).
+    A chunk runs long when there is no silence to cut at.
+    """
+    chunks = []
+    start = 0
+    for prev, nxt in zip(speech, speech[1:]):
+        cut = (prev['end'] + nxt['start']) // 2
+        if cut - start >= target_samples:
+            chunks.append((start, cut))
+            start = cut
+    if total_samples > start:
+        chunks.append((start, total_samples))
+    return chunks
+
+# Per-process model, loaded once by the pool initializer
+_CHUNK_MODEL = None
+
+def _init_chunk_worker(model_size: str, cpu_threads: int):
+    global _CHUNK_MODEL
+    _CHUNK_MODEL = WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads)
+
+def _transcribe_chunk(audio, offset_ms: int) -> List[Line]:
+    """ Transcribe one chunk and shift its timestamps back onto the episode timeline """
+    chunk_end_ms = offset_ms + len(audio) // SAMPLES_PER_MS
+    segments, _ = _CHUNK_MODEL.transcribe(audio)
+    lines = []
+    for segment in segments:
+        line = segment_to_line(segment)
+        lines.append(Line(line.start_ms + offset_ms, min(line.end_ms + offset_ms, chunk_end_ms), line.text))
+    return lines
+
+def iter_transcription_parallel(audio_path: Path, model_size="large-v3", workers: Optional[int] = None,
+                                chunk_sec: float = TRANSCRIBE_CHUNK_SEC, checkpoint: Path = None,
+                                executor: Optional[Executor] = None) -> Iterator[Line]:
+    """
+    CPU transcription split at silences and spread over a process pool.
+
+    Each process loads its own int8 model with TRANSCRIBE_THREADS_PER_WORKER
+    CTranslate2 threads. Chunks are yielded in audio order, with at most two
+    per worker decoded and queued at a time to bound memory.
+    """
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // TRANSCRIBE_THREADS_PER_WORKER)
+
+    def decode(resume_ms: int) -> Iterator[Line]:
+        audio = decode_audio(str(audio_path), sampling_rate=SAMPLING_RATE)[resume_ms * SAMPLES_PER_MS:]
+        speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=TRANSCRIBE_VAD_MIN_SILENCE_MS), sampling_rate=SAMPLING_RATE)
+        chunks = plan_chunks(speech, len(audio), int(chunk_sec * SAMPLING_RATE))
+        pool = executor or ProcessPoolExecutor(workers, initializer=_init_chunk_worker,
+                                               initargs=(model_size, TRANSCRIBE_THREADS_PER_WORKER))
+        try:
+            pending = deque()
+            for start, end in chunks:
+                pending.append(pool.submit(_transcribe_chunk, audio[start:end], resume_ms + start // SAMPLES_PER_MS))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            if executor is None:
+                pool.shutdown(cancel_futures=True)
+
+    return checkpointed(audio_path, model_size, checkpoint, decode)
+
+def iter_transcription_batched(audio_path: Path, model_size="large-v3", device="auto", model=None,
+                               batch_size: int = TRANSCRIBE_BATCH_SIZE, checkpoint: Path = None) -> Iterator[Line]:
+    """ Transcription through faster-whisper's BatchedInferencePipeline (VAD chunks decoded in batches) """
+    def decode(resume_ms: int) -> Iterator[Line]:
+        nonlocal model
+        if model is None:
+            device_, compute_type = resolve_device(device)
+            model = WhisperModel(model_size, device=device_, compute_type=compute_type)
+        audio = decode_audio(str(audio_path), sampling_rate=SAMPLING_RATE)[resume_ms * SAMPLES_PER_MS:]
+        segments, _ = BatchedInferencePipeline(model).transcribe(audio, batch_size=batch_size)
+        for segment in segments:
+            line = segment_to_line(segment)
+            yield Line(line.start_ms + resume_ms, line.end_ms + resume_ms, line.text)
+
+    return checkpointed(audio_path, model_size, checkpoint, decode)
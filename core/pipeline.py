@@ -0,0 +1,146 @@
+""" Stage-graph executor: items stream between stages through bounded queues on an asyncio loop """
+
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+from config import PIPELINE_QUEUE_SIZE
+from core.metrics import bind
+
+_END = object()  # An upstream stage (or the source) has no more items
+_CLOSED = object()  # All upstreams ended; tells a stage's sibling workers to stop
+
+class Stage(NamedTuple):
+    name: str
+    fn: Callable[[Any], Any]
+    inputs: Tuple[str, ...] = ()  # Upstream stages; none means the stage is fed from the source
+    workers: int = 1
+    executor: str = "thread"  # "thread", "process" (fn and items must pickle) or "inline" (quick fns, run on the loop)
+    fan_out: bool = False  # fn returns an iterable of items (possibly empty) instead of one item
+
+class Pipeline:
+    """
+    Runs a graph of stages over a stream of items. Each stage has a bounded
+    input queue and `workers` concurrent calls of fn; every result is passed
+    on to the stages listing it in inputs as soon as it is ready, so a slow
+    stage holds back its upstreams (backpressure) without stalling the rest.
+    A stage with several inputs gets (input name, item) pairs. Results of
+    stages nothing consumes are collected and returned by run().
+
+    The first error cancels the run: queued items are dropped, calls already
+    running in a pool are waited for, and the error is raised. With span
+    (e.g. RunMetrics.span), each stage runs inside span(name) for its whole
+    lifetime and count() adds to that span's counters.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = PIPELINE_QUEUE_SIZE,
+                 span: Optional[Callable[[str], Any]] = None):
+        names = [stage.name for stage in stages]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Duplicate stage names: {names}")
+        for stage in stages:
+            unknown = set(stage.inputs) - set(names)
+            if unknown:
+                raise ValueError(f"Stage {stage.name} reads from unknown stages: {sorted(unknown)}")
+            if stage.executor not in ("thread", "process", "inline"):
+                raise ValueError(f"Unknown executor for stage {stage.name}: {stage.executor}")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.span = span
+        self.records: Dict[str, Dict[str, Any]] = {stage.name: {} for stage in stages}
+        self._lock = threading.Lock()
+
+    def count(self, stage: str, key: str, n: int = 1):
+        """ Add n to a counter of stage's span (safe from any worker thread) """
+        with self._lock:
+            record = self.records[stage]
+            record[key] = record.get(key, 0) + n
+
+    def run(self, source: Iterable) -> Dict[str, List]:
+        """ Push every item of source through the graph; returns {sink stage: [results in completion order]} """
+        pools: Dict[str, Executor] = {}
+        for stage in self.stages:
+            if stage.executor == "thread":
+                pools[stage.name] = ThreadPoolExecutor(max(1, stage.workers), thread_name_prefix=stage.name)
+            elif stage.executor == "process":
+                pools[stage.name] = ProcessPoolExecutor(max(1, stage.workers))
+        try:
+            return asyncio.run(self._run(iter(source), pools))
+        finally:
+            for pool in pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
+
+    async def _run(self, source, pools: Dict[str, Executor]) -> Dict[str, List]:
+        queues = {stage.name: asyncio.Queue(self.queue_size) for stage in self.stages}
+        consumers = {stage.name: [s.name for s in self.stages if stage.name in s.inputs] for stage in self.stages}
+        outputs = {stage.name: [] for stage in self.stages if not consumers[stage.name]}
+        fed = [stage.name for stage in self.stages if not stage.inputs]
+
+        async def feed():
+            loop = asyncio.get_running_loop()
+            while True:
+                # The source may block (e.g. a generator reading a file), so it is pulled from a thread
+                item = await loop.run_in_executor(None, next, source, _END)
+                for name in fed:
+                    await queues[name].put((None, item))
+                if item is _END:
+                    return
+
+        tasks = [asyncio.ensure_future(feed())]
+        tasks += [asyncio.ensure_future(self._run_stage(stage, queues, consumers, outputs, pools.get(stage.name)))
+                  for stage in self.stages]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return outputs
+
+    async def _run_stage(self, stage: Stage, queues: Dict[str, asyncio.Queue], consumers: Dict[str, List[str]],
+                         outputs: Dict[str, List], pool: Optional[Executor]):
+        queue = queues[stage.name]
+        upstreams = len(stage.inputs) or 1
+        ended = 0
+        loop = asyncio.get_running_loop()
+
+        async def emit(value):
+            if stage.name in outputs:
+                outputs[stage.name].append(value)
+            for name in consumers[stage.name]:
+                await queues[name].put((stage.name, value))
+
+        async def worker(fn):
+            nonlocal ended
+            while True:
+                source, item = await queue.get()
+                if item is _CLOSED:
+                    queue.put_nowait((None, _CLOSED))  # A slot is free: this worker just took one
+                    return
+                if item is _END:
+                    ended += 1
+                    if ended == upstreams:
+                        await queue.put((None, _CLOSED))
+                    continue
+                arg = (source, item) if len(stage.inputs) > 1 else item
+                if pool is None:
+                    result = fn(arg)
+                else:
+                    result = await loop.run_in_executor(pool, fn, arg)
+                for value in result if stage.fan_out else [result]:
+                    await emit(value)
+
+        with self.span(stage.name) if self.span else nullcontext({}) as record:
+            try:
+                # Bound inside the span so calls made by fn in the pool report to this stage
+                fn = stage.fn if stage.executor == "process" else bind(stage.fn)
+                await asyncio.gather(*[worker(fn) for _ in range(1 if pool is None else max(1, stage.workers))])
+            finally:
+                with self._lock:
+                    record.update(self.records[stage.name])
+        for name in consumers[stage.name]:
+            await queues[name].put((stage.name, _END))
@@ -0,0 +1,73 @@
+""" Persistent per-segment prompt cache (SQLite) """
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable
+
+class PromptCache:
+    """
+    LLM results keyed on (segment text, global style, negative style, model,
+    system prompt version), so unchanged segments cost nothing on re-runs and
+    across re-cut episodes. Least recently used entries beyond max_entries are
+    evicted. With read=False (--force) lookups always miss but results are still
+    stored. Safe to share between threads.
+    """
+
+    def __init__(self, path: Path, max_entries: int = 100000, read: bool = True):
+        self.path = Path(path)
+        self.read = read
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS prompts ("
+                        "key TEXT PRIMARY KEY, result TEXT NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS prompts_last_used ON prompts (last_used)")
+        self.db.commit()
+
+    @staticmethod
+    def key(text: str, global_style: str, negative_style: str, model: str, system_prompt_version: int) -> str:
+        payload = json.dumps([text, global_style, negative_style, model, system_prompt_version], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Dict]:
+        """ Cached results for the keys present; touches them for LRU """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys) if self.read else 0, 500):  # Stay under SQLite's bound-parameter limit
+                chunk = keys[i:i + 500]
+                rows = self.db.execute(f"SELECT key, result FROM prompts WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                found.update((key, json.loads(result)) for key, result in rows)
+            now = time.time()
+            self.db.executemany("UPDATE prompts SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.db.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, results: Dict[str, Dict]):
+        """ Store results (prompt, negative_prompt, caption) and evict beyond max_entries """
+        if not results:
+            return
+        now = time.time()
+        with self._lock:
+            self.db.executemany("INSERT OR REPLACE INTO prompts (key, result, last_used) VALUES (?, ?, ?)",
+                                [(key, json.dumps(result, ensure_ascii=False), now) for key, result in results.items()])
+            self.db.execute("DELETE FROM prompts WHERE key IN (SELECT key FROM prompts ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                            (self.max_entries,))
+            self.db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+
+    def close(self):
+        self.db.close()
@@ -1,17 +1,29 @@
 """ Prompt generator module """
 
 import json
+import threading
 import time
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 from core.segmenter import Segment
-from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL, RETRY_LLM
+from core.prompt_cache import PromptCache
+from core.metrics import bind, timed_call
+from core.backends import LLM_CLIENTS
+from config import OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_MODEL, RETRY_LLM, LLM_BATCH_TOKENS, LLM_MAX_WORKERS, LLM_BACKEND
 
-def generate_prompts(segments: List[Segment], global_style: str, negative_style: str, retry=int(RETRY_LLM)) -> Dict[str, Any]:
-    import openai
+# Bump whenever the system prompt changes so cached prompts are regenerated
+SYSTEM_PROMPT_VERSION = 1
 
-    client = openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+# Rough token estimate: ~4 characters per token, plus the "<index>: " prefix and newline
+CHARS_PER_TOKEN = 4
+SEGMENT_OVERHEAD_TOKENS = 4
+# Completion tokens needed per result (prompt + negative + caption + JSON keys)
+RESULT_TOKENS = 120
+# Base delay before retrying segments that came back missing or invalid
+BACKOFF_SEC = 1.0
 
-    system_prompt = f"""You are generating stable-diffusion prompts for video segments.
+def build_system_prompt(global_style: str, negative_style: str) -> str:
+    return f"""You are generating stable-diffusion prompts for video segments.
 Rules:
 - Incorporate the provided GLOBAL_STYLE into each prompt: "{global_style}"
 - Never include text/typography in the image. Avoid words, logos, watermarks.
@@ -20,22 +32,161 @@ Rules:
 Return strict JSON with the shape:
 {{"results": [{{"segment_index": <int>, "prompt": "<positive prompt>", "negative_prompt": "<negative or global default>", "caption": "<short hook>"}}, ...]}}"""
 
-    user_prompt = f"Segments:\n" + '\n'.join(f"{s.index}: {s.text}" for s in segments)
+def estimate_tokens(segment: Segment) -> int:
+    return len(segment.text) // CHARS_PER_TOKEN + SEGMENT_OVERHEAD_TOKENS + RESULT_TOKENS
 
-    for attempt in range(retry + 1):
+def batch_segments(segments: List[Segment], max_tokens: int = LLM_BATCH_TOKENS) -> List[List[Segment]]:
+    """ Split segments into consecutive batches whose estimated request + response fits max_tokens """
+    batches, batch, used = [], [], 0
+    for seg in segments:
+        cost = estimate_tokens(seg)
+        if batch and used + cost > max_tokens:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(seg)
+        used += cost
+    if batch:
+        batches.append(batch)
+    return batches
+
+class _RateLimiter:
+    """ Shared cooldown: a 429 on one worker pauses every worker until Retry-After has passed """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._not_before = 0.0
+        self.throttled = 0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._not_before - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def backoff(self, seconds: float):
+        with self._lock:
+            self.throttled += 1
+            self._not_before = max(self._not_before, time.monotonic() + seconds)
+
+class LLMBudget:
+    """
+    Concurrency and rate-limit state shared by generate_prompts calls, so
+    several episodes running at once stay within one request budget.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_WORKERS):
+        self.slots = threading.BoundedSemaphore(max(1, max_in_flight))
+        self.limiter = _RateLimiter()
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """ Retry-After (seconds) from a 429 response, if the server sent one """
+    response = getattr(error, 'response', None)
+    if response is None or getattr(response, 'status_code', None) != 429:
+        return None
+    value = response.headers.get('retry-after-ms')
+    if value:
         try:
-            response = client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}],
-                response_format={"type": "json_object"}
-            )
-            result = json.loads(response.choices[0].message.content)
-            return result
+            return float(value) / 1000
+        except ValueError:
+            pass
+    try:
+        return float(response.headers.get('retry-after', ''))
+    except ValueError:
+        return 1.0
+
+def _valid_result(item: Any, wanted: set) -> bool:
+    return bool(isinstance(item, dict) and isinstance(item.get('segment_index'), int) and item['segment_index'] in wanted
+                and isinstance(item.get('prompt'), str) and item['prompt'].strip()
+                and isinstance(item.get('caption'), str) and item['caption'].strip())
+
+def _request_batch(client, system_prompt: str, batch: List[Segment], negative_style: str, budget: LLMBudget) -> Dict[int, Dict]:
+    """ One chat completion for a batch; returns the valid results keyed by segment_index """
+    user_prompt = f"Segments:\n" + '\n'.join(f"{s.index}: {s.text}" for s in batch)
+    with budget.slots:
+        budget.limiter.wait()
+        try:
+            with timed_call("openai", "chat.completions"):
+                response = client.chat.completions.create(
+                    model=OPENAI_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}],
+                    response_format={"type": "json_object"}
+                )
         except Exception as e:
-            if attempt == retry:
-                raise
-            time.sleep((2 ** attempt))
+            delay = _retry_after(e)
+            if delay is not None:
+                budget.limiter.backoff(delay)
+            raise
+    results = json.loads(response.choices[0].message.content).get('results', [])
+    wanted = {s.index for s in batch}
+    merged = {}
+    for item in results if isinstance(results, list) else []:
+        if _valid_result(item, wanted):
+            if not isinstance(item.get('negative_prompt'), str) or not item['negative_prompt'].strip():
+                item['negative_prompt'] = negative_style
+            merged[item['segment_index']] = item
+    return merged
+
+def openai_client():
+    """ OpenAI SDK client; retries and backoff are handled per batch, not by the SDK """
+    import openai
+    return openai.OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL, max_retries=0)
+
+def generate_prompts(segments: List[Segment], global_style: str, negative_style: str, retry=int(RETRY_LLM),
+                     max_tokens: int = LLM_BATCH_TOKENS, max_workers: int = LLM_MAX_WORKERS,
+                     cache: Optional[PromptCache] = None, budget: Optional[LLMBudget] = None) -> Dict[str, Any]:
+    """
+    Generate prompts in token-budgeted batches sent concurrently.
+
+    Segments found in cache are answered without calling the API. Results are
+    merged by segment_index; after each round only segments with missing or
+    invalid results are re-batched and retried. A 429 pauses all workers for
+    Retry-After and halves the worker count for the next round. Pass a shared
+    budget to bound requests across concurrent calls.
+    """
+    merged: Dict[int, Dict] = {}
+    keys: Dict[int, str] = {}
+    if cache is not None:
+        keys = {s.index: cache.key(s.text, global_style, negative_style, OPENAI_MODEL, SYSTEM_PROMPT_VERSION) for s in segments}
+        cached = cache.get_many(keys.values())
+        for s in segments:
+            if keys[s.index] in cached:
+                merged[s.index] = {"segment_index": s.index, **cached[keys[s.index]]}
+    pending = [s for s in segments if s.index not in merged]
+    if not pending:
+        return {"results": [merged[s.index] for s in segments]}
+
+    client = LLM_CLIENTS.get(LLM_BACKEND)()
+    system_prompt = build_system_prompt(global_style, negative_style)
+    budget = budget or LLMBudget(max_workers)
+    limiter = budget.limiter
+    workers = max(1, max_workers)
+    last_error = None
+
+    for attempt in range(retry + 1):
+        batches = batch_segments(pending, max_tokens)
+        throttled = limiter.throttled
+        round_results: Dict[int, Dict] = {}
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches)), thread_name_prefix='llm') as pool:
+            futures = [pool.submit(bind(_request_batch), client, system_prompt, batch, negative_style, budget) for batch in batches]
+            for future in futures:
+                try:
+                    round_results.update(future.result())
+                except Exception as e:
+                    last_error = e
+        merged.update(round_results)
+        if cache is not None:
+            cache.put_many({keys[i]: {k: r[k] for k in ('prompt', 'negative_prompt', 'caption')} for i, r in round_results.items()})
+        pending = [s for s in pending if s.index not in merged]
+        if not pending:
+            return {"results": [merged[s.index] for s in segments]}
+        if limiter.throttled > throttled:
+            workers = max(1, workers // 2)
+        elif attempt < retry:
+            time.sleep(BACKOFF_SEC * 2 ** attempt)
 
-    raise ValueError("LLM failed after retries")
\ No newline at end of file
+    raise ValueError(f"LLM failed after retries for {len(pending)} segments "
+                     f"(first: {pending[0].index}); last error: {last_error}")
@@ -1,45 +1,274 @@
 """ Segmenter module """
 
 import json
-from config import MAX_SEG_TEXT_CHARS
+import math
+import re
+from collections import defaultdict
+from itertools import chain
+import numpy as np
+from config import MAX_SEG_TEXT_CHARS, SEGMENT_MAX_SEC, SEGMENT_PAUSE_MS, SEGMENT_SIMILARITY
+from core.columnar import LineStore, TupleStore
 from core.transcript_parser import Line
-from typing import List, NamedTuple
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
 from pathlib import Path
 
+# Windows shorter than this (other than the first) are folded into the previous segment
+MIN_SEGMENT_MS = 3000
+# Adaptive segmentation: a line ending in one of these closes a sentence
+SENTENCE_ENDS = '.!?…'
+# Words compared for similarity; shorter ones are mostly function words
+SIMILARITY_WORD = re.compile(r"[^\W\d_]{4,}")
+
 class Segment(NamedTuple):
     index: int
     start_ms: int
     end_ms: int
     text: str
 
-def segment_transcript(lines: List[Line], segment_seconds: int, max_chars: int, output_file: Path = None) -> List[Segment]:
-    total_duration = lines[-1].end_ms if lines else 0
-    segment_ms = segment_seconds * 1000
-    segments = []
+class SegmentStore(TupleStore):
+    """ Segments: index / start_ms / end_ms columns and the text buffer """
+    ITEM = Segment
+
+def _bucket_line(buckets: Dict[int, List[Line]], line: Line, segment_ms: int):
+    """ Append line to every window it overlaps by at least 1 ms """
+    if line.end_ms > line.start_ms:
+        for w in range(max(line.start_ms, 0) // segment_ms, (line.end_ms - 1) // segment_ms + 1):
+            buckets[w].append(line)
 
-    for i in range(0, total_duration, segment_ms):
-        start_ms = i
-        end_ms = min(i + segment_ms, total_duration)
-        if end_ms - start_ms < 3000 and i > 0:  # Merge if <3s and not first
-            # Replace last segment with extended version (NamedTuple is immutable)
+def _cut_windows(buckets: Dict[int, List[Line]], first: int, stop: int, segment_ms: int,
+                 total_duration: int, max_chars: int) -> List[Segment]:
+    """ Build Segments for windows [first, stop), consuming their buckets """
+    segments = []
+    for w in range(first, stop):
+        start_ms = w * segment_ms
+        end_ms = min(start_ms + segment_ms, total_duration)
+        bucket = buckets.pop(w, ())
+        if end_ms - start_ms < MIN_SEGMENT_MS and w > 0:  # Merge if <3s and not first
             prev = segments[-1]
             segments[-1] = Segment(index=prev.index, start_ms=prev.start_ms, end_ms=end_ms, text=prev.text)
             continue
+        # Lines starting at or after the end of the transcript never overlap the last window
+        text = ' '.join(line.text for line in bucket if line.start_ms < end_ms)[:max_chars]
+        segments.append(Segment(index=w, start_ms=start_ms, end_ms=end_ms, text=text))
+    return segments
+
+def write_segments(segments: List[Segment], output_file: Path):
+    """ Write segments to JSON """
+    data = [{"index": s.index, "start_ms": s.start_ms, "end_ms": s.end_ms, "text": s.text} for s in segments]
+    with open(output_file, 'w') as f:
+        json.dump(data, f, indent=2)
+
+def load_segments(segments_file: Path) -> SegmentStore:
+    """ Read segments written by write_segments """
+    with open(segments_file) as f:
+        return SegmentStore.from_items(Segment(**item) for item in json.load(f))
+
+def _window_lines(store: LineStore, segment_ms: int, n_windows: int, total_duration: int):
+    """
+    (line ids, bounds): the ids of the lines overlapping each window by at least
+    1 ms, grouped by window in transcript order; window w owns
+    ids[bounds[w]:bounds[w + 1]]. Lines starting at or after the end of the
+    transcript overlap no window.
+    """
+    ids = np.flatnonzero((store.end_ms > store.start_ms) & (store.start_ms < total_duration))
+    first = np.maximum(store.start_ms[ids], 0) // segment_ms
+    last = np.minimum((store.end_ms[ids] - 1) // segment_ms, n_windows - 1)
+    counts = np.maximum(last - first + 1, 0)
+    # One (line, window) pair per overlap: each line repeated once per window it spans
+    pair_lines = np.repeat(ids, counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    pair_windows = np.repeat(first, counts) + np.arange(len(pair_lines)) - starts
+    order = np.argsort(pair_windows, kind='stable')
+    bounds = np.searchsorted(pair_windows[order], np.arange(n_windows + 1))
+    return pair_lines[order], bounds
+
+def segment_transcript(lines: Iterable[Line], segment_seconds: int, max_chars: int, output_file: Path = None) -> SegmentStore:
+    """
+    Cut the transcript into fixed segment_seconds windows.
+
+    Lines are packed into a LineStore and assigned to the windows they overlap
+    with array operations (one stable sort), without per-line Python objects.
+    Lines need not be sorted; text inside a window keeps transcript order.
+    """
+    store = LineStore.from_items(lines)
+    total_duration = int(store.end_ms[-1]) if len(store) else 0
+    segment_ms = segment_seconds * 1000
+    n_windows = len(range(0, total_duration, segment_ms))
+    line_ids, bounds = _window_lines(store, segment_ms, n_windows, total_duration)
+
+    windows = np.arange(n_windows)
+    window_start = windows * segment_ms
+    window_end = np.minimum(window_start + segment_ms, total_duration)
+    # Windows shorter than MIN_SEGMENT_MS (other than the first) extend the previous segment
+    kept = np.flatnonzero((window_end - window_start >= MIN_SEGMENT_MS) | (windows == 0))
+    segment_end = window_end[np.append(kept[1:] - 1, n_windows - 1)[:len(kept)]]
+    columns = [kept, window_start[kept], segment_end]
+
+    lo, hi = bounds[kept], bounds[kept + 1]
+    if len(line_ids):
+        first, last = line_ids[np.minimum(lo, len(line_ids) - 1)], line_ids[hi - 1]
+    else:
+        first = last = np.zeros(len(kept), dtype=np.int64)
+    if np.all((hi == lo) | (last - first == hi - lo - 1)):
+        # Every segment covers a run of consecutive lines (ordered, non-overlapping captions): its text
+        # is one slice of the line buffer, so the segments share it instead of copying
+        text_start = np.where(hi > lo, store.text_start[first], 0)
+        text_end = np.where(hi > lo, np.minimum(store.text_end[last], text_start + max_chars), 0)
+        segments = SegmentStore(columns, store.buffer, text_start, text_end)
+    else:
+        texts = (' '.join(store.text(i) for i in line_ids[bounds[w]:bounds[w + 1]])[:max_chars] for w in kept)
+        segments = SegmentStore.from_items(Segment(*values, text) for *values, text in zip(*columns, texts))
+
+    if output_file:
+        write_segments(segments, output_file)
+
+    return segments
+
+def iter_segments(lines: Iterable[Line], segment_seconds: int, max_chars: int = MAX_SEG_TEXT_CHARS) -> Iterator[Segment]:
+    """
+    Streaming variant of segment_transcript.
+
+    Consumes lines as they arrive (e.g. straight from the transcriber) and yields
+    each Segment as soon as no later line can change it. Lines must be ordered
+    by start_ms. Yields exactly what segment_transcript returns for the same lines.
+    """
+    segment_ms = segment_seconds * 1000
+    buckets = defaultdict(list)
+    next_window = 0
+    last = None
+
+    for line in lines:
+        if last is not None and line.start_ms < last.start_ms:
+            raise ValueError(f"iter_segments needs lines ordered by start_ms ({line.start_ms} < {last.start_ms})")
+        last = line
+        _bucket_line(buckets, line, segment_ms)
+
+        # The transcript ends no earlier than this line starts. Window w is final
+        # once every overlapping line has arrived and window w+1 is known to be
+        # long enough not to be merged back into it.
+        if segment_ms >= MIN_SEGMENT_MS:
+            ready = (line.start_ms - MIN_SEGMENT_MS) // segment_ms
+            if ready > next_window:
+                yield from _cut_windows(buckets, next_window, ready, segment_ms, line.start_ms, max_chars)
+                next_window = ready
+
+    total_duration = last.end_ms if last else 0
+    yield from _cut_windows(buckets, next_window, len(range(0, total_duration, segment_ms)), segment_ms, total_duration, max_chars)
+
+def _sorted_lines(lines: Iterable[Line]) -> LineStore:
+    """ lines packed in start_ms order (stable), so every run of lines is one slice of the text buffer """
+    store = LineStore.from_items(lines)
+    if np.any(np.diff(store.start_ms) < 0):
+        store = LineStore.from_items(store[i] for i in np.argsort(store.start_ms, kind='stable').tolist())
+    return store
+
+def _unit_starts(store: LineStore, segment_ms: int, pause_ms: int) -> List[int]:
+    """
+    Index of the first line of each unit. A unit closes after the first line
+    that ends a sentence or is followed by a pause of pause_ms once it is
+    segment_ms long, and after any line once it is 2 * segment_ms long (for
+    transcripts without punctuation or pauses). The last unit is folded into
+    the previous one when shorter than MIN_SEGMENT_MS.
+    """
+    buffer = store.buffer
+    ends_sentence = np.array([end > start and buffer[end - 1] in SENTENCE_ENDS
+                              for start, end in zip(store.text_start.tolist(), store.text_end.tolist())], dtype=bool)
+    natural = (ends_sentence[:-1] | (store.start_ms[1:] - store.end_ms[:-1] >= pause_ms)).tolist()
+
+    starts, unit_start_ms = [0], 0
+    for i, next_start in enumerate(store.start_ms[1:].tolist()):
+        length = next_start - unit_start_ms
+        if length >= 2 * segment_ms or (natural[i] and length >= segment_ms):
+            starts.append(i + 1)
+            unit_start_ms = next_start
+    if len(starts) > 1 and int(store.end_ms.max()) - unit_start_ms < MIN_SEGMENT_MS:
+        starts.pop()
+    return starts
+
+def adjacent_similarity(texts: List[str]) -> np.ndarray:
+    """
+    TF-IDF cosine similarity of each text with the next (len(texts) - 1
+    values in [0, 1]), over words of 4+ letters. Term weights are computed
+    for all texts at once from sorted (text, term) keys, without building the
+    texts x vocabulary matrix.
+    """
+    n = len(texts)
+    vocab: Dict[str, int] = {}
+    words = [[vocab.setdefault(w, len(vocab)) for w in SIMILARITY_WORD.findall(text.lower())] for text in texts]
+    counts = np.array([len(w) for w in words], dtype=np.int64)
+    v = max(len(vocab), 1)
+    terms = np.fromiter(chain.from_iterable(words), dtype=np.int64, count=int(counts.sum()))
+    keys, tf = np.unique(np.repeat(np.arange(n, dtype=np.int64), counts) * v + terms, return_counts=True)
+    text_ids, term_ids = keys // v, keys % v
+    df = np.bincount(term_ids, minlength=v)
+    weight = tf * (np.log((1 + n) / (1 + df[term_ids])) + 1)
+    norm = np.sqrt(np.bincount(text_ids, weight ** 2, minlength=n))
+    # Where the same term occurs in the next text, its key is one row further on
+    nxt = np.minimum(np.searchsorted(keys, keys + v), max(len(keys) - 1, 0))
+    shared = np.flatnonzero(keys[nxt] == keys + v) if len(keys) else np.zeros(0, dtype=np.int64)
+    dot = np.bincount(text_ids[shared], weight[shared] * weight[nxt[shared]], minlength=n)[:-1]
+    denominator = norm[:-1] * norm[1:]
+    return np.divide(dot, denominator, out=np.zeros(max(n - 1, 0)), where=denominator > 0)
+
+def _merge_units(lengths: List[int], similarity: List[float], threshold: float, max_ms: int) -> List[int]:
+    """ First unit of each group: a unit joins the previous group when similar enough and the group stays within max_ms """
+    groups, length = [0], lengths[0]
+    for u in range(1, len(lengths)):
+        if similarity[u - 1] >= threshold and length + lengths[u] <= max_ms:
+            length += lengths[u]
+        else:
+            groups.append(u)
+            length = lengths[u]
+    return groups
+
+def adaptive_segments(lines: Iterable[Line], segment_seconds: int, max_chars: int, max_seconds: int = SEGMENT_MAX_SEC,
+                      pause_ms: int = SEGMENT_PAUSE_MS, similarity: float = SEGMENT_SIMILARITY,
+                      images_per_hour: Optional[float] = None, output_file: Path = None) -> SegmentStore:
+    """
+    Cut the transcript on pauses and sentence ends, then merge similar neighbours.
+
+    Units of at least segment_seconds end on a sentence end or a pause (see
+    _unit_starts); adjacent units whose adjacent_similarity reaches similarity
+    are merged into one segment of at most max_seconds. With images_per_hour,
+    the threshold is lowered until the episode fits that many segments per
+    hour, as far as max_seconds allows. Segments start where their first line
+    starts and cover the timeline without gaps; indexes are consecutive.
+    """
+    store = _sorted_lines(lines)
+    if not len(store):
+        return SegmentStore.from_items([])
+    total_duration = int(store.end_ms.max())
+    units = _unit_starts(store, segment_seconds * 1000, pause_ms)
+    bounds = units + [len(store)]
+    unit_start = np.append(0, store.start_ms[units[1:]])
+    lengths = (np.append(unit_start[1:], total_duration) - unit_start).tolist()
+    scores = adjacent_similarity([store.joined_text(a, b) for a, b in zip(bounds, bounds[1:])])
+    max_ms = max(max_seconds, segment_seconds) * 1000
 
-        text_parts = []
-        for line in lines:
-            if line.start_ms < end_ms and line.end_ms > start_ms:
-                overlap_start = max(start_ms, line.start_ms)
-                overlap_end = min(end_ms, line.end_ms)
-                if overlap_end > overlap_start:
-                    text_parts.append(line.text)
+    groups = _merge_units(lengths, scores.tolist(), similarity, max_ms)
+    limit = math.ceil(total_duration / 3_600_000 * images_per_hour) if images_per_hour else len(groups)
+    if len(groups) > limit:
+        # Lower thresholds allow more merges: binary search the highest one that fits the budget
+        thresholds = np.unique(scores[scores < similarity])[::-1].tolist()
+        lo, hi = 0, len(thresholds) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if len(_merge_units(lengths, scores.tolist(), thresholds[mid], max_ms)) <= limit:
+                hi = mid
+            else:
+                lo = mid + 1
+        if thresholds:
+            groups = _merge_units(lengths, scores.tolist(), thresholds[lo], max_ms)
 
-        full_text = ' '.join(text_parts)[:max_chars]
-        segments.append(Segment(index=i//segment_ms, start_ms=start_ms, end_ms=end_ms, text=full_text))
+    first = np.array([units[g] for g in groups], dtype=np.int64)
+    last = np.append(first[1:], len(store)) - 1
+    starts = np.append(0, store.start_ms[first[1:]])
+    text_start = store.text_start[first]
+    text_end = np.maximum(np.minimum(store.text_end[last], text_start + max_chars), text_start)
+    segments = SegmentStore([np.arange(len(first)), starts, np.append(starts[1:], total_duration)], store.buffer,
+                            text_start, text_end)
 
     if output_file:
-        data = [{"index": s.index, "start_ms": s.start_ms, "end_ms": s.end_ms, "text": s.text} for s in segments]
-        with open(output_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        write_segments(segments, output_file)
 
-    return segments
\ No newline at end of file
+    return segments
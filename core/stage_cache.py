@@ -0,0 +1,186 @@
+""" Content-addressed stage cache """
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+# Bump when a stage's output format changes so old entries stop matching
+CACHE_VERSION = 1
+
+def digest_file(path: Path) -> str:
+    """ sha256 of a file's bytes """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def digest_json(obj: Any) -> str:
+    """ sha256 of a JSON-serialisable value (key order independent) """
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+def link_or_copy(src: Path, dest: Path, copy: bool = False):
+    """ Hard-link src to dest (copy across filesystems, or always with copy), replacing dest atomically """
+    tmp = dest.with_name(f"{dest.name}.{os.getpid()}-{threading.get_ident()}.cache-tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        if copy:
+            shutil.copyfile(src, tmp)
+        else:
+            try:
+                os.link(src, tmp)
+            except OSError:
+                shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+class StageCache:
+    """
+    Stores each stage's output under a hash of its real inputs.
+
+    Layout: <root>/<stage>/<key><suffix>. Entries are immutable. Outputs are
+    materialised into the run directory by hard link, so writers must replace
+    (not truncate) files they produce; run_file_stage() takes care of that.
+    Editable outputs (prompts.json, captions.ass, images) are copied instead,
+    and with run_dir set the cache remembers what it last wrote there
+    (run_dir/STATE_FILE): a file changed since is a user edit, which fetch()
+    keeps rather than overwrite, so later stages are built from it.
+    """
+
+    STATE_FILE = ".stage_files.json"
+
+    def __init__(self, root: Path, read: bool = True, run_dir: Optional[Path] = None):
+        self.root = Path(root)
+        self.read = read
+        self.run_dir = Path(run_dir) if run_dir else None
+        self.hits = 0
+        self.misses = 0
+        self.edited = set()
+        self._lock = threading.Lock()
+        # {path relative to run_dir: [size, mtime_ns, sha256]} of editable files as last written
+        self._written: Dict[str, list] = {}
+        if self.run_dir and (self.run_dir / self.STATE_FILE).exists():
+            with open(self.run_dir / self.STATE_FILE) as f:
+                self._written = json.load(f)
+
+    def key(self, stage: str, **inputs) -> str:
+        return digest_json({"stage": stage, "version": CACHE_VERSION, **inputs})
+
+    def path(self, stage: str, key: str, suffix: str = '') -> Path:
+        return self.root / stage / f"{key}{suffix}"
+
+    def lookup(self, stage: str, key: str, suffix: str = '') -> Optional[Path]:
+        """ Cached entry for key, or None on a miss (or when reads are disabled, e.g. --force) """
+        path = self.path(stage, key, suffix)
+        if self.read and path.exists():
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def _name(self, path: Path) -> str:
+        path, root = Path(path).resolve(), self.run_dir.resolve()
+        return str(path.relative_to(root)) if root in path.parents else str(path)
+
+    def record(self, path: Path):
+        """ Note path as written by the pipeline (an editable output produced outside fetch/store, e.g. a card) """
+        if self.run_dir is None:
+            return
+        stat = path.stat()
+        entry = [stat.st_size, stat.st_mtime_ns, digest_file(path)]
+        with self._lock:
+            self._written[self._name(path)] = entry
+
+    def forget(self, path: Path):
+        """ Stop tracking path (e.g. a placeholder that the next run should replace) """
+        if self.run_dir is None:
+            return
+        with self._lock:
+            self._written.pop(self._name(path), None)
+
+    def is_edited(self, path: Path) -> bool:
+        """ True if path changed since the pipeline last wrote it; --force (read=False) discards edits """
+        if not self.read or self.run_dir is None or not path.exists():
+            return False
+        with self._lock:
+            entry = self._written.get(self._name(path))
+        if entry is None:
+            return False
+        stat = path.stat()
+        if [stat.st_size, stat.st_mtime_ns] == entry[:2]:
+            return False
+        return digest_file(path) != entry[2]
+
+    def fetch(self, stage: str, key: str, dest: Path, editable: bool = False) -> bool:
+        """
+        Materialise a cached entry at dest; False on a miss. An editable dest
+        is copied rather than linked, and one the user edited is kept as is
+        (counted as a hit and added to edited).
+        """
+        if editable and self.is_edited(dest):
+            with self._lock:
+                self.edited.add(dest)
+                self.hits += 1
+            return True
+        cached = self.lookup(stage, key, dest.suffix)
+        if cached is None:
+            return False
+        link_or_copy(cached, dest, copy=editable)
+        if editable:
+            self.record(dest)
+        return True
+
+    def store(self, stage: str, key: str, src: Path, editable: bool = False) -> Path:
+        """ Add src to the cache under key; an editable src is copied, so edits to it never reach the entry """
+        path = self.path(stage, key, src.suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(src, path, copy=editable)
+        if editable:
+            self.record(src)
+        return path
+
+    def run_file_stage(self, stage: str, key: str, dest: Path, build: Callable[[], bool], editable: bool = False) -> bool:
+        """
+        Produce dest for a single-file stage. On a hit the cached file is linked
+        (editable: copied) into place, and an edited editable dest is kept;
+        otherwise dest is removed, build() writes it and the result is stored
+        unless build() returns False (placeholder output). Returns True on a hit.
+        """
+        if self.fetch(stage, key, dest, editable):
+            return True
+        dest.unlink(missing_ok=True)
+        self.forget(dest)
+        if build() is not False:
+            self.store(stage, key, dest, editable)
+        return False
+
+    def save_state(self):
+        """ Write what the pipeline last wrote into run_dir, for the next run's is_edited() """
+        if self.run_dir is None:
+            return
+        with self._lock:
+            state = dict(self._written)
+        tmp = self.run_dir / f"{self.STATE_FILE}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.run_dir / self.STATE_FILE)
+
+    def load_json(self, stage: str, key: str) -> Optional[Any]:
+        cached = self.lookup(stage, key, '.json')
+        if cached is None:
+            return None
+        with open(cached) as f:
+            return json.load(f)
+
+    def save_json(self, stage: str, key: str, data: Any):
+        path = self.path(stage, key, '.json')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
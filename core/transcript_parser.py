@@ -1,61 +1,324 @@
 """ Transcript parser module """
 
 import json
+import mmap
+import os
 import re
+import sys
+import time
 from pathlib import Path
-from typing import List, NamedTuple
-from faster_whisper import WhisperModel
-import pysrt
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence
+from config import TRANSCRIBE_CHECKPOINT_SEC
+from core.backends import TRANSCRIBERS, TRANSCRIPT_FORMATS
 
 class Line(NamedTuple):
     start_ms: int
     end_ms: int
     text: str
 
+# Byte-order marks recognised at the start of an SRT file (utf-8 without one)
+SRT_BOMS = ((b'\xff\xfe\x00\x00', 'utf_32_le'), (b'\x00\x00\xfe\xff', 'utf_32_be'),
+            (b'\xff\xfe', 'utf_16_le'), (b'\xfe\xff', 'utf_16_be'), (b'\xef\xbb\xbf', 'utf_8'))
+SRT_TIME_SEP = re.compile(r'[:.,]')
+LEADING_INT = re.compile(r'^(\d+)')
+# [SPEAKER_XX] - HH:MM:SS.MMM followed by the turn's text, up to the next line starting with '['
+# (written greedily: the equivalent lazy .*? with a lookahead is several times slower)
+TXT_TURN = re.compile(rb'\[([^\]]+)\]\s*-\s*(\d{1,2}):(\d{2}):(\d{2})\.(\d{3})\s*((?:[^\n]+|\n(?!\[))*)')
+# Estimated duration of each line of a speaker turn
+TXT_LINE_MS = 3000
+JSON_READ_CHARS = 1 << 16
+
+def __getattr__(name):
+    # faster_whisper (and ctranslate2 under it) is imported when a model is first loaded, not with this module
+    if name == "WhisperModel":
+        from faster_whisper import WhisperModel
+        globals()[name] = WhisperModel
+        return WhisperModel
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def _whisper_model(*args, **kwargs):
+    """ Load a WhisperModel, looked up on the module so tests can swap it out """
+    return sys.modules[__name__].WhisperModel(*args, **kwargs)
+
+def _srt_int(digits: str) -> int:
+    try:
+        return int(digits)
+    except ValueError:
+        match = LEADING_INT.match(digits)
+        return int(match.group()) if match else 0
+
+def _srt_ms(timestamp: str) -> Optional[int]:
+    """ HH:MM:SS,mmm (any of : . , as separators) to ms, or None if it is not four fields """
+    parts = SRT_TIME_SEP.split(timestamp)
+    if len(parts) != 4:
+        return None
+    h, m, s, ms = map(_srt_int, parts)
+    return ((h * 60 + m) * 60 + s) * 1000 + ms
+
+def _srt_cue(block: List[str]) -> Optional[Line]:
+    """ One cue from its (right-stripped) lines, or None if it is malformed """
+    if len(block) < 2:
+        return None
+    if '-->' not in block[0]:
+        block = block[1:]  # Cue number
+    timestamps = block[0].split('-->')
+    if len(timestamps) != 2:
+        return None
+    start = _srt_ms(timestamps[0].strip())
+    end = _srt_ms(timestamps[1].lstrip().split(' ', 1)[0].strip())  # Drop X1:.. position info
+    if start is None or end is None:
+        return None
+    return Line(start, end, ' '.join(block[1:]).strip())
+
+def iter_srt(srt_path: Path) -> Iterator[Line]:
+    """
+    Stream Lines from an SRT file one cue at a time. Cues are separated by
+    blank lines; malformed cues are skipped. The encoding comes from the BOM
+    (utf-8 without one).
+    """
+    with open(srt_path, 'rb') as f:
+        head = f.read(4)
+    encoding = next((name for bom, name in SRT_BOMS if head.startswith(bom)), 'utf_8')
+    with open(srt_path, encoding=encoding) as f:
+        block: List[str] = []
+        for i, raw in enumerate(f):
+            if i == 0:
+                raw = raw.lstrip('\ufeff')
+            if raw.strip():
+                block.append(raw.rstrip())
+            elif block:
+                line = _srt_cue(block)
+                if line is not None:
+                    yield line
+                block = []
+        if block:
+            line = _srt_cue(block)
+            if line is not None:
+                yield line
+
 def parse_srt(srt_path: Path) -> List[Line]:
     """ Parse SRT file into Lines """
-    subs = pysrt.open(srt_path)
-    lines = []
-    for sub in subs:
-        text = sub.text.strip().replace('\n', ' ')
-        lines.append(Line(sub.start.ordinal, sub.end.ordinal, text))
-    return lines
+    return list(iter_srt(srt_path))
+
+def iter_json_transcript(json_path: Path, read_chars: int = JSON_READ_CHARS) -> Iterator[Line]:
+    """
+    Stream Lines from a JSON list of {"start", "end", "text"} items (seconds),
+    decoding one item at a time from a window of the file instead of loading
+    the whole document.
+    """
+    decoder = json.JSONDecoder()
+    with open(json_path) as f:
+        buf, pos, eof = '', 0, False
+
+        def next_char() -> str:
+            """ Next non-space character, reading on as needed ('' at end of file) """
+            nonlocal buf, pos, eof
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                buf, pos = f.read(read_chars), 0
+                eof = not buf
+
+        if next_char() != '[':
+            raise ValueError(f"{json_path} must contain a JSON list of transcript items")
+        pos += 1
+        if next_char() == ']':
+            return
+        while True:
+            while True:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    # An item running into the end of the window may be cut short (e.g. a number)
+                    if end < len(buf) or eof:
+                        break
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(max(read_chars, len(buf) - pos))  # Grow the window for items bigger than it
+                eof = not chunk
+                buf, pos = buf[pos:] + chunk, 0
+            # Rounded, not truncated: 64.731 * 1000 is 64730.999... in floating point
+            yield Line(round(item['start'] * 1000), round(item['end'] * 1000), item['text'].strip())
+            pos = end
+            separator = next_char()
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"{json_path}: expected ',' or ']' after transcript item")
+            pos += 1
+            next_char()
 
 def parse_json_transcript(json_path: Path) -> List[Line]:
     """ Parse JSON transcript (e.g., from OpenAI Whisper) """
-    with open(json_path) as f:
-        data = json.load(f)
-    lines = []
-    for item in data:
-        start_ms = int(item['start'] * 1000)
-        end_ms = int(item['end'] * 1000)
-        text = item['text'].strip()
-        lines.append(Line(start_ms, end_ms, text))
-    return lines
+    return list(iter_json_transcript(json_path))
+
+def iter_text_transcript(text_path: Path) -> Iterator[Line]:
+    """
+    Stream Lines from a `[SPEAKER_XX] - HH:MM:SS.MMM` transcript. The file is
+    memory-mapped and matched turn by turn, so only the current turn is
+    decoded; each of its lines is given TXT_LINE_MS.
+    """
+    with open(text_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in TXT_TURN.finditer(data):
+                hh, mm, ss, mmm = (int(g) for g in match.group(2, 3, 4, 5))
+                start_ms = (hh * 3600 + mm * 60 + ss) * 1000 + mmm
+                text_lines = [line.strip() for line in match.group(6).decode('utf-8').split('\n') if line.strip()]
+                for i, t in enumerate(text_lines):
+                    yield Line(start_ms + i * TXT_LINE_MS, start_ms + (i + 1) * TXT_LINE_MS, t)
 
 def parse_text_transcript(text_path: Path) -> List[Line]:
     """ Parse text transcript with [SPEAKER_XX] - HH:MM:SS.MMM format """
-    lines = []
-    with open(text_path) as f:
-        content = f.read()
-    
-    # Regex to find entries like [SPEAKER_01] - 00:00:00.000
-    pattern = re.compile(r'\[([^\]]+)\]\s*-\s*(\d{1,2}):(\d{2}):(\d{2})\.(\d{3})\s*(.*?)(?=\n\[|\n$|$)', re.DOTALL)
-    
-    for match in pattern.findall(content):
-        speaker, hh, mm, ss, mmm, text_chunk = match
-        hh, mm, ss, mmm = map(int, [hh, mm, ss, mmm])
-        start_ms = (hh * 3600 + mm * 60 + ss) * 1000 + mmm
-        
-        # Simple heuristic: split text into lines, estimate duration
-        text_lines = [line.strip() for line in text_chunk.split('\n') if line.strip()]
-        duration_per_line = 3000  # 3 seconds per line estimate
-        for i, t in enumerate(text_lines):
-            lines.append(Line(start_ms + i*duration_per_line, start_ms + (i+1)*duration_per_line, t))
-    
-    return lines
-
-def transcribe_audio(audio_path: Path, model_size="large-v3", device="auto") -> List[Line]:
+    return list(iter_text_transcript(text_path))
+
+def iter_transcript(srt_path: str) -> Iterator[Line]:
+    """ Stream Lines from a .srt, .json or .txt transcript """
+    path = Path(srt_path)
+    if path.suffix not in TRANSCRIPT_FORMATS:
+        raise ValueError("Unsupported transcript format")
+    return TRANSCRIPT_FORMATS.get(path.suffix)(path)
+
+_DEVICE_PROBE = {}
+
+def resolve_device(device="auto"):
+    """
+    Map a --whisper-device value to (device, compute_type).
+
+    "auto" probes CUDA by loading a tiny model once per process; the result is
+    cached so later calls (and every job in the worker daemon) skip the probe.
+    """
+    if device == "auto":
+        if "auto" not in _DEVICE_PROBE:
+            try:
+                # Try GPU with small test
+                test_model = _whisper_model("tiny", device="cuda", compute_type="float16")
+                del test_model
+                _DEVICE_PROBE["auto"] = ("cuda", "float16")
+                print("✓ Using GPU for transcription")
+            except Exception as e:
+                _DEVICE_PROBE["auto"] = ("cpu", "int8")
+                print(f"⚠ GPU unavailable ({e}), using CPU for transcription")
+        return _DEVICE_PROBE["auto"]
+    elif device == "cuda":
+        return "cuda", "float16"
+    else:
+        return "cpu", "int8"
+
+class TranscriptCheckpoint:
+    """
+    JSONL checkpoint of a transcription in progress.
+
+    The first record identifies the audio file and model; every following record
+    is one [start_ms, end_ms, text] line. Records are buffered and flushed every
+    flush_sec seconds, so a crash loses at most that much work.
+    """
+
+    def __init__(self, path: Path, audio_path: Path, model_size: str, flush_sec: float = TRANSCRIBE_CHECKPOINT_SEC):
+        self.path = Path(path)
+        stat = Path(audio_path).stat()
+        self.header = {"audio": str(Path(audio_path).resolve()), "size": stat.st_size,
+                       "mtime_ns": stat.st_mtime_ns, "model_size": model_size}
+        self.flush_sec = flush_sec
+        self._file = None
+        self._last_flush = 0.0
+
+    def load(self) -> List[Line]:
+        """ Lines from a checkpoint of the same audio and model, else [] """
+        if not self.path.exists():
+            return []
+        lines = []
+        with open(self.path) as f:
+            try:
+                if json.loads(f.readline()) != self.header:
+                    return []
+                for record in f:
+                    lines.append(Line(*json.loads(record)))
+            except (ValueError, TypeError):
+                pass  # Torn final record from a crash: keep what was complete
+        return lines
+
+    def open(self, lines: List[Line]):
+        """ Rewrite the checkpoint with the resumed lines and keep it open for appends """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'w')
+        self._file.write(json.dumps(self.header) + '\n')
+        for line in lines:
+            self._file.write(json.dumps(list(line)) + '\n')
+        self.flush()
+
+    def append(self, line: Line):
+        self._file.write(json.dumps(list(line)) + '\n')
+        if time.monotonic() - self._last_flush >= self.flush_sec:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if self._file:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+def segment_to_line(segment) -> Line:
+    return Line(int(round(segment.start * 1000)), int(round(segment.end * 1000)), segment.text.strip().replace('\n', ' '))
+
+def checkpointed(audio_path: Path, model_size: str, checkpoint: Optional[Path],
+                 decode: Callable[[int], Iterator[Line]]) -> Iterator[Line]:
+    """
+    Run decode(resume_ms) under an optional checkpoint.
+
+    Lines already in a matching checkpoint are yielded first; decode is then asked
+    for the rest of the audio from the last checkpointed timestamp, and its lines
+    are streamed into the checkpoint. The checkpoint is removed once complete.
+    """
+    store = TranscriptCheckpoint(checkpoint, audio_path, model_size) if checkpoint else None
+    done = store.load() if store else []
+    if store:
+        store.open(done)
+    try:
+        yield from done
+        for line in decode(done[-1].end_ms if done else 0):
+            if store:
+                store.append(line)
+            yield line
+    finally:
+        if store:
+            store.close()
+    if store:
+        store.remove()
+
+def iter_transcription(audio_path: Path, model_size="large-v3", device="auto", model=None,
+                       checkpoint: Path = None) -> Iterator[Line]:
+    """
+    Transcribe audio with faster-whisper, yielding Lines as they are decoded.
+
+    With checkpoint set, lines are streamed into that file and a later call for
+    the same audio and model resumes from the last checkpointed timestamp.
+    """
+    def decode(resume_ms: int) -> Iterator[Line]:
+        nonlocal model
+        if model is None:
+            device_, compute_type = resolve_device(device)
+            model = _whisper_model(model_size, device=device_, compute_type=compute_type)
+        segments, info = model.transcribe(str(audio_path), clip_timestamps=[resume_ms / 1000] if resume_ms else "0")
+        for segment in segments:
+            yield segment_to_line(segment)
+
+    return checkpointed(audio_path, model_size, checkpoint, decode)
+
+def transcribe_audio(audio_path: Path, model_size="large-v3", device="auto", model=None, checkpoint: Path = None,
+                     mode: str = "single", workers: int = None, executor=None) -> List[Line]:
     """
     Transcribe audio using faster-whisper
 
@@ -63,52 +326,22 @@ def transcribe_audio(audio_path: Path, model_size="large-v3", device="auto") ->
         audio_path: Path to audio file
         model_size: Model size (tiny, base, small, medium, large-v3)
         device: "auto" (try GPU, fallback to CPU), "cuda", or "cpu"
+        model: Already loaded WhisperModel to use instead of loading one
+        checkpoint: Optional JSONL file to checkpoint progress to and resume from
+        mode: "single" (one decode stream), "parallel" (VAD-split chunks in a CPU
+              process pool) or "batched" (faster-whisper BatchedInferencePipeline)
+        workers: Process count for "parallel" (default: one per TRANSCRIBE_THREADS_PER_WORKER cores)
+        executor: Existing process pool for "parallel" (see core.batch.SharedPools)
     """
-    # Auto-detect best device
-    if device == "auto":
-        try:
-            # Try GPU with small test
-            test_model = WhisperModel("tiny", device="cuda", compute_type="float16")
-            del test_model
-            device = "cuda"
-            compute_type = "float16"
-            print(f"✓ Using GPU for transcription (model: {model_size})")
-        except Exception as e:
-            device = "cpu"
-            compute_type = "int8"
-            print(f"⚠ GPU unavailable ({e}), using CPU for transcription")
-    elif device == "cuda":
-        compute_type = "float16"
-    else:
-        compute_type = "int8"
-
-    model = WhisperModel(model_size, device=device, compute_type=compute_type)
-    segments, info = model.transcribe(str(audio_path))
-    srt_path = audio_path.with_suffix('.srt')
-    with open(srt_path, 'w') as f:
-        for i, segment in enumerate(segments):
-            f.write(f"{i+1}\n")
-            f.write(f"{format_time(segment.start)} --> {format_time(segment.end)}\n")
-            f.write(f"{segment.text}\n\n")
-    return parse_srt(srt_path)
-
-def format_time(seconds):
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = seconds % 60
-    return f"{hours:02}:{minutes:02}:{secs:06.3f}".replace('.', ',')
-
-def parse_transcript(audio_path: str, srt_path: str = None) -> List[Line]:
-    """ Main parse function """
+    transcribe = TRANSCRIBERS.get(mode)
+    if mode == "parallel":
+        return list(transcribe(audio_path, model_size, workers, checkpoint=checkpoint, executor=executor))
+    return list(transcribe(audio_path, model_size, device, model, checkpoint=checkpoint))
+
+def parse_transcript(audio_path: str, srt_path: str = None) -> Sequence[Line]:
+    """ Main parse function; the lines come back packed in a LineStore """
+    from core.columnar import LineStore  # columnar imports Line from here
     if srt_path:
-        path = Path(srt_path)
-        if path.suffix == '.json':
-            return parse_json_transcript(path)
-        elif path.suffix == '.txt':
-            return parse_text_transcript(path)
-        elif path.suffix == '.srt':
-            return parse_srt(path)
-        else:
-            raise ValueError("Unsupported transcript format")
+        return LineStore.from_items(iter_transcript(srt_path))
     else:
-        return transcribe_audio(Path(audio_path))
\ No newline at end of file
+        return LineStore.from_items(transcribe_audio(Path(audio_path)))
\ No newline at end of file
@@ -1,22 +1,373 @@
 """ Video assembler module """
 
+import json
+import os
+import struct
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from config import FFMPEG_EXE, VIDEO_FPS, VIDEO_BITRATE
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import numpy as np
+from config import (FFMPEG_EXE, VIDEO_FPS, VIDEO_BITRATE, VIDEO_ENCODE_MODE, VIDEO_ENCODE_WORKERS, VIDEO_PROFILE,
+                    VIDEO_STILL_FPS, VIDEO_CRF, VIDEO_KEYFRAME_SEC, CAPTION_RENDER, PREVIEW_FPS, PREVIEW_CRF)
+from core.caption_overlay import composite_frames, overlay_filter, render_overlays
+from core.captions import AssEvent, ass_header, dialogue_event, format_ms_many, parse_ass_time, read_ass, visible_events
+from core.columnar import int_column
+from core.segmenter import Segment
+from core.stage_cache import digest_file, digest_json
+from core.metrics import bind, timed_call
 
-def assemble_video(audio_path: str, images_dir: Path, captions_file: Path, output_video: Path):
-    images_list = images_dir / "images.txt"
+# Used when no segments are passed (legacy callers)
+DEFAULT_IMAGE_SEC = 12
+# Bump when encode_chunk's output changes so existing chunks are re-encoded
+CHUNK_VERSION = 1
+
+class VideoChunk(NamedTuple):
+    index: int
+    image: Path
+    start_frame: int
+    frames: int
+
+def plan_chunks(segments: List[Segment], images_dir: Path, fps: int = VIDEO_FPS) -> List[VideoChunk]:
+    """
+    One chunk per segment showing images/seg_NNN.png. Boundaries are rounded
+    to frames on the episode timeline (not per segment), so the chunks add up
+    to the transcript length without drift against the audio.
+    """
+    # Same float arithmetic and round-half-to-even as round(ms * fps / 1000), over whole columns
+    starts = np.rint(int_column(segments, 'start_ms') * fps / 1000).astype(np.int64)
+    ends = np.rint(int_column(segments, 'end_ms') * fps / 1000).astype(np.int64)
+    keep = ends > starts
+    return [VideoChunk(index, images_dir / f"seg_{index:03d}.png", start, frames)
+            for index, start, frames in zip(int_column(segments, 'index')[keep].tolist(), starts[keep].tolist(),
+                                            (ends - starts)[keep].tolist())]
+
+def _legacy_chunks(images_dir: Path, fps: int) -> List[VideoChunk]:
+    frames = DEFAULT_IMAGE_SEC * fps
+    return [VideoChunk(i, img, i * frames, frames) for i, img in enumerate(sorted(images_dir.glob("*.png")))]
+
+def encode_args(fps: int, bitrate: str, profile: str = "standard") -> List[str]:
+    """
+    Video encoder settings; identical for every chunk so they can be joined by
+    stream copy. "still" targets slideshow content: constant quality instead of
+    a fixed bitrate, x264's stillimage tuning and a keyframe only every
+    VIDEO_KEYFRAME_SEC (enough for seeking), in High profile for player support.
+    "preview" trades quality for speed: x264's ultrafast preset at PREVIEW_CRF.
+    """
+    if profile == "standard":
+        return ['-r', str(fps), '-c:v', 'libx264', '-preset', 'medium', '-b:v', bitrate, '-pix_fmt', 'yuv420p']
+    if profile == "preview":
+        return ['-r', str(fps), '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', str(PREVIEW_CRF), '-pix_fmt', 'yuv420p']
+    if profile == "still":
+        return ['-r', str(fps), '-c:v', 'libx264', '-preset', 'medium', '-tune', 'stillimage', '-crf', str(VIDEO_CRF),
+                '-g', str(max(1, round(VIDEO_KEYFRAME_SEC * fps))), '-profile:v', 'high', '-pix_fmt', 'yuv420p']
+    raise ValueError(f"Unknown video profile: {profile}")
+
+def _mux_args(output_video: Path) -> List[str]:
+    return ['-c:a', 'aac', '-b:a', '192k', '-movflags', '+faststart', str(output_video)]
+
+def _subtitles(captions_file: Optional[Path]) -> List[str]:
+    """ libass filter burning captions_file in on every frame (none when captions are pre-rendered) """
+    return [f"subtitles='{captions_file}':fontsdir=."] if captions_file else []
+
+def write_concat_list(chunks: List[VideoChunk], images_list: Path, fps: int):
+    """ ffconcat list showing each chunk's image for its frames """
     with open(images_list, 'w') as f:
-        for img in sorted(images_dir.glob("*.png")):
-            f.write(f"file '{img}'\nduration {12}\n")  # Fixed duration per segment
-        # Remove duration for last file
-        + f.write(f"file '{img}'\n")  # Simplified
+        for chunk in chunks:
+            f.write(f"file '{chunk.image.resolve()}'\nduration {chunk.frames / fps}\n")
+        if chunks:  # The concat demuxer ignores the last duration unless the file is repeated
+            f.write(f"file '{chunks[-1].image.resolve()}'\n")
+
+def _assemble_single(audio_path: str, chunks: List[VideoChunk], captions_file: Optional[Path], output_video: Path,
+                     fps: int, encode: List[str]):
+    """ One ffmpeg pass over a concat list of all images """
+    images_list = output_video.parent / "images.txt"
+    write_concat_list(chunks, images_list, fps)
 
     cmd = [
         FFMPEG_EXE, '-y', '-f', 'concat', '-safe', '0', '-i', str(images_list),
         '-i', audio_path,
-        '-vf', f"subtitles='{captions_file}':fontsdir=.",
-        '-r', str(VIDEO_FPS), '-c:v', 'libx264', '-preset', 'medium', '-b:v', VIDEO_BITRATE, '-pix_fmt', 'yuv420p',
-        '-c:a', 'aac', '-b:a', '192k', str(output_video)
+        *(['-vf', *_subtitles(captions_file)] if captions_file else []), '-frames:v', str(sum(chunk.frames for chunk in chunks)),
+        *encode, *_mux_args(output_video)
+    ]
+    with timed_call("ffmpeg", "encode"):
+        subprocess.run(cmd, check=True)
+
+def png_size(path: Path) -> Tuple[int, int]:
+    """ (width, height) from a PNG header """
+    with open(path, 'rb') as f:
+        head = f.read(24)
+    if head[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError(f"{path} is not a PNG")
+    return struct.unpack('>II', head[16:24])
+
+def decode_rgb(image: Path, width: int, height: int, overlay: Optional[Path] = None) -> bytes:
+    """ Decode (and scale) an image once into a raw rgb24 frame, with a caption overlay drawn on top if given """
+    inputs = ['-i', str(image), '-vf', f"scale={width}:{height}"]
+    if overlay is not None:
+        inputs = ['-i', str(image), '-i', str(overlay), '-filter_complex', overlay_filter(width, height)]
+    with timed_call("ffmpeg", "decode"):
+        result = subprocess.run([FFMPEG_EXE, '-loglevel', 'error', *inputs,
+                                 '-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                                capture_output=True, check=True)
+    if len(result.stdout) != width * height * 3:
+        raise ValueError(f"Could not decode {image}")
+    return result.stdout
+
+def _assemble_pipe(audio_path: str, chunks: List[VideoChunk], captions_file: Optional[Path], output_video: Path,
+                   fps: int, encode: List[str], overlays: Dict[int, Path] = None):
+    """
+    One ffmpeg pass fed raw frames on stdin in segment order. Each image is
+    decoded once (the next one while the current one is being written) and its
+    buffer repeated for the segment's frames; every image is scaled to the size
+    of the first. With overlays ({segment index: caption PNG}) the captions are
+    composited into that one decode instead of drawn by libass per frame.
+    """
+    if not chunks:
+        raise ValueError("No images to assemble")
+    width, height = png_size(chunks[0].image)
+    overlays = overlays or {}
+    runs = []  # [image, overlay, frames] for consecutive chunks showing the same picture
+    for chunk in chunks:
+        if runs and runs[-1][:2] == [chunk.image, overlays.get(chunk.index)]:
+            runs[-1][2] += chunk.frames
+        else:
+            runs.append([chunk.image, overlays.get(chunk.index), chunk.frames])
+
+    cmd = [
+        FFMPEG_EXE, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f"{width}x{height}", '-framerate', str(fps), '-i', '-',
+        '-i', audio_path, '-map', '0:v', '-map', '1:a',
+        *(['-vf', *_subtitles(captions_file)] if captions_file else []),
+        *encode, *_mux_args(output_video)
+    ]
+    decode = bind(decode_rgb)
+    with timed_call("ffmpeg", "encode"):
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix='decode') as decoder:
+                pending = decoder.submit(decode, runs[0][0], width, height, runs[0][1])
+                for i, (image, overlay, frames) in enumerate(runs):
+                    frame = pending.result()
+                    if i + 1 < len(runs):
+                        pending = decoder.submit(decode, runs[i + 1][0], width, height, runs[i + 1][1])
+                    for _ in range(frames):
+                        proc.stdin.write(frame)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its return code says why
+        except BaseException:
+            proc.kill()
+            raise
+        finally:
+            proc.wait()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd[0])
+
+def encode_chunk(chunk: VideoChunk, captions_file: Optional[Path], output: Path, fps: int = VIDEO_FPS,
+                 encode: List[str] = None, threads: int = 0):
+    """
+    Encode one segment (its image with the captions burned in) as a
+    self-contained video-only file starting on a keyframe. The frames are
+    shifted onto the episode timeline while the subtitles are drawn, so the
+    full captions file can be used unchanged; without captions_file the image
+    is encoded as is. encode defaults to the standard profile's encoder arguments.
+    """
+    encode = encode or encode_args(fps, VIDEO_BITRATE)
+    offset = f"{chunk.start_frame}/({fps}*TB)"
+    captions = ['-vf', f"setpts=PTS+{offset},{_subtitles(captions_file)[0]},setpts=PTS-STARTPTS"] if captions_file else []
+    cmd = [
+        FFMPEG_EXE, '-y', '-loglevel', 'error', '-loop', '1', '-framerate', str(fps), '-i', str(chunk.image),
+        *captions,
+        '-frames:v', str(chunk.frames), *encode, '-threads', str(threads),
+        '-video_track_timescale', str(fps * 1000), '-an', str(output)
     ]
-    subprocess.run(cmd, check=True)
\ No newline at end of file
+    with timed_call("ffmpeg", "encode_chunk"):
+        subprocess.run(cmd, check=True)
+
+def _window(chunk: VideoChunk, fps: int) -> Tuple[float, float]:
+    """ (start_ms, end_ms) of the time chunk is on screen """
+    return chunk.start_frame * 1000 / fps, (chunk.start_frame + chunk.frames) * 1000 / fps
+
+def _caption_inputs(captions_file: Optional[Path], chunks: List[VideoChunk], fps: int) -> Dict[int, List[str]]:
+    """ For each chunk: the captions header plus every Dialogue line visible during the chunk """
+    if captions_file is None:
+        return {chunk.index: [] for chunk in chunks}
+    header, events = read_ass(captions_file)
+    visible = visible_events(events, [_window(chunk, fps) for chunk in chunks])
+    return {chunk.index: header + [events[i].line for i in shown] for chunk, shown in zip(chunks, visible)}
+
+def chunk_key(chunk: VideoChunk, captions: List[str], fps: int, encode: List[str]) -> str:
+    """ Key over everything a chunk's pixels depend on: image bytes, visible captions, timing, encoder settings """
+    return digest_json({"version": CHUNK_VERSION, "image": digest_file(chunk.image), "captions": captions,
+                        "start_frame": chunk.start_frame, "frames": chunk.frames, "encode": encode})
+
+def chunk_keys(chunks: List[VideoChunk], captions_file: Optional[Path], fps: int, encode: List[str]) -> Dict[int, str]:
+    """ chunk_key() of every chunk, with the visible captions read from captions_file """
+    captions = _caption_inputs(captions_file, chunks, fps)
+    return {chunk.index: chunk_key(chunk, captions[chunk.index], fps, encode) for chunk in chunks}
+
+def chunk_file(chunk_dir: Path, chunk: VideoChunk, key: str) -> Path:
+    return chunk_dir / f"chunk_{chunk.index:03d}_{key[:16]}.mp4"
+
+class StreamedChunks:
+    """
+    Encodes "chunked" mode chunks while images and captions are still coming
+    in, into the files _assemble_chunked() would write for the finished
+    captions file, so assemble_video() afterwards only joins them. A chunk is
+    ready once its image has landed and the caption of every segment shown
+    during it is known; add_image() and add_caption() return the chunks they
+    made ready. Segments' event times are known up front, so which captions
+    a chunk needs is too.
+    """
+
+    def __init__(self, segments: List[Segment], images_dir: Path, output_video: Path, fps: int, encode: List[str],
+                 workers: Optional[int] = None):
+        self.fps = fps
+        self.encode = encode
+        self.chunk_dir = output_video.parent / "chunks"
+        self.header = ass_header().split('\n')[:-1]  # As read_ass() returns it
+        self.threads = max(1, (os.cpu_count() or 1) // max(1, workers or VIDEO_ENCODE_WORKERS or os.cpu_count() or 1))
+        self.chunks = {chunk.index: chunk for chunk in plan_chunks(segments, images_dir, fps)}
+        indexes = int_column(segments, 'index').tolist()
+        timing = [AssEvent(parse_ass_time(start), parse_ass_time(end), '') for start, end in
+                  zip(format_ms_many(int_column(segments, 'start_ms')), format_ms_many(int_column(segments, 'end_ms')))]
+        visible = visible_events(timing, [_window(chunk, fps) for chunk in self.chunks.values()])
+        self.needs = {index: [indexes[i] for i in shown] for index, shown in zip(self.chunks, visible)}
+        self.segments = {segment.index: segment for segment in segments}
+        self.lines: Dict[int, str] = {}
+        self.landed = set()
+
+    def _ready(self, indexes) -> List[VideoChunk]:
+        return [self.chunks[i] for i in indexes if i in self.chunks and i in self.landed
+                and all(j in self.lines for j in self.needs[i])]
+
+    def add_image(self, index: int) -> List[VideoChunk]:
+        """ Segment index's image is final """
+        self.landed.add(index)
+        return self._ready([index])
+
+    def add_caption(self, result: Dict) -> List[VideoChunk]:
+        """ A prompt result (with its caption) has arrived """
+        index = result['segment_index']
+        self.lines[index] = dialogue_event(self.segments[index], result).line
+        return self._ready(i for i in self.landed if index in self.needs.get(i, ()))
+
+    def encode_chunk(self, chunk: VideoChunk) -> bool:
+        """ Encode chunk into chunks/; False if a file with its key is already there """
+        captions = self.header + [self.lines[j] for j in self.needs[chunk.index]]
+        output = chunk_file(self.chunk_dir, chunk, chunk_key(chunk, captions, self.fps, self.encode))
+        if output.exists():
+            return False
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        script = output.with_suffix('.part.ass')
+        script.write_text('\n'.join(captions) + '\n')
+        tmp = output.with_suffix('.part.mp4')
+        try:
+            encode_chunk(chunk, script, tmp, self.fps, self.encode, self.threads)
+        finally:
+            script.unlink()
+        os.replace(tmp, output)
+        return True
+
+def _assemble_chunked(audio_path: str, chunks: List[VideoChunk], captions_file: Optional[Path], output_video: Path,
+                      fps: int, encode: List[str], workers: Optional[int]) -> int:
+    """
+    Encode chunks in parallel, join them by stream copy and mux the audio once.
+
+    Chunks are kept in chunks/ under their key with a manifest.json of
+    {segment index: file}; a re-run only encodes chunks whose inputs changed
+    and returns how many that was.
+    """
+    chunk_dir = output_video.parent / "chunks"
+    chunk_dir.mkdir(parents=True, exist_ok=True)
+    keys = chunk_keys(chunks, captions_file, fps, encode)
+    files = {chunk.index: chunk_file(chunk_dir, chunk, keys[chunk.index]) for chunk in chunks}
+    dirty = [chunk for chunk in chunks if not files[chunk.index].exists()]
+
+    workers = max(1, min(workers or VIDEO_ENCODE_WORKERS or os.cpu_count() or 1, len(dirty) or 1))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    def run(chunk: VideoChunk):
+        # The key is in the file name, so only a finished encode may take it
+        tmp = files[chunk.index].with_suffix('.part.mp4')
+        encode_chunk(chunk, captions_file, tmp, fps, encode, threads)
+        os.replace(tmp, files[chunk.index])
+
+    # Each chunk runs in its own ffmpeg process; threads only wait on them
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='encode') as pool:
+        for future in [pool.submit(bind(run), chunk) for chunk in dirty]:
+            future.result()
+
+    with open(chunk_dir / "manifest.json", 'w') as f:
+        json.dump({str(chunk.index): {"key": keys[chunk.index], "file": files[chunk.index].name} for chunk in chunks},
+                  f, indent=2)
+    for stale in set(chunk_dir.glob("chunk_*.mp4")) - set(files.values()):
+        stale.unlink()
+
+    chunks_list = chunk_dir / "chunks.txt"
+    with open(chunks_list, 'w') as f:
+        for chunk in chunks:
+            f.write(f"file '{files[chunk.index].resolve()}'\n")
+    cmd = [
+        FFMPEG_EXE, '-y', '-f', 'concat', '-safe', '0', '-i', str(chunks_list),
+        '-i', audio_path, '-map', '0:v', '-map', '1:a', '-c:v', 'copy',
+        *_mux_args(output_video)
+    ]
+    with timed_call("ffmpeg", "concat"):
+        subprocess.run(cmd, check=True)
+    return len(dirty)
+
+def assemble_video(audio_path: str, images_dir: Path, captions_file: Path, output_video: Path,
+                   segments: List[Segment] = None, fps: int = None, bitrate: str = VIDEO_BITRATE,
+                   mode: str = VIDEO_ENCODE_MODE, workers: Optional[int] = None, profile: str = VIDEO_PROFILE,
+                   caption_render: str = CAPTION_RENDER) -> int:
+    """
+    Render images + burned-in captions + audio into output_video. Returns the
+    number of segments (re-)encoded.
+
+    Args:
+        segments: Timing for each image (images_dir/seg_NNN.png); without it every
+                  PNG in images_dir is shown for DEFAULT_IMAGE_SEC
+        fps: Output frame rate (default: VIDEO_FPS, or VIDEO_STILL_FPS for the "still" profile)
+        bitrate: Target bitrate for the "standard" profile ("still" uses VIDEO_CRF)
+        mode: "single" (one ffmpeg pass over a concat list), "pipe" (one pass fed
+              decoded frames on stdin) or "chunked" (one GOP-aligned chunk per
+              segment encoded in parallel, joined with the concat demuxer and -c copy;
+              chunks are kept next to output_video and only changed ones re-encoded)
+        workers: Concurrent ffmpeg processes for "chunked" (default: VIDEO_ENCODE_WORKERS or CPU count)
+        profile: "standard" (constant bitrate), "still" (low frame rate, long GOP,
+                 stillimage tuning, constant quality) for slideshow content or
+                 "preview" (PREVIEW_FPS, ultrafast preset, PREVIEW_CRF) for drafts
+        caption_render: "ass" (libass draws captions_file on every frame) or
+                        "overlay" (each caption is rasterized once into a transparent
+                        PNG in overlays/ and composited once per segment: into the
+                        decoded frame for "pipe", into frames/seg_NNN_<key>.png for
+                        the other modes). Overlays sample the captions at each
+                        segment's first frame, which fits build_captions output
+    """
+    fps = fps or {"still": VIDEO_STILL_FPS, "preview": PREVIEW_FPS}.get(profile, VIDEO_FPS)
+    encode = encode_args(fps, bitrate, profile)
+    chunks = plan_chunks(segments, images_dir, fps) if segments is not None else _legacy_chunks(images_dir, fps)
+    if caption_render == "overlay":
+        if not chunks:
+            raise ValueError("No images to assemble")
+        width, height = png_size(chunks[0].image)
+        overlays = render_overlays(captions_file, chunks, fps, width, height, output_video.parent / "overlays")
+        if mode == "pipe":
+            _assemble_pipe(audio_path, chunks, None, output_video, fps, encode, overlays)
+            return len(chunks)
+        chunks = composite_frames(chunks, overlays, output_video.parent / "frames", width, height, workers)
+        captions_file = None
+    elif caption_render != "ass":
+        raise ValueError(f"Unknown caption render mode: {caption_render}")
+    if mode == "single":
+        _assemble_single(audio_path, chunks, captions_file, output_video, fps, encode)
+        return len(chunks)
+    elif mode == "pipe":
+        _assemble_pipe(audio_path, chunks, captions_file, output_video, fps, encode)
+        return len(chunks)
+    elif mode == "chunked":
+        return _assemble_chunked(audio_path, chunks, captions_file, output_video, fps, encode, workers)
+    else:
+        raise ValueError(f"Unknown encode mode: {mode}")
@@ -0,0 +1,137 @@
+""" Warm transcription worker: keeps Whisper models resident between runs """
+
+import argparse
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from config import WHISPER_WORKER_URL, WHISPER_WORKER_MAX_MODELS
+
+ModelKey = Tuple[str, str, str]  # (model_size, device, compute_type)
+
+def _load_whisper(model_size: str, device: str, compute_type: str):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device=device, compute_type=compute_type)
+
+class ModelPool:
+    """ Small LRU pool of loaded models keyed by (model_size, device, compute_type) """
+
+    def __init__(self, max_models: int = WHISPER_WORKER_MAX_MODELS, loader: Callable = _load_whisper):
+        self.max_models = max(1, max_models)
+        self.loader = loader
+        self._models: "OrderedDict[ModelKey, object]" = OrderedDict()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: ModelKey):
+        """ Return (model, lock); the lock serialises jobs on the same model """
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key], self._locks[key]
+            model = self.loader(*key)
+            self._models[key] = model
+            self._locks[key] = threading.Lock()
+            while len(self._models) > self.max_models:
+                old, _ = self._models.popitem(last=False)
+                del self._locks[old]
+            return model, self._locks[key]
+
+    def keys(self) -> List[ModelKey]:
+        with self._lock:
+            return list(self._models)
+
+def _transcribe(pool: ModelPool, audio_path: str, model_size: str, device: str, checkpoint: Optional[str] = None) -> list:
+    from core.transcript_parser import resolve_device, transcribe_audio
+    key = (model_size, *resolve_device(device))
+    model, lock = pool.get(key)
+    with lock:
+        return [list(line) for line in transcribe_audio(Path(audio_path), model_size, key[1], model=model,
+                                                        checkpoint=Path(checkpoint) if checkpoint else None)]
+
+def make_server(host: str = "127.0.0.1", port: int = 0, pool: Optional[ModelPool] = None,
+                transcribe: Callable = _transcribe) -> ThreadingHTTPServer:
+    """
+    HTTP worker: POST /transcribe {"audio_path", "model_size", "device", "checkpoint"}
+    -> {"lines": [[start_ms, end_ms, text], ...]}
+    """
+    pool = pool or ModelPool()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, data, status=200):
+            body = json.dumps(data).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                return self._json({"status": "ok", "models": [list(k) for k in pool.keys()]})
+            self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            if self.path != '/transcribe':
+                return self._json({"error": "not found"}, 404)
+            try:
+                job = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                lines = transcribe(pool, job['audio_path'], job.get('model_size', 'large-v3'), job.get('device', 'auto'),
+                                   job.get('checkpoint'))
+            except Exception as e:
+                return self._json({"error": f"{type(e).__name__}: {e}"}, 500)
+            self._json({"lines": lines})
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+def worker_available(url: str = WHISPER_WORKER_URL) -> bool:
+    """ True if a worker answers /health at url """
+    import requests
+    try:
+        return requests.get(f"{url}/health", timeout=0.5).ok
+    except requests.RequestException:
+        return False
+
+def submit_transcription(audio_path: Path, model_size: str, device: str, url: str = WHISPER_WORKER_URL,
+                         checkpoint: Path = None):
+    """ Transcribe on the worker; returns Lines """
+    import requests
+    from core.transcript_parser import Line
+    response = requests.post(f"{url}/transcribe", json={
+        "audio_path": str(Path(audio_path).resolve()), "model_size": model_size, "device": device,
+        "checkpoint": str(Path(checkpoint).resolve()) if checkpoint else None})
+    if not response.ok:
+        raise RuntimeError(f"Whisper worker failed: {response.json().get('error', response.text)}")
+    return [Line(*line) for line in response.json()['lines']]
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep Whisper models loaded and serve transcription jobs")
+    parser.add_argument("--host", default="127.0.0.1", help="Bind address (keep local: jobs reference local paths)")
+    parser.add_argument("--port", type=int, default=int(WHISPER_WORKER_URL.rsplit(':', 1)[1]), help="Port")
+    parser.add_argument("--max-models", type=int, default=WHISPER_WORKER_MAX_MODELS, help="Models kept loaded")
+    parser.add_argument("--preload", help="Model size to load at startup (e.g. large-v3)")
+    parser.add_argument("--device", default="auto", help="Device for --preload (auto, cuda, cpu)")
+    args = parser.parse_args()
+
+    pool = ModelPool(args.max_models)
+    if args.preload:
+        from core.transcript_parser import resolve_device
+        pool.get((args.preload, *resolve_device(args.device)))
+    server = make_server(args.host, args.port, pool)
+    print(f"Whisper worker listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,11 @@ OUTPUT_ROOT = "output"
 # Segmentation
 SEGMENT_SECONDS = 12
 MAX_SEG_TEXT_CHARS = 900
+SEGMENT_MODE = "fixed"  # "adaptive": cut on pauses and sentence ends, merge neighbours about the same thing
+SEGMENT_MAX_SEC = 60  # Adaptive: longest segment merging may build
+SEGMENT_PAUSE_MS = 800  # Adaptive: silence between lines that counts as a place to cut
+SEGMENT_SIMILARITY = 0.3  # Adaptive: TF-IDF cosine similarity at which neighbouring segments merge
+IMAGES_PER_HOUR = None  # Image budget; adaptive merges further (fixed widens windows) to stay under it
 
 # Captions (ASS)
 CAPTION_MAX_CHARS = 88
@@ -20,12 +25,30 @@ CAPTION_FONTSIZE = 42
 CAPTION_MARGIN = 60
 CAPTION_STROKE = 2
 CAPTION_BG_ALPHA = 0.35
+CAPTION_RENDER = "ass"  # "ass": libass draws the captions on every frame, or "overlay": each caption is rasterized once and composited per segment
+
+# Transcription
+TRANSCRIBE_CHECKPOINT_SEC = 30  # How often an in-progress transcription is flushed to its checkpoint
+TRANSCRIBE_MODE = "single"  # "single" | "parallel" (VAD chunks across CPU processes) | "batched" (BatchedInferencePipeline)
+TRANSCRIBE_CHUNK_SEC = 300  # Target chunk length for "parallel"
+TRANSCRIBE_VAD_MIN_SILENCE_MS = 500  # Silence "parallel" may split chunks at
+TRANSCRIBE_THREADS_PER_WORKER = 4  # CTranslate2 threads per "parallel" process; workers default to cores / this
+TRANSCRIBE_BATCH_SIZE = 16  # Batch size for "batched"
+
+# Transcription worker (python -m core.whisper_worker); used automatically when running
+WHISPER_WORKER_URL = "http://127.0.0.1:8765"
+WHISPER_WORKER_MAX_MODELS = 2  # Models kept loaded, keyed by (model_size, device, compute_type)
 
 # LLM (OpenAI-compatible API)
 # Set OPENAI_API_KEY environment variable or replace "YOUR_KEY" below
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "YOUR_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = "gpt-4o-mini"
+LLM_BACKEND = "openai"  # Chat client from core.backends.LLM_CLIENTS (any OpenAI-compatible API works via OPENAI_BASE_URL)
+LLM_BATCH_TOKENS = 6000  # Token budget per request (segment text + expected results)
+LLM_MAX_WORKERS = 4  # Concurrent LLM requests
+PROMPT_CACHE_PATH = None  # Per-segment LLM result cache (SQLite); None uses {cache dir}/prompts.sqlite
+PROMPT_CACHE_MAX_ENTRIES = 100000  # Least recently used entries beyond this are evicted
 
 # Global visual style
 GLOBAL_STYLE = "cinematic, sacred geometry, cosmic-tech elegance, crisp detail, clean composition, dramatic lighting, high dynamic range"
@@ -43,14 +66,47 @@ BATCH_SIZE = 1
 COMFY_HOST = "127.0.0.1"
 COMFY_PORT = 8188
 COMFY_OUTPUT_DIR = "output"
+COMFY_MAX_IN_FLIGHT = 2  # Prompts kept queued on each ComfyUI server at once
+COMFY_POLL_SEC = 0.5  # /history poll interval when the /ws event stream is unavailable
+COMFY_URLS = None  # Several ComfyUI servers to balance renders over, e.g. ["http://gpu1:8188", "http://gpu2:8188"]; None uses COMFY_HOST:COMFY_PORT
+COMFY_HTTP_TIMEOUT_SEC = 30  # Timeout for each ComfyUI HTTP request (renders are bounded by TIMEOUT_COMFY_SEC)
+COMFY_QUEUE_PROBE_SEC = 1.0  # Refresh each server's /queue depth at most this often when picking one
+COMFY_HEALTH_SEC = 30  # Re-check a server that stopped answering after this long
+IMAGE_LIBRARY_DIR = None  # Rendered-image library; None uses {CACHE_DIR or OUTPUT_ROOT/.cache}/library
+IMAGE_REUSE_THRESHOLD = None  # Opt-in: reuse a library image when prompt similarity (TF-IDF cosine, 0-1) reaches this (e.g. 0.9); None always renders
 
 # FFmpeg
 FFMPEG_EXE = "ffmpeg"
 VIDEO_FPS = 30
 VIDEO_BITRATE = "10M"
+VIDEO_ENCODE_MODE = "single"  # "single" ffmpeg pass, "pipe": single pass fed decoded frames on stdin, or "chunked": segments encoded in parallel and joined by stream copy
+VIDEO_ENCODE_WORKERS = None  # ffmpeg processes for chunked mode; None uses the CPU count
+VIDEO_PROFILE = "standard"  # "standard" (VIDEO_FPS at VIDEO_BITRATE) or "still" (slideshow-tuned, see below)
+VIDEO_STILL_FPS = 5  # Frame rate for the still profile; caption/image changes land on 1/VIDEO_STILL_FPS s
+VIDEO_CRF = 20  # x264 constant quality for the still profile (lower = better, 18-23 typical)
+VIDEO_KEYFRAME_SEC = 10  # Keyframe interval for the still profile (seek granularity)
+
+# Preview (--preview)
+PREVIEW_WIDTH = 640  # Image and video size for --preview
+PREVIEW_HEIGHT = 360
+PREVIEW_FPS = 5  # Frame rate for --preview
+PREVIEW_STEPS = 8  # Sampler steps for --preview renders
+PREVIEW_IMAGES = "render"  # "render": low-step ComfyUI renders at preview size (cards for failed ones), "cards": placeholder cards only, no ComfyUI
+PREVIEW_CRF = 30  # x264 constant quality for --preview (ultrafast preset)
 
 # Behaviour
 ALLOW_REUSE = True
+CACHE_DIR = None  # Stage cache location; None uses {OUTPUT_ROOT}/.cache (shared by all episodes)
 RETRY_LLM = 3
 RETRY_COMFY = 2
 TIMEOUT_COMFY_SEC = 600
+
+# Pipeline
+PIPELINE_MODE = "sequential"  # "sequential": each stage finishes before the next starts; "streamed": prompts, images and segment encodes overlap item by item
+PIPELINE_QUEUE_SIZE = 8  # Items waiting between two streamed stages before the upstream one pauses
+
+# Batch mode (--manifest or --audio DIR)
+BATCH_PARALLEL_EPISODES = 2  # Episodes in flight at once; they share one transcription, LLM and ComfyUI pool
+
+# Metrics (stage spans and external call latencies always go to output/{slug}/metrics.jsonl)
+METRICS_TEXTFILE_DIR = None  # Also write podcast_factory_{slug}.prom here for the node_exporter textfile collector
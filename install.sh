@@ -19,6 +19,6 @@ pip install --upgrade pip
 pip install -r requirements.txt
 
 echo "Verifying installation..."
-python -c "import faster_whisper, requests, websocket, openai, pysrt; print('All required packages installed successfully!')"
+python -c "import faster_whisper, requests, websocket, openai, numpy; print('All required packages installed successfully!')"
 
 echo "Installation complete. To activate the virtual environment in the future, run: source venv/bin/activate"
\ No newline at end of file
@@ -2,33 +2,100 @@
 """ CLI entrypoint for Podcast Video Factory """
 
 import argparse
+import math
 import os
 import json
+import threading
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from config import *
 from version import __version__
-from core.transcript_parser import parse_transcript
-from core.segmenter import segment_transcript
-from core.prompt_generator import generate_prompts
-from core.comfy_client import ComfyClient
-from core.captions import build_captions
-from core.video_assembler import assemble_video
+from core.backends import TRANSCRIBERS
 from core.logging_utils import setup_logger
 
+# Pipeline modules (numpy, requests, asyncio, ...) are imported by the functions
+# that use them, so --help, --version and argument errors return immediately
+if TYPE_CHECKING:
+    from core.batch import SharedPools
+    from core.comfy_client import ComfyScheduler
+    from core.image_library import ImageLibrary
+
 def resolve_slug(audio_path):
     """ Generate slug from audio filename """
     return Path(audio_path).stem
 
-def main():
+def open_image_library(output_root, allow_reuse: bool) -> 'ImageLibrary':
+    """ Library of rendered images shared by all episodes under output_root (or IMAGE_LIBRARY_DIR) """
+    from core.image_library import ImageLibrary
+    if IMAGE_LIBRARY_DIR:
+        root = Path(IMAGE_LIBRARY_DIR)
+    else:
+        root = (Path(CACHE_DIR) if CACHE_DIR else Path(output_root) / ".cache") / "library"
+    return ImageLibrary(root, IMAGE_REUSE_THRESHOLD, read=allow_reuse)
+
+def comfy_urls(args: argparse.Namespace) -> List[str]:
+    """ ComfyUI servers to render on: --comfy-url, else COMFY_URLS, else COMFY_HOST:COMFY_PORT """
+    return args.comfy_url or COMFY_URLS or [f"http://{COMFY_HOST}:{COMFY_PORT}"]
+
+def report_comfy_nodes(scheduler: 'ComfyScheduler', span: Dict, logger):
+    """ Per-server throughput into the images span and run.log """
+    span["nodes"] = scheduler.client.node_stats()
+    for node in span["nodes"]:
+        logger.info(f"ComfyUI {node['url']}: {node['completed']} images ({node['images_per_min']}/min), "
+                    f"{node['failed']} failed, {node['moved']} moved away{'' if node['healthy'] else ', down'}")
+
+@contextmanager
+def open_scheduler(pools: Optional['SharedPools'], images_dir: Path, output_root, allow_reuse: bool, render: Dict,
+                   urls: List[str]):
+    """ The batch's shared ComfyScheduler, or one (with the image library) for this run only """
+    if pools:
+        yield pools.comfy()
+        return
+    from core.comfy_client import ComfyClient, ComfyScheduler
+    client = ComfyClient(urls, images_dir)
+    library = open_image_library(output_root, allow_reuse)
+    scheduler = ComfyScheduler(client, COMFY_MAX_IN_FLIGHT, library=library, **render)
+    try:
+        yield scheduler
+    finally:
+        scheduler.close()
+        library.close()
+
+def render_settings(args: argparse.Namespace) -> Dict:
+    """ ComfyUI render settings for a run; --preview swaps in the small, low-step PREVIEW_* ones """
+    if args.preview:
+        return {"width": PREVIEW_WIDTH, "height": PREVIEW_HEIGHT, "steps": PREVIEW_STEPS, "cfg": CFG,
+                "sampler": SAMPLER_NAME, "scheduler": SCHEDULER}
+    return {"width": args.width or WIDTH, "height": args.height or HEIGHT, "steps": STEPS, "cfg": CFG,
+            "sampler": SAMPLER_NAME, "scheduler": SCHEDULER}
+
+def transcription_settings(args: argparse.Namespace) -> Dict:
+    """ Whisper settings that change the transcript (thread and worker counts only change speed) """
+    settings = {"whisper_model": args.whisper_model, "mode": args.whisper_mode, "device": args.whisper_device}
+    if args.whisper_mode == "parallel":
+        settings.update(chunk_sec=TRANSCRIBE_CHUNK_SEC, vad_min_silence_ms=TRANSCRIBE_VAD_MIN_SILENCE_MS)
+    elif args.whisper_mode == "batched":
+        settings.update(batch_size=TRANSCRIBE_BATCH_SIZE)
+    return settings
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Podcast Video Factory - Transform audio into visual stories",
         epilog=f"Version {__version__}"
     )
     parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
-    parser.add_argument("--audio", required=True, help="Path to audio file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--audio", help="Path to audio file, or a directory of audio files to batch")
+    source.add_argument("--manifest", help="Batch manifest: JSON list or text file of audio[<TAB>transcript] lines")
     parser.add_argument("--srt", help="Path to transcript file (.srt, .txt, .json)")
     parser.add_argument("--out", help="Output directory root")
     parser.add_argument("--seg-sec", type=int, help="Segment seconds")
+    parser.add_argument("--segment-mode", choices=["fixed", "adaptive"], default=SEGMENT_MODE,
+                        help="fixed windows of --seg-sec, or adaptive: cut on pauses and sentence ends, merge similar neighbours")
+    parser.add_argument("--images-per-hour", type=float, default=IMAGES_PER_HOUR,
+                        help="Image budget: at most this many segments (and renders) per hour of audio")
     parser.add_argument("--width", type=int, help="Width")
     parser.add_argument("--height", type=int, help="Height")
     parser.add_argument("--fps", type=int, help="FPS")
@@ -37,92 +104,484 @@ def main():
     parser.add_argument("--force", action="store_true", help="Force regeneration")
     parser.add_argument("--whisper-model", default="large-v3", help="Whisper model size (tiny, base, small, medium, large-v3)")
     parser.add_argument("--whisper-device", default="auto", help="Transcription device (auto, cuda, cpu)")
-    args = parser.parse_args()
+    parser.add_argument("--whisper-mode", choices=TRANSCRIBERS.names(), default=TRANSCRIBE_MODE,
+                        help="Transcription mode: single stream, parallel CPU chunks, or batched inference")
+    parser.add_argument("--whisper-workers", type=int, help="Processes for --whisper-mode parallel (default: cores / TRANSCRIBE_THREADS_PER_WORKER)")
+    parser.add_argument("--encode-mode", choices=["single", "pipe", "chunked"], default=VIDEO_ENCODE_MODE,
+                        help="Video encode: one ffmpeg pass over a concat list, one pass fed frames on stdin, "
+                             "or per-segment chunks encoded in parallel and joined by stream copy")
+    parser.add_argument("--video-profile", choices=["standard", "still"], default=VIDEO_PROFILE,
+                        help="Encoder tuning: standard (VIDEO_FPS, VIDEO_BITRATE) or still (low fps, stillimage tune, CRF)")
+    parser.add_argument("--caption-render", choices=["ass", "overlay"], default=CAPTION_RENDER,
+                        help="Captions drawn by libass on every frame, or rasterized once per caption and composited per segment")
+    parser.add_argument("--preview", action="store_true",
+                        help="Fast draft into {slug}/preview/: PREVIEW_WIDTH x PREVIEW_HEIGHT low-step renders (or cards), "
+                             "PREVIEW_FPS, ultrafast encode; transcript, segments, prompts and captions are shared with full renders")
+    parser.add_argument("--comfy-url", action="append", metavar="URL",
+                        help="ComfyUI server to render on (repeat to balance over several; default: COMFY_URLS or COMFY_HOST:COMFY_PORT)")
+    parser.add_argument("--pipeline", choices=["sequential", "streamed"], default=PIPELINE_MODE,
+                        help="Run stages one after another, or stream segments through prompts, images and "
+                             "(with --encode-mode chunked) segment encodes as each one is ready")
+    parser.add_argument("--parallel-episodes", type=int, default=BATCH_PARALLEL_EPISODES,
+                        help="Episodes in flight at once in batch mode")
+    return parser
+
+def run_episode(audio: str, srt: Optional[str], args: argparse.Namespace, pools: Optional['SharedPools'] = None) -> Dict:
+    """
+    Run the pipeline for one episode into {output_root}/{slug}/. With pools
+    (batch mode), transcription, LLM requests and ComfyUI renders go through
+    the shared pools. Returns {"output_dir", "duration_ms"}.
+    """
+    from core.transcript_parser import parse_transcript, Line
+    from core.columnar import LineStore
+    from core.segmenter import adaptive_segments, segment_transcript, load_segments
+    from core.prompt_generator import LLMBudget, batch_segments, generate_prompts, SYSTEM_PROMPT_VERSION
+    from core.prompt_cache import PromptCache
+    from core.comfy_client import ImageJob
+    from core.captions import build_captions, CAPTIONS_VERSION
+    from core.video_assembler import StreamedChunks, assemble_video, encode_args
+    from core.stage_cache import StageCache, digest_file, link_or_copy
+    from core.cards import CARD_VERSION, card_colour, write_card
+    from core.metrics import RunMetrics, activate
+    from core.whisper_worker import worker_available, submit_transcription
 
     # Override config with args
-    srt_path = args.srt if args.srt else SRT_PATH
+    srt_path = srt if srt else SRT_PATH
     output_root = args.out if args.out else OUTPUT_ROOT
     segment_seconds = args.seg_sec if args.seg_sec else SEGMENT_SECONDS
-    width = args.width if args.width else WIDTH
-    height = args.height if args.height else HEIGHT
-    video_fps = args.fps if args.fps else VIDEO_FPS
+    render = render_settings(args)
+    width, height = render["width"], render["height"]
+    video_profile = "preview" if args.preview else args.video_profile
+    video_fps = args.fps if args.fps else {"still": VIDEO_STILL_FPS, "preview": PREVIEW_FPS}.get(video_profile, VIDEO_FPS)
     video_bitrate = args.bitrate if args.bitrate else VIDEO_BITRATE
     global_style = args.style if args.style else GLOBAL_STYLE
     allow_reuse = not args.force if args.force else ALLOW_REUSE
 
-    slug = resolve_slug(args.audio)
+    slug = resolve_slug(audio)
     output_dir = Path(output_root) / slug
     output_dir.mkdir(parents=True, exist_ok=True)
+    # Images and video of a preview live apart from the full render's
+    render_dir = output_dir / "preview" if args.preview else output_dir
+    render_dir.mkdir(exist_ok=True)
+
+    logger = setup_logger(output_dir / "run.log", f"podcast_factory.{slug}" if pools else 'podcast_factory')
 
-    logger = setup_logger(output_dir / "run.log")
+    cache = StageCache(Path(CACHE_DIR) if CACHE_DIR else Path(output_root) / ".cache", read=allow_reuse,
+                       run_dir=output_dir)
+    audio_digest = digest_file(Path(audio)) if os.path.exists(audio) else None
 
+    metrics = RunMetrics(output_dir / "metrics.jsonl", episode=slug)
     try:
-        # Step 1: Parse transcript
-        # Pass transcription config if auto-transcribing
-        if srt_path:
-            lines = parse_transcript(args.audio, srt_path)
-        else:
-            # Import transcribe_audio directly for more control
-            from core.transcript_parser import transcribe_audio
-            lines = transcribe_audio(Path(args.audio), model_size=args.whisper_model, device=args.whisper_device)
-        logger.info("Parsed transcript")
-
-        # Step 2: Segment
-        segments = segment_transcript(lines, segment_seconds, MAX_SEG_TEXT_CHARS, output_dir / "segments.json")
-        logger.info(f"Segmented into {len(segments)} segments")
-
-        # Step 3: Generate prompts (SKIP if OpenAI key not set)
-        prompts_file = output_dir / "prompts.json"
-        if allow_reuse and prompts_file.exists():
-            with open(prompts_file) as f:
-                prompts = json.load(f)
-            logger.info("Reusing prompts")
-        else:
-            if not OPENAI_API_KEY or OPENAI_API_KEY == "YOUR_KEY":
+        with activate(metrics):
+            # Step 1: Parse transcript
+            with metrics.span("transcript") as span:
+                # Pass transcription config if auto-transcribing
+                if srt_path:
+                    transcript_key = cache.key("transcript", transcript=digest_file(Path(srt_path)), format=Path(srt_path).suffix)
+                else:
+                    transcript_key = cache.key("transcript", audio=audio_digest, **transcription_settings(args))
+                cached_lines = cache.load_json("transcript", transcript_key)
+                if cached_lines is not None:
+                    lines = LineStore.from_items(Line(*item) for item in cached_lines)
+                    span["cache_hits"] = len(lines)
+                    logger.info("Reusing transcript")
+                else:
+                    if srt_path:
+                        lines = parse_transcript(audio, srt_path)
+                    else:
+                        checkpoint = output_dir / "transcript.partial.jsonl"
+                        if args.whisper_mode == "single" and worker_available():
+                            lines = submit_transcription(Path(audio), args.whisper_model, args.whisper_device, checkpoint=checkpoint)
+                            logger.info(f"Transcribed on worker {WHISPER_WORKER_URL}")
+                        elif pools:
+                            lines = pools.transcribe(Path(audio), args.whisper_model, args.whisper_device, checkpoint, args.whisper_mode)
+                        else:
+                            # Import transcribe_audio directly for more control
+                            from core.transcript_parser import transcribe_audio
+                            lines = transcribe_audio(Path(audio), model_size=args.whisper_model, device=args.whisper_device,
+                                                     checkpoint=checkpoint, mode=args.whisper_mode, workers=args.whisper_workers)
+                    cache.save_json("transcript", transcript_key, [list(line) for line in lines])
+                    logger.info("Parsed transcript")
+                span["items"] = len(lines)
+
+            # Step 2: Segment
+            with metrics.span("segments") as span:
+                segments_file = output_dir / "segments.json"
+                if args.segment_mode == "adaptive":
+                    segments_key = cache.key("segments", transcript=transcript_key, segment_seconds=segment_seconds,
+                                             max_chars=MAX_SEG_TEXT_CHARS, mode="adaptive", max_seconds=SEGMENT_MAX_SEC,
+                                             pause_ms=SEGMENT_PAUSE_MS, similarity=SEGMENT_SIMILARITY,
+                                             images_per_hour=args.images_per_hour)
+                    segment = lambda: adaptive_segments(lines, segment_seconds, MAX_SEG_TEXT_CHARS,
+                                                        images_per_hour=args.images_per_hour, output_file=segments_file)
+                else:
+                    if args.images_per_hour:
+                        # Fixed windows meet the budget by getting longer
+                        segment_seconds = max(segment_seconds, math.ceil(3600 / args.images_per_hour))
+                    segments_key = cache.key("segments", transcript=transcript_key, segment_seconds=segment_seconds, max_chars=MAX_SEG_TEXT_CHARS)
+                    segment = lambda: segment_transcript(lines, segment_seconds, MAX_SEG_TEXT_CHARS, segments_file)
+                reused = cache.run_file_stage("segments", segments_key, segments_file, segment)
+                if reused:
+                    logger.info("Reusing segments")
+                segments = load_segments(segments_file)
+                span.update(items=len(segments), cache_hits=len(segments) if reused else 0)
+                hours = int(segments.end_ms[-1]) / 3_600_000 if len(segments) else 0
+                logger.info(f"Segmented into {len(segments)} segments"
+                            + (f" ({len(segments) / hours:.0f} per hour)" if hours else ""))
+
+            # Steps 3 and 4 share these: prompts (SKIP if OpenAI key not set), images (SKIP if ComfyUI not available)
+            prompts_file = output_dir / "prompts.json"
+            use_llm = OPENAI_API_KEY and OPENAI_API_KEY != "YOUR_KEY"
+            prompts_key = cache.key("prompts", segments=segments_key, style=global_style, negative_style=NEGATIVE_STYLE,
+                                    model=OPENAI_MODEL if use_llm else "dummy", system_prompt=SYSTEM_PROMPT_VERSION)
+            images_dir = render_dir / "images"
+            images_dir.mkdir(exist_ok=True)
+            template_digest = digest_file(Path("workflows/comfy_template.json"))
+            scope = {"style": global_style}  # The scheduler adds render settings, workflow, models and negative prompt
+            final_video = render_dir / ("preview.mp4" if args.preview else "final.mp4")
+            image_keys = {}
+            failed = {}
+            streamed_encodes = 0
+
+            def dummy_prompts():
                 print("SKIP: No OpenAI API key set, using dummy prompts")
-                prompts = {"results": [{"segment_index": i, "prompt": f"dummy prompt for segment {i}", "negative_prompt": NEGATIVE_STYLE, "caption": f"Segment {i}"} for i in range(len(segments))]}
+                return {"results": [{"segment_index": i, "prompt": f"dummy prompt for segment {i}", "negative_prompt": NEGATIVE_STYLE, "caption": f"Segment {i}"} for i in range(len(segments))]}
+
+            def open_prompt_cache():
+                return PromptCache(Path(PROMPT_CACHE_PATH) if PROMPT_CACHE_PATH else cache.root / "prompts.sqlite",
+                                   PROMPT_CACHE_MAX_ENTRIES, read=allow_reuse)
+
+            def card(job, count):
+                path = images_dir / f"seg_{job.segment_index:03d}.png"
+                write_card(path, width, height, card_colour(job.positive))
+                cache.record(path)
+                image_keys[job.segment_index] = cache.key("card", prompt=job.positive, width=width, height=height,
+                                                          version=CARD_VERSION)
+                count("cards")
+
+            def image_from_cache(job, count) -> bool:
+                """ Put job's image in place without ComfyUI (preview card or stage cache hit); False if it must be rendered """
+                if args.preview and PREVIEW_IMAGES == "cards":
+                    card(job, count)
+                    return True
+                image_keys[job.segment_index] = cache.key("image", prompt=job.positive, negative=job.negative, seed=job.seed,
+                                                          width=width, height=height, steps=render["steps"], cfg=CFG,
+                                                          sampler=SAMPLER_NAME, scheduler=SCHEDULER, template=template_digest)
+                path = images_dir / f"seg_{job.segment_index:03d}.png"
+                if cache.fetch("images", image_keys[job.segment_index], path, editable=True):
+                    logger.info(f"{'Keeping edited' if path in cache.edited else 'Reusing'} image for segment {job.segment_index}")
+                    count("cache_hits")
+                    return True
+                return False
+
+            def image_done(job, path, source, count):
+                cache.store("images", image_keys[job.segment_index], path, editable=True)
+                if source == "library":
+                    count("cache_hits")
+                    logger.info(f"Reused library image for segment {job.segment_index}")
+                elif source == "duplicate":
+                    count("duplicates")
+                    logger.info(f"Copied image for duplicate prompt in segment {job.segment_index}")
+                else:
+                    count("rendered")
+                    logger.info(f"Generated image for segment {job.segment_index}")
+
+            def image_failed(job, error, count) -> bool:
+                """ Stand in a card (preview) or a dummy file for a failed render; True if the stand-in is a real image """
+                logger.warning(f"Image for segment {job.segment_index} failed: {error}")
+                if args.preview:
+                    card(job, count)
+                    return True
+                image_keys.pop(job.segment_index, None)
+                placeholder = images_dir / f"seg_{job.segment_index:03d}.png"
+                placeholder.unlink(missing_ok=True)
+                placeholder.write_text("dummy image")
+                cache.forget(placeholder)
+                return False
+
+            if args.pipeline == "streamed":
+                # Steps 3, 4 and the chunk encodes of step 6 overlap: each LLM batch goes on to ComfyUI as soon as it
+                # is answered, and each segment is encoded as soon as its image and the captions it shows are known
+                from core.pipeline import Pipeline, Stage
+                prompts_reused = cache.fetch("prompts", prompts_key, prompts_file, editable=True)
+                prompt_cache = None
+                if prompts_reused:
+                    logger.info("Keeping edited prompts" if prompts_file in cache.edited else "Reusing prompts")
+                    with open(prompts_file) as f:
+                        work = [[result] for result in json.load(f)["results"]]
+                elif not use_llm:
+                    work = [[result] for result in dummy_prompts()["results"]]
+                else:
+                    prompt_cache = open_prompt_cache()
+                    work = batch_segments(segments, LLM_BATCH_TOKENS)
+                budget = pools.llm if pools else LLMBudget(LLM_MAX_WORKERS)
+                encode_workers = VIDEO_ENCODE_WORKERS or os.cpu_count() or 1
+                chunks = None
+                if args.encode_mode == "chunked" and args.caption_render == "ass" and os.path.exists(audio):
+                    chunks = StreamedChunks(segments, images_dir, final_video, video_fps,
+                                            encode_args(video_fps, video_bitrate, video_profile), encode_workers)
+                results = {}
+                comfy_error = None
+
+                def count_image(key):
+                    pipeline.count("images", key)
+
+                def prompt_batch(batch):
+                    """ A batch of segments for the LLM, or results already known (passed on as they are) """
+                    if prompt_cache is not None:
+                        batch = generate_prompts(batch, global_style, NEGATIVE_STYLE, max_workers=1, cache=prompt_cache,
+                                                 budget=budget)["results"]
+                    pipeline.count("prompts", "items", len(batch))
+                    return batch
+
+                # Jobs reach the scheduler one at a time here, so identical prompts are deduplicated per run instead:
+                # (prompt, negative) -> the first such segment's render, resolving to its image path or its error
+                renders: Dict[Tuple[str, str], Future] = {}
+                renders_lock = threading.Lock()
+
+                def render_image(result):
+                    job = ImageJob(result["segment_index"], result["prompt"], result["negative_prompt"], SEED + result["segment_index"])
+                    pipeline.count("images", "items")
+                    if image_from_cache(job, count_image):
+                        return job.segment_index, True
+                    with renders_lock:
+                        first = renders.get((job.positive, job.negative))
+                        if first is None:
+                            first = renders[(job.positive, job.negative)] = mine = Future()
+                        else:
+                            mine = None
+                    if mine is None:
+                        try:
+                            path = images_dir / f"seg_{job.segment_index:03d}.png"
+                            link_or_copy(first.result(), path, copy=True)
+                            image_done(job, path, "duplicate", count_image)
+                            return job.segment_index, True
+                        except Exception as e:
+                            error = e
+                    else:
+                        error = comfy_error
+                        done = {}
+                        if scheduler is not None:
+                            try:
+                                done, errors = scheduler.run([job], on_done=lambda *landed: image_done(*landed, count_image),
+                                                             output_dir=images_dir, scope=scope)
+                                error = errors.get(job.segment_index)
+                            except Exception as e:
+                                error = e
+                        if error is None:
+                            mine.set_result(done[job.segment_index])
+                            return job.segment_index, True
+                        mine.set_exception(error)
+                    failed[job.segment_index] = error
+                    count_image("failed")
+                    return job.segment_index, image_failed(job, error, count_image)
+
+                def landed(event):
+                    """ Runs on the event loop: collects results and hands on the chunks they make ready """
+                    source, item = event
+                    if source == "prompts":
+                        results[item["segment_index"]] = item
+                        return chunks.add_caption(item) if chunks else []
+                    index, usable = item
+                    return chunks.add_image(index) if chunks and usable else []
+
+                def encode(chunk):
+                    pipeline.count("encode", "items")
+                    try:
+                        if chunks.encode_chunk(chunk):
+                            pipeline.count("encode", "encoded")
+                    except Exception as e:
+                        logger.warning(f"Early encode of segment {chunk.index} failed, left to the final assembly: {e}")
+
+                @contextmanager
+                def stage_span(name):
+                    if name == "landed":
+                        yield {}
+                        return
+                    fields = {"rendered": 0, "duplicates": 0, "failed": 0, "cards": 0} if name == "images" else {}
+                    with metrics.span(name, **fields) as record:
+                        yield record
+                        if name == "prompts":
+                            record["cache_hits"] = len(segments) if prompts_reused else prompt_cache.hits if prompt_cache else 0
+                        elif name == "images" and scheduler is not None:
+                            report_comfy_nodes(scheduler, record, logger)
+
+                stages = [Stage("prompts", prompt_batch, workers=LLM_MAX_WORKERS, fan_out=True),
+                          Stage("images", render_image, ("prompts",), workers=COMFY_MAX_IN_FLIGHT * len(comfy_urls(args))),
+                          Stage("landed", landed, ("prompts", "images"), executor="inline", fan_out=True)]
+                if chunks:
+                    stages.append(Stage("encode", encode, ("landed",), workers=encode_workers))
+                pipeline = Pipeline(stages, span=stage_span)
+                try:
+                    with ExitStack() as stack:
+                        scheduler = None
+                        if not (args.preview and PREVIEW_IMAGES == "cards"):
+                            try:
+                                scheduler = stack.enter_context(open_scheduler(pools, images_dir, output_root, allow_reuse,
+                                                                               render, comfy_urls(args)))
+                            except Exception as e:
+                                comfy_error = e
+                        pipeline.run(work)
+                finally:
+                    if prompt_cache is not None:
+                        logger.info(f"Prompt cache: {prompt_cache.hits} hits, {prompt_cache.misses} misses")
+                        prompt_cache.close()
+                prompts = {"results": [results[s.index] for s in segments]}
+                if not prompts_reused:
+                    prompts_file.unlink(missing_ok=True)  # Runs before copies were used left hard links into the cache
+                    with open(prompts_file, "w") as f:
+                        json.dump(prompts, f, indent=2)
+                    cache.store("prompts", prompts_key, prompts_file, editable=True)
+                    logger.info("Generated prompts")
+                streamed_encodes = pipeline.records.get("encode", {}).get("encoded", 0)
             else:
-                prompts = generate_prompts(segments, global_style, NEGATIVE_STYLE)
-            with open(prompts_file, "w") as f:
-                json.dump(prompts, f, indent=2)
-            logger.info("Generated prompts")
-
-        # Step 4: Generate images (SKIP if ComfyUI not available)
-        client = ComfyClient(f"http://{COMFY_HOST}:{COMFY_PORT}", output_dir / "images")
-        try:
-            for i, seg in enumerate(prompts["results"]):
-                seed = SEED + seg["segment_index"]
-                client.generate_image(seg["prompt"], seg["negative_prompt"], seed)
-                logger.info(f"Generated image for segment {i}")
-        except Exception as e:
-            print(f"SKIP: ComfyUI error ({e}), creating dummy images")
-            (output_dir / "images").mkdir(exist_ok=True)
-            for i in range(len(segments)):
-                (output_dir / "images" / f"seg_{i:03d}.png").write_text("dummy image")  # Placeholder
-
-        # Step 5: Build captions
-        captions_file = output_dir / "captions.ass"
-        build_captions(segments, prompts["results"], captions_file)
-        logger.info("Built captions")
-
-        # Step 6: Assemble video (SKIP if FFmpeg not available)
-        audio_path = args.audio
-        if not os.path.exists(audio_path):
-            print("SKIP: No audio file, creating dummy MP4")
-            (output_dir / "final.mp4").write_text("dummy video")
-        else:
-            try:
-                assemble_video(audio_path, output_dir / "images", captions_file, output_dir / "final.mp4")
-                logger.info("Assembled video")
-            except Exception as e:
-                print(f"SKIP: FFmpeg error ({e}), creating dummy MP4")
-                (output_dir / "final.mp4").write_text("dummy video")
-
-        print("SUCCESS: Pipeline completed at", output_dir)
+                # Step 3: Generate prompts (SKIP if OpenAI key not set)
+                with metrics.span("prompts") as span:
+
+                    def build_prompts():
+                        if not use_llm:
+                            prompts = dummy_prompts()
+                        else:
+                            prompt_cache = open_prompt_cache()
+                            try:
+                                prompts = generate_prompts(segments, global_style, NEGATIVE_STYLE, cache=prompt_cache,
+                                                           budget=pools.llm if pools else None)
+                            finally:
+                                span["cache_hits"] = prompt_cache.hits
+                                logger.info(f"Prompt cache: {prompt_cache.hits} hits, {prompt_cache.misses} misses")
+                                prompt_cache.close()
+                        with open(prompts_file, "w") as f:
+                            json.dump(prompts, f, indent=2)
+                        logger.info("Generated prompts")
+
+                    if cache.run_file_stage("prompts", prompts_key, prompts_file, build_prompts, editable=True):
+                        logger.info("Keeping edited prompts" if prompts_file in cache.edited else "Reusing prompts")
+                        span["cache_hits"] = len(segments)
+                    with open(prompts_file) as f:
+                        prompts = json.load(f)
+                    span["items"] = len(prompts["results"])
+
+                # Step 4: Generate images (SKIP if ComfyUI not available)
+                with metrics.span("images") as span:
+                    span.update(items=len(prompts["results"]), rendered=0, duplicates=0, failed=0, cards=0)
+
+                    def count(key):
+                        span[key] += 1
+
+                    jobs = []
+                    for seg in prompts["results"]:
+                        job = ImageJob(seg["segment_index"], seg["prompt"], seg["negative_prompt"], SEED + seg["segment_index"])
+                        if not image_from_cache(job, count):
+                            jobs.append(job)
+                    if jobs:
+                        try:
+                            with open_scheduler(pools, images_dir, output_root, allow_reuse, render,
+                                                comfy_urls(args)) as scheduler:
+                                _, failed = scheduler.run(jobs, on_done=lambda *done: image_done(*done, count),
+                                                          output_dir=images_dir, scope=scope)
+                                report_comfy_nodes(scheduler, span, logger)
+                        except Exception as e:
+                            failed = {job.segment_index: e for job in jobs}
+                    span["failed"] = len(failed)
+                    for job in jobs:
+                        if job.segment_index in failed:
+                            image_failed(job, failed[job.segment_index], count)
+            if failed:
+                print(f"SKIP: ComfyUI error ({next(iter(failed.values()))}), "
+                      f"{'using cards' if args.preview else 'creating dummy images'} for {len(failed)} segments")
+
+            # Step 5: Build captions
+            with metrics.span("captions") as span:
+                captions_file = output_dir / "captions.ass"
+                # Keyed on the prompts.json actually on disk, which may have been edited by hand
+                captions_key = cache.key("captions", segments=segments_key, prompts=digest_file(prompts_file), font=CAPTION_FONT,
+                                         fontsize=CAPTION_FONTSIZE, margin=CAPTION_MARGIN, stroke=CAPTION_STROKE,
+                                         bg_alpha=CAPTION_BG_ALPHA, case=CAPTION_CASE, max_chars=CAPTION_MAX_CHARS,
+                                         version=CAPTIONS_VERSION)
+                span["items"] = len(segments)
+                if cache.run_file_stage("captions", captions_key, captions_file,
+                                        lambda: build_captions(segments, prompts["results"], captions_file), editable=True):
+                    span["cache_hits"] = len(segments)
+                    logger.info("Keeping edited captions" if captions_file in cache.edited else "Reusing captions")
+                else:
+                    logger.info("Built captions")
+
+            # Step 6: Assemble video (SKIP if FFmpeg not available)
+            with metrics.span("video") as span:
+                audio_path = audio
+                span["items"] = len(segments)
+                if not os.path.exists(audio_path):
+                    print("SKIP: No audio file, creating dummy MP4")
+                    final_video.write_text("dummy video")
+                else:
+                    # Keyed on the captions and image bytes in place (hand edits included); placeholder images
+                    # make the result uncacheable
+                    video_key = cache.key("video", audio=audio_digest, captions=digest_file(captions_file), fps=video_fps,
+                                          encode_mode=args.encode_mode, caption_render=args.caption_render,
+                                          encode=encode_args(video_fps, video_bitrate, video_profile),
+                                          images=[digest_file(images_dir / f"seg_{s.index:03d}.png") for s in segments]
+                                          ) if len(image_keys) == len(segments) else None
+
+                    def build_video():
+                        try:
+                            encoded = assemble_video(audio_path, images_dir, captions_file, final_video, segments, video_fps,
+                                                     video_bitrate, args.encode_mode, profile=video_profile,
+                                                     caption_render=args.caption_render) + streamed_encodes
+                            span["cache_hits"] = len(segments) - encoded
+                            logger.info(f"Assembled video ({encoded} of {len(segments)} segments encoded)")
+                            return video_key is not None
+                        except Exception as e:
+                            print(f"SKIP: FFmpeg error ({e}), creating dummy MP4")
+                            final_video.write_text("dummy video")
+                            return False
+
+                    if video_key is None:
+                        final_video.unlink(missing_ok=True)
+                        build_video()
+                    elif cache.run_file_stage("video", video_key, final_video, build_video):
+                        span["cache_hits"] = len(segments)
+                        logger.info("Reusing video")
+
+            logger.info(f"Stage cache: {cache.hits} hits, {cache.misses} misses")
+            print("SUCCESS: Pipeline completed at", output_dir)
+            return {"output_dir": str(output_dir), "duration_ms": segments[-1].end_ms if segments else 0}
 
     except Exception as e:
         logger.error(str(e))
         raise
+    finally:
+        cache.save_state()
+        metrics.close()
+        if METRICS_TEXTFILE_DIR:
+            metrics.write_prometheus(Path(METRICS_TEXTFILE_DIR) / f"podcast_factory_{slug}.prom")
+        for handler in logger.handlers[:]:
+            handler.close()
+            logger.removeHandler(handler)
+
+def main():
+    args = build_parser().parse_args()
+    if args.audio and not Path(args.audio).is_dir():
+        run_episode(args.audio, args.srt, args)
+        return
+
+    from core.batch import SharedPools, load_manifest, run_batch
+
+    if args.srt:
+        raise SystemExit("--srt applies to a single episode; pair transcripts with audio in a --manifest instead")
+    episodes = load_manifest(Path(args.manifest or args.audio))
+    if not episodes:
+        raise SystemExit(f"No episodes found in {args.manifest or args.audio}")
+    output_root = Path(args.out if args.out else OUTPUT_ROOT)
+    output_root.mkdir(parents=True, exist_ok=True)
+    pools = SharedPools(comfy_urls(args), output_root, args.whisper_workers,
+                        library=open_image_library(output_root, ALLOW_REUSE and not args.force), **render_settings(args))
+    try:
+        summary = run_batch(episodes, lambda ep: run_episode(str(ep.audio), str(ep.srt) if ep.srt else None, args, pools),
+                            args.parallel_episodes, output_root / "batch_summary.json")
+    finally:
+        pools.close()
+    if summary["failed"]:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
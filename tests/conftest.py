@@ -0,0 +1,244 @@
+""" Shared fixtures: local fake ComfyUI and OpenAI-compatible servers """
+
+import base64
+import hashlib
+import json
+import queue
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+PNG_BYTES = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR4nGNgYGD4DwABBAEAwS2OUAAAAABJRU5ErkJggg==")
+
+class FakeComfy:
+    """ Minimal ComfyUI: /prompt, /history, /view, /queue and a /ws event stream """
+
+    def __init__(self, render_sec=0.05, fail_first=0):
+        self.render_sec = render_sec
+        self.fail_first = fail_first
+        self.down = False  # Drop every request without an answer, like a crashed server
+        self.png = PNG_BYTES  # Served for every rendered image
+        self.lock = threading.Lock()
+        self.prompts = {}
+        self.history = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.submitted = 0
+        self.ws_clients = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        for q in self.ws_clients:
+            q.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _finish(self, prompt_id, client_id, fail):
+        graph = self.prompts[prompt_id]
+        prefix = next((n['inputs']['filename_prefix'] for n in graph.values() if n.get('class_type') == 'SaveImage'), 'img')
+        with self.lock:
+            self.in_flight -= 1
+            if fail:
+                self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False, "messages": ["boom"]}}
+            else:
+                self.history[prompt_id] = {
+                    "outputs": {"7": {"images": [{"filename": f"{prefix}_00001_.png", "subfolder": "", "type": "output"}]}},
+                    "status": {"status_str": "success", "completed": True, "messages": []}}
+            clients = list(self.ws_clients)
+        event = json.dumps({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+        for q in clients:
+            q.put(event)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, data, status=200):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                if fake.down:
+                    self.close_connection = True
+                    return
+                if urlparse(self.path).path != '/prompt':
+                    return self._json({}, 404)
+                prompt_id = uuid.uuid4().hex
+                with fake.lock:
+                    fake.prompts[prompt_id] = payload['prompt']
+                    fake.submitted += 1
+                    fail = fake.submitted <= fake.fail_first
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                    pending = fake.in_flight
+                threading.Timer(fake.render_sec, fake._finish, (prompt_id, payload.get('client_id'), fail)).start()
+                self._json({"prompt_id": prompt_id, "number": pending})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if fake.down:
+                    self.close_connection = True
+                    return
+                if url.path == '/ws':
+                    return self._websocket()
+                if url.path.startswith('/history/'):
+                    prompt_id = url.path.rsplit('/', 1)[1]
+                    with fake.lock:
+                        entry = fake.history.get(prompt_id)
+                    return self._json({prompt_id: entry} if entry else {})
+                if url.path == '/queue':
+                    with fake.lock:
+                        return self._json({"queue_running": [[0]] * min(fake.in_flight, 1),
+                                           "queue_pending": [[0]] * max(fake.in_flight - 1, 0)})
+                if url.path == '/view':
+                    assert parse_qs(url.query)['filename']
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(fake.png)))
+                    self.end_headers()
+                    self.wfile.write(fake.png)
+                    return
+                self._json({}, 404)
+
+            def _websocket(self):
+                key = self.headers['Sec-WebSocket-Key'] + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', base64.b64encode(hashlib.sha1(key.encode()).digest()).decode())
+                self.end_headers()
+                self.wfile.flush()
+                events = queue.Queue()
+                with fake.lock:
+                    fake.ws_clients.append(events)
+                while True:
+                    message = events.get()
+                    if message is None:
+                        return
+                    data = message.encode()
+                    header = bytes([0x81, len(data)]) if len(data) < 126 else bytes([0x81, 126]) + len(data).to_bytes(2, 'big')
+                    try:
+                        self.wfile.write(header + data)
+                        self.wfile.flush()
+                    except OSError:
+                        return
+
+        return Handler
+
+@pytest.fixture
+def fake_comfy():
+    server = FakeComfy()
+    yield server
+    server.close()
+
+@pytest.fixture
+def comfy_template(tmp_path):
+    template = {
+        "1": {"class_type": "CLIPTextEncode", "inputs": {"text": "$POSITIVE_PROMPT"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "$NEGATIVE_PROMPT"}},
+        "5": {"class_type": "KSampler", "inputs": {"seed": "$SEED", "steps": "$STEPS", "sampler_name": "$SAMPLER_NAME"}},
+        "7": {"class_type": "SaveImage", "inputs": {"filename_prefix": "seg_$INDEX", "images": ["6", 0]}},
+    }
+    path = tmp_path / "template.json"
+    path.write_text(json.dumps(template))
+    return path
+
+class FakeOpenAI:
+    """ OpenAI-compatible /v1/chat/completions that answers segment prompts """
+
+    def __init__(self, rate_limit_first=0, drop_once=(), garbage_once=()):
+        self.rate_limit_first = rate_limit_first
+        self.drop_once = set(drop_once)
+        self.garbage_once = set(garbage_once)
+        self.prompts = {}  # segment index -> prompt to answer instead of "prompt {i}"
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _answer(self, indices):
+        results = []
+        for i in indices:
+            if i in self.drop_once:
+                self.drop_once.discard(i)
+                continue
+            if i in self.garbage_once:
+                self.garbage_once.discard(i)
+                results.append({"segment_index": i, "prompt": ""})
+                continue
+            results.append({"segment_index": i, "prompt": self.prompts.get(i, f"prompt {i}"), "negative_prompt": "neg", "caption": f"caption {i}"})
+        return results
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, data, status=200, headers=()):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with fake.lock:
+                    fake.requests.append(payload)
+                    if len(fake.requests) <= fake.rate_limit_first:
+                        return self._json({"error": {"message": "slow down", "type": "rate_limit"}}, 429, [('Retry-After', '0.2')])
+                    fake.in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake.in_flight)
+                time.sleep(0.05)
+                user = payload['messages'][-1]['content']
+                indices = [int(line.split(':', 1)[0]) for line in user.splitlines()[1:]]
+                with fake.lock:
+                    fake.in_flight -= 1
+                    content = json.dumps({"results": fake._answer(indices)})
+                self._json({"id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": payload['model'],
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": content}}],
+                            "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}})
+
+        return Handler
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    server = FakeOpenAI()
+    monkeypatch.setattr("core.prompt_generator.OPENAI_BASE_URL", server.url)
+    monkeypatch.setattr("core.prompt_generator.OPENAI_API_KEY", "test-key")
+    yield server
+    server.close()
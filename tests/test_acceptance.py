@@ -5,15 +5,17 @@ import os
 from pathlib import Path
 from core.transcript_parser import parse_transcript
 from core.segmenter import segment_transcript
+from benchmarks.synthetic import write_json
 
-def test_basic_parse_and_segment():
+def test_basic_parse_and_segment(tmp_path):
     """ Test parsing transcript and segmenting without full pipeline """
     # Use the provided JSON transcript
     transcript_path = "Time_Traveler_Pensions,_Quantum_Minds,_and_the_ADHD_Spiritual/transcript.json"
     
     if not Path(transcript_path).exists():
-        print("Transcript file not found, skipping")
-        return
+        print("Transcript file not found, using a synthetic one-hour transcript")
+        transcript_path = tmp_path / "transcript.json"
+        write_json(transcript_path, hours=1)
     
     lines = parse_transcript(audio_path=None, srt_path=transcript_path)
     print(f"Parsed {len(lines)} lines from JSON transcript")
@@ -30,4 +32,6 @@ def test_basic_parse_and_segment():
     print("Acceptance test passed!")
 
 if __name__ == "__main__":
-    test_basic_parse_and_segment()
\ No newline at end of file
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        test_basic_parse_and_segment(Path(tmp))
\ No newline at end of file
@@ -0,0 +1,89 @@
+""" Batch mode: manifests, shared pools and the run summary """
+
+import json
+import threading
+import pytest
+from pathlib import Path
+from core.batch import Episode, SharedPools, load_manifest, run_batch
+from core.comfy_client import ComfyClient, ComfyScheduler, ImageJob
+from core.prompt_generator import LLMBudget, generate_prompts
+from core.segmenter import Segment
+from conftest import PNG_BYTES
+
+def test_load_manifest_formats(tmp_path):
+    for name in ("b.mp3", "a.wav", "notes.txt"):
+        (tmp_path / name).write_text("")
+    assert load_manifest(tmp_path) == [Episode(tmp_path / "a.wav"), Episode(tmp_path / "b.mp3")]
+
+    (tmp_path / "list.txt").write_text("# nightly\nep1.mp3\tep1.srt\n\nsub/ep2.mp3  # no transcript\n")
+    assert load_manifest(tmp_path / "list.txt") == [Episode(tmp_path / "ep1.mp3", tmp_path / "ep1.srt"),
+                                                    Episode(tmp_path / "sub/ep2.mp3")]
+
+    (tmp_path / "list.json").write_text(json.dumps(["ep1.mp3", {"audio": "ep2.mp3", "srt": "ep2.json"}]))
+    assert load_manifest(tmp_path / "list.json") == [Episode(tmp_path / "ep1.mp3"),
+                                                     Episode(tmp_path / "ep2.mp3", tmp_path / "ep2.json")]
+
+def test_load_manifest_rejects_shared_output_dirs(tmp_path):
+    (tmp_path / "list.txt").write_text("a/ep.mp3\nb/ep.wav\n")
+    with pytest.raises(ValueError, match="output/ep/"):
+        load_manifest(tmp_path / "list.txt")
+
+def test_run_batch_summarises_throughput_and_failures(tmp_path):
+    def run(episode):
+        if episode.slug == "bad":
+            raise RuntimeError("no audio")
+        return {"output_dir": str(tmp_path / episode.slug), "duration_ms": 60000}
+
+    episodes = [Episode(Path(f"{slug}.mp3")) for slug in ("one", "bad", "two")]
+    summary = run_batch(episodes, run, max_parallel=2, summary_file=tmp_path / "batch_summary.json")
+    assert (summary["episodes"], summary["succeeded"], summary["failed"]) == (3, 2, 1)
+    assert summary["audio_seconds"] == 120
+    assert list(summary["results"]) == ["one", "bad", "two"]
+    assert summary["results"]["bad"]["error"] == "RuntimeError: no audio"
+    assert json.loads((tmp_path / "batch_summary.json").read_text()) == summary
+
+def test_llm_budget_bounds_concurrent_episodes(fake_openai, monkeypatch):
+    monkeypatch.setattr("core.prompt_generator.BACKOFF_SEC", 0.01)
+    segments = [Segment(i, i * 12000, (i + 1) * 12000, "word " * 100) for i in range(8)]
+    budget = LLMBudget(max_in_flight=2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        generate_prompts(segments, "style", "neg", max_tokens=300, max_workers=4, budget=budget))) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(results) == 3
+    assert fake_openai.max_in_flight == 2
+
+def test_shared_scheduler_renders_into_each_episode(fake_comfy, comfy_template, tmp_path):
+    fake_comfy.render_sec = 0.1
+    client = ComfyClient(fake_comfy.url, tmp_path, comfy_template, use_websocket=False, poll_interval=0.02)
+    scheduler = ComfyScheduler(client, max_in_flight=2)
+    done = {}
+
+    def episode(slug):
+        jobs = [ImageJob(i, f"{slug} {i}", "neg", i) for i in range(3)]
+        done[slug], _ = scheduler.run(jobs, output_dir=tmp_path / slug / "images")
+
+    threads = [threading.Thread(target=episode, args=(slug,)) for slug in ("a", "b")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    scheduler.close()
+    assert done["b"][2] == tmp_path / "b" / "images" / "seg_002.png"
+    assert done["a"][2].read_bytes() == PNG_BYTES
+    assert fake_comfy.max_in_flight == 2
+
+def test_shared_pools_reuse_loaded_models(monkeypatch, tmp_path):
+    calls = []
+    monkeypatch.setattr("core.transcript_parser.resolve_device", lambda device: ("cpu", "int8"))
+    monkeypatch.setattr("core.transcript_parser.transcribe_audio",
+                        lambda audio, size, device, model=None, checkpoint=None, mode="single": calls.append(model) or [])
+    pools = SharedPools()
+    pools.models.loader = lambda *key: object()
+    pools.transcribe(tmp_path / "a.mp3", "tiny", "auto")
+    pools.transcribe(tmp_path / "b.mp3", "tiny", "auto")
+    assert calls[0] is calls[1]
+    pools.close()
@@ -0,0 +1,43 @@
+""" Benchmark suite: synthetic transcripts, a tiny suite run and regression detection """
+
+import json
+import pytest
+from benchmarks import run_benchmarks
+from benchmarks.run_benchmarks import compare, run_suite
+from benchmarks.synthetic import write_json, write_srt, write_txt
+from core.transcript_parser import parse_transcript
+
+@pytest.mark.parametrize("write, suffix", [(write_srt, ".srt"), (write_json, ".json"), (write_txt, ".txt")])
+def test_synthetic_transcripts_parse_to_the_requested_length(tmp_path, write, suffix):
+    path = tmp_path / f"episode{suffix}"
+    count = write(path, hours=0.25)
+    lines = parse_transcript(None, str(path))
+    assert len(lines) == count > 100
+    assert lines[-1].end_ms == pytest.approx(0.25 * 3600 * 1000, abs=20000)
+    assert all(line.text for line in lines)
+
+def test_srt_and_json_carry_the_same_lines(tmp_path):
+    write_srt(tmp_path / "a.srt", hours=0.1, seed=3)
+    write_json(tmp_path / "a.json", hours=0.1, seed=3)
+    assert parse_transcript(None, str(tmp_path / "a.srt")) == parse_transcript(None, str(tmp_path / "a.json"))
+
+def test_suite_runs_every_stage(tmp_path):
+    results = run_suite([0.05], repeat=1, workdir=tmp_path)
+    assert {key.split('@')[0] for key in results} == {
+        "parse_srt", "parse_json", "parse_txt", "segment_transcript", "build_captions", "comfy_build_graph", "concat_list"}
+    assert all(r["items"] > 0 and r["peak_mb"] >= 0 for r in results.values())
+
+def test_regressions_beyond_threshold_fail(tmp_path, monkeypatch):
+    baseline = {"parse_srt@1h": {"seconds": 1.0, "peak_mb": 10.0}, "concat_list@1h": {"seconds": 0.001, "peak_mb": 0.1}}
+    results = {"parse_srt@1h": {"seconds": 1.2, "peak_mb": 20.0},
+               "concat_list@1h": {"seconds": 0.002, "peak_mb": 0.2},  # Doubled, but within timer noise
+               "parse_json@1h": {"seconds": 9.0, "peak_mb": 9.0}}  # Not in the baseline
+    assert compare(results, baseline, threshold=0.25) == ["parse_srt@1h: 20.0 MB peak vs baseline 10.0 MB (+100%)"]
+    assert len(compare(results, baseline, threshold=0.1)) == 2
+
+    monkeypatch.setattr(run_benchmarks, "run_suite", lambda *args, **kwargs: results)
+    (tmp_path / "baseline.json").write_text(json.dumps({"machine": {}, "results": baseline}))
+    assert run_benchmarks.main(["--baseline", str(tmp_path / "baseline.json")]) == 1
+    assert run_benchmarks.main(["--baseline", str(tmp_path / "new.json")]) == 2  # No baseline yet
+    assert run_benchmarks.main(["--baseline", str(tmp_path / "new.json"), "--save-baseline"]) == 0
+    assert run_benchmarks.main(["--baseline", str(tmp_path / "new.json")]) == 0
@@ -0,0 +1,64 @@
+""" Columnar Line / Segment stores behave like the lists they replace """
+
+import random
+import sys
+import numpy as np
+from core.captions import format_ms, format_ms_many
+from core.columnar import LineStore, int_column
+from core.segmenter import Segment, SegmentStore, iter_segments, load_segments, segment_transcript, write_segments
+from core.transcript_parser import Line
+
+def _lines(n, seed=0):
+    rng = random.Random(seed)
+    return [Line(i * 1000, i * 1000 + rng.randint(1, 1000), ' '.join(f"w{j}" for j in range(rng.randint(0, 4))))
+            for i in range(n)]
+
+def test_line_store_round_trip():
+    lines = _lines(200)
+    store = LineStore.from_items(lines)
+    assert len(store) == 200
+    assert store == lines and lines == store
+    assert list(store) == lines
+    assert store[0] == lines[0] and store[-1] == lines[-1]
+    assert store[10:20] == lines[10:20]
+    assert store.text(5) == lines[5].text
+    assert store.joined_text(3, 7) == ' '.join(line.text for line in lines[3:7])
+    assert store.joined_text(3, 7, 4) == ' '.join(line.text for line in lines[3:7])[:4]
+    assert store.start_ms.dtype == np.int64 and store.start_ms.tolist() == [line.start_ms for line in lines]
+    assert LineStore.from_items(store) is store
+    assert store != lines[:-1]
+
+def test_empty_store():
+    store = LineStore.from_items([])
+    assert len(store) == 0 and list(store) == [] and store == []
+    assert segment_transcript(store, 12, 900) == []
+
+def test_store_is_smaller_than_tuples():
+    lines = _lines(5000)
+    store = LineStore.from_items(lines)
+    assert store.nbytes < sum(sys.getsizeof(line) + sys.getsizeof(line.text) for line in lines) / 3
+
+def test_segments_share_the_line_buffer_when_ordered(tmp_path):
+    lines = _lines(300, seed=3)
+    segments = segment_transcript(lines, 12, 40, tmp_path / "segments.json")
+    assert isinstance(segments, SegmentStore)
+    store = LineStore.from_items(lines)
+    assert segment_transcript(store, 12, 40).buffer is store.buffer
+    assert segments == list(iter_segments(iter(lines), 12, 40))
+    assert load_segments(tmp_path / "segments.json") == segments
+
+def test_unordered_lines_fall_back_to_a_packed_buffer(tmp_path):
+    lines = _lines(300, seed=4)
+    shuffled = lines[:-1]
+    random.Random(4).shuffle(shuffled)
+    segments = segment_transcript(shuffled + lines[-1:], 12, 900)
+    assert [s[:3] for s in segments] == [s[:3] for s in segment_transcript(lines, 12, 900)]
+    assert segments.buffer is not LineStore.from_items(lines).buffer
+    write_segments(segments, tmp_path / "segments.json")
+    assert load_segments(tmp_path / "segments.json") == segments
+
+def test_format_ms_many_matches_format_ms():
+    rng = random.Random(5)
+    values = [0, 9, 10, 999, 1000, 59999, 3600000, 35999999] + [rng.randrange(10 ** 9) for _ in range(2000)]
+    assert format_ms_many(np.array(values)) == [format_ms(ms) for ms in values]
+    assert format_ms_many(int_column([Segment(0, 1234, 5678, "")], 'end_ms')) == ["0:00:05.67"]
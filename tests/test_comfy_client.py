@@ -0,0 +1,151 @@
+""" ComfyUI client and scheduler against local fake servers """
+
+import threading
+import time
+import pytest
+from core.comfy_client import ComfyClient, ComfyScheduler, ImageJob
+from conftest import FakeComfy, PNG_BYTES
+
+def _jobs(n):
+    return [ImageJob(i, f"prompt {i}", "neg", 100 + i) for i in range(n)]
+
+def test_scheduler_keeps_prompts_in_flight_and_downloads(fake_comfy, comfy_template, tmp_path):
+    fake_comfy.render_sec = 0.2
+    client = ComfyClient(fake_comfy.url, tmp_path / "images", comfy_template, use_websocket=False, poll_interval=0.02)
+    done, failed = ComfyScheduler(client, max_in_flight=3).run(_jobs(7))
+    assert failed == {}
+    assert sorted(done) == list(range(7))
+    assert done[4] == tmp_path / "images" / "seg_004.png"
+    assert done[4].read_bytes() == PNG_BYTES
+    assert fake_comfy.max_in_flight == 3
+    assert not list((tmp_path / "images").glob("*.part"))
+
+def test_completion_over_websocket(fake_comfy, comfy_template, tmp_path):
+    client = ComfyClient(fake_comfy.url, tmp_path / "images", comfy_template, poll_interval=30)
+    assert client.nodes[0]._listener is not None and client.nodes[0]._listener.alive
+    path = client.generate_image("a cat", "blurry", 7, segment_index=2, timeout=5)
+    assert path.read_bytes() == PNG_BYTES
+    graph = next(iter(fake_comfy.prompts.values()))
+    assert graph["7"]["inputs"]["filename_prefix"] == "seg_002"
+    client.close()
+
+def test_signalled_completion_polls_history_at_poll_interval(tmp_path, comfy_template):
+    client = ComfyClient("http://127.0.0.1:9", tmp_path / "images", comfy_template, use_websocket=False, poll_interval=0.05)
+    node = client.nodes[0]
+    calls = []
+
+    class Signalled:
+        """ A listener whose event for the prompt is already set """
+        alive = True
+        def wait(self, prompt_id, timeout):
+            return True
+        def forget(self, prompt_id):
+            pass
+
+    # The ws event arrives before /history has the entry
+    node._listener = Signalled()
+    node.get_history = lambda prompt_id: calls.append(prompt_id) or (None if len(calls) < 4 else {"outputs": {"7": {}}})
+    assert node.wait_for_completion("p1", timeout=5) == {"outputs": {"7": {}}}
+    with pytest.raises(TimeoutError):
+        node.get_history = lambda prompt_id: calls.append(prompt_id)
+        calls.clear()
+        node.wait_for_completion("p2", timeout=0.3)
+    assert len(calls) <= 7
+
+def test_scheduler_retries_then_reports_failures(fake_comfy, comfy_template, tmp_path):
+    fake_comfy.fail_first = 2
+    client = ComfyClient(fake_comfy.url, tmp_path / "images", comfy_template, use_websocket=False, poll_interval=0.01)
+    done, failed = ComfyScheduler(client, max_in_flight=1, retries=2).run(_jobs(1))
+    assert list(done) == [0] and failed == {}
+
+    fake_comfy.submitted, fake_comfy.fail_first = 0, 10
+    done, failed = ComfyScheduler(client, max_in_flight=1, retries=1).run(_jobs(1))
+    assert done == {} and "boom" in str(failed[0])
+    assert fake_comfy.submitted == 2
+
+def test_scheduler_timeout(fake_comfy, comfy_template, tmp_path):
+    fake_comfy.render_sec = 1.0
+    client = ComfyClient(fake_comfy.url, tmp_path / "images", comfy_template, use_websocket=False, poll_interval=0.01)
+    done, failed = ComfyScheduler(client, retries=3, timeout=0.2).run(_jobs(1))
+    assert isinstance(failed[0], TimeoutError)
+    assert fake_comfy.submitted == 1
+
+def test_compiled_template_fills_typed_values(tmp_path):
+    client = ComfyClient("http://127.0.0.1:9", tmp_path / "images", use_websocket=False)
+    graph = client.build_graph("a fox", "blurry", 1280, 720, 42, 20, 5.5, "euler", "karras", segment_index=7)["prompt"]
+    assert graph["1"]["inputs"]["text"] == "a fox"
+    assert graph["4"]["inputs"] == {"width": 1280, "height": 720, "batch_size": 1}
+    assert graph["5"]["inputs"]["seed"] == 42 and graph["5"]["inputs"]["cfg"] == 5.5
+    assert graph["5"]["inputs"]["scheduler"] == "karras"
+    assert graph["7"]["inputs"]["filename_prefix"] == "seg_007"
+    # The compiled template itself is untouched between calls
+    assert client.template.graph["4"]["inputs"]["width"] == "$WIDTH"
+    other = client.build_graph("b", "c", 1, 2, 3, 4, 5, "s", "t", segment_index=8)["prompt"]
+    assert other["4"]["inputs"]["width"] == 1 and graph["4"]["inputs"]["width"] == 1280
+
+def test_build_graph_does_not_reread_template(tmp_path, monkeypatch):
+    client = ComfyClient("http://127.0.0.1:9", tmp_path / "images", use_websocket=False)
+    monkeypatch.setattr("builtins.open", lambda *a, **k: (_ for _ in ()).throw(AssertionError("template re-read")))
+    client.build_graph("a", "b", 1, 2, 3, 4, 5, "s", "t")
+
+@pytest.fixture
+def fake_comfies():
+    servers = []
+
+    def start(n, **kwargs):
+        servers.extend(FakeComfy(**kwargs) for _ in range(n))
+        return servers[-n:]
+
+    yield start
+    for server in servers:
+        server.close()
+
+def test_jobs_go_to_the_least_loaded_node(fake_comfies, comfy_template, tmp_path):
+    busy, idle = fake_comfies(2, render_sec=0.05)
+    busy.in_flight = 20  # Queue filled by someone else
+    client = ComfyClient([busy.url, idle.url], tmp_path / "images", comfy_template, use_websocket=False,
+                         poll_interval=0.01, probe_interval=0)
+    done, failed = ComfyScheduler(client, max_in_flight=2).run(_jobs(8))
+    assert sorted(done) == list(range(8)) and failed == {}
+    assert (busy.submitted, idle.submitted) == (0, 8)
+
+    busy.in_flight = 0
+    done, failed = ComfyScheduler(client, max_in_flight=2).run(_jobs(8))
+    assert busy.submitted > 0 and idle.submitted > 8
+    stats = {node["url"]: node for node in client.node_stats()}
+    assert stats[busy.url]["completed"] + stats[idle.url]["completed"] == 16
+    assert stats[idle.url]["images_per_min"] > 0 and stats[idle.url]["in_flight"] == 0
+    client.close()
+
+def test_jobs_move_away_from_a_dead_node(fake_comfies, comfy_template, tmp_path):
+    flaky, steady = fake_comfies(2, render_sec=0.3)
+    client = ComfyClient([flaky.url, steady.url], tmp_path / "images", comfy_template, use_websocket=False,
+                         poll_interval=0.01, probe_interval=0, health_interval=60)
+    scheduler = ComfyScheduler(client, max_in_flight=2)
+    threading.Timer(0.1, setattr, (flaky, "down", True)).start()  # Dies with renders queued on it
+    done, failed = scheduler.run(_jobs(6))
+    assert sorted(done) == list(range(6)) and failed == {}
+    assert all(path.read_bytes() == PNG_BYTES for path in done.values())
+    stats = {node["url"]: node for node in client.node_stats()}
+    assert not stats[flaky.url]["healthy"] and stats[flaky.url]["moved"] > 0
+    assert stats[steady.url]["completed"] == 6
+
+    # Every node down: the job fails instead of hanging
+    steady.down = True
+    done, failed = ComfyScheduler(client, max_in_flight=1, retries=0).run(_jobs(1))
+    assert "No ComfyUI server reachable" in str(failed[0])
+    client.close()
+
+def test_a_node_that_comes_back_is_used_again(fake_comfies, comfy_template, tmp_path):
+    first, second = fake_comfies(2)
+    first.down = True
+    client = ComfyClient([first.url, second.url], tmp_path / "images", comfy_template, use_websocket=False,
+                         poll_interval=0.01, probe_interval=0, health_interval=0.2)
+    client.generate_image("a", "b", 1, timeout=5)
+    assert (first.submitted, second.submitted) == (0, 1)
+    first.down = False
+    second.in_flight = 5
+    time.sleep(0.25)
+    client.generate_image("a", "b", 1, timeout=5)
+    assert first.submitted == 1
+    client.close()
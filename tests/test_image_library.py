@@ -0,0 +1,109 @@
+""" Image library: prompt similarity, scopes, persistence and reuse by the ComfyUI scheduler """
+
+import json
+import pytest
+from core.comfy_client import ComfyClient, ComfyScheduler, ImageJob
+from core.image_library import ImageLibrary
+from conftest import PNG_BYTES
+
+SCOPE = {"style": "cinematic", "width": 1280}
+
+@pytest.fixture
+def rendered(tmp_path):
+    image = tmp_path / "render.png"
+    image.write_bytes(PNG_BYTES)
+    return image
+
+def test_similar_prompts_match_within_scope(tmp_path, rendered):
+    library = ImageLibrary(tmp_path / "library", threshold=0.6)
+    library.add(rendered, "a lighthouse on a rocky coast at dusk, dramatic clouds", "blurry", 7, SCOPE)
+    library.add(rendered, "a crowded city market at noon, colorful stalls", "blurry", 8, SCOPE)
+
+    close, far, other_scope = (library.find_many(["a lighthouse on a rocky coast at dusk, dramatic sky"], SCOPE)[0],
+                               library.find_many(["an astronaut floating above the moon"], SCOPE)[0],
+                               library.find_many(["a lighthouse on a rocky coast at dusk, dramatic clouds"],
+                                                 {**SCOPE, "width": 640})[0])
+    assert close.seed == 7 and close.score >= 0.6
+    assert close.path.read_bytes() == PNG_BYTES
+    assert far is None
+    assert other_scope is None
+    library.close()
+
+def test_library_persists_and_respects_read(tmp_path, rendered):
+    library = ImageLibrary(tmp_path / "library")
+    library.add(rendered, "a red fox in snow", "", 1, SCOPE)
+    assert library.find_many(["a red fox in snow"], SCOPE) == [None]  # Reuse is opt-in
+    library.close()
+
+    reopened = ImageLibrary(tmp_path / "library", threshold=0.9)
+    assert len(reopened) == 1
+    assert reopened.find_many(["a red fox in snow"], SCOPE)[0].score == pytest.approx(1.0)
+    reopened.close()
+    assert ImageLibrary(tmp_path / "library", threshold=0.9, read=False).find_many(["a red fox in snow"], SCOPE) == [None]
+    assert ImageLibrary(tmp_path / "library", threshold=None).find_many(["a red fox in snow"], SCOPE) == [None]
+
+def test_library_loads_only_the_scopes_it_searches(tmp_path, rendered):
+    library = ImageLibrary(tmp_path / "library")
+    for i in range(20):
+        library.add(rendered, f"a red fox in snow {i}", "", i, {**SCOPE, "width": 640 if i % 2 else 1280})
+    library.close()
+
+    # Reuse off (the default) or --force: nothing is read back
+    for off in (ImageLibrary(tmp_path / "library"), ImageLibrary(tmp_path / "library", threshold=0.5, read=False)):
+        assert off.find_many(["a red fox in snow 3"], SCOPE) == [None] and not off._scopes
+        off.close()
+    library = ImageLibrary(tmp_path / "library", threshold=0.5)
+    assert len(library) == 20 and not library._scopes
+    assert library.find_many(["a red fox in snow 4"], SCOPE)[0].seed == 4
+    assert len(library._scopes) == 1 and len(next(iter(library._scopes.values())).files) == 10
+    # Adds to a loaded scope are searchable at once
+    library.add(rendered, "a blue whale at sea", "", 99, SCOPE)
+    assert library.find_many(["a blue whale at sea"], SCOPE)[0].seed == 99
+    library.close()
+
+def test_scheduler_renders_duplicate_prompts_once(fake_comfy, comfy_template, tmp_path):
+    client = ComfyClient(fake_comfy.url, tmp_path / "images", comfy_template, use_websocket=False, poll_interval=0.02)
+    scheduler = ComfyScheduler(client, max_in_flight=2)
+    sources = {}
+    jobs = [ImageJob(0, "same prompt", "neg", 0), ImageJob(1, "other prompt", "neg", 1),
+            ImageJob(2, "same prompt", "neg", 2)]
+    done, failed = scheduler.run(jobs, on_done=lambda job, path, source: sources.__setitem__(job.segment_index, source))
+    scheduler.close()
+    assert not failed
+    assert fake_comfy.submitted == 2
+    assert sources == {0: "rendered", 1: "rendered", 2: "duplicate"}
+    assert done[2].read_bytes() == PNG_BYTES
+
+def test_scheduler_reuses_library_images(fake_comfy, comfy_template, tmp_path):
+    library = ImageLibrary(tmp_path / "library", threshold=0.9)
+    scope = {"style": "cinematic"}
+
+    def render(episode, negative="neg", template=comfy_template):
+        client = ComfyClient(fake_comfy.url, tmp_path / episode, template, use_websocket=False, poll_interval=0.02)
+        scheduler = ComfyScheduler(client, max_in_flight=2, library=library, width=64, height=64)
+        sources = {}
+        jobs = [ImageJob(0, "a lighthouse at dusk", negative, 0), ImageJob(1, f"{episode} title card", negative, 1)]
+        done, _ = scheduler.run(jobs, on_done=lambda job, path, source: sources.__setitem__(job.segment_index, source),
+                                scope=scope)
+        scheduler.close()
+        return done, sources
+
+    render("ep1")
+    assert fake_comfy.submitted == 2 and len(library) == 2
+    done, sources = render("ep2")
+    assert fake_comfy.submitted == 3
+    assert sources == {0: "library", 1: "rendered"}
+    assert done[0] == tmp_path / "ep2" / "seg_000.png" and done[0].read_bytes() == PNG_BYTES
+
+    # A different negative prompt or checkpoint renders again
+    _, sources = render("ep3", negative="text, watermark")
+    assert sources == {0: "rendered", 1: "rendered"}
+    graph = json.loads(comfy_template.read_text())
+    graph["3"] = {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "other.safetensors"}}
+    other = tmp_path / "other.json"
+    other.write_text(json.dumps(graph))
+    _, sources = render("ep4", template=other)
+    assert sources == {0: "rendered", 1: "rendered"}
+    scopes = [json.loads(row[0]) for row in library.db.execute("SELECT scope FROM images")]
+    assert scopes[-1]["models"] == ["other.safetensors"] and scopes[-1]["negative"] == "neg"
+    library.close()
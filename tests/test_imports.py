@@ -0,0 +1,67 @@
+""" Startup cost: heavy backends are imported only when a run selects them """
+
+import re
+import shutil
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+import pytest
+from config import FFMPEG_EXE
+from core.backends import TRANSCRIPT_FORMATS, Registry
+
+REPO = Path(__file__).resolve().parent.parent
+# Transcription, LLM and ComfyUI dependencies; none is needed to start the CLI or to run from a transcript
+HEAVY = ("faster_whisper", "ctranslate2", "av", "onnxruntime", "openai", "requests")
+# Cumulative import time of the CLI module; it measures ~20 ms, this leaves room for slow machines
+IMPORT_BUDGET_MS = 150
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(FFMPEG_EXE) is None, reason="ffmpeg not installed")
+
+def _python(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-X", "importtime", "-c", textwrap.dedent(code)], cwd=REPO,
+                          capture_output=True, text=True, check=True)
+
+def _loaded(stdout: str) -> set:
+    return set(stdout.split()) & set(HEAVY)
+
+def test_cli_import_stays_within_budget():
+    run = _python(f"""
+        import sys
+        import podcast_video_factory
+        print(*sys.modules)
+    """)
+    assert not _loaded(run.stdout)
+    cumulative = re.search(r"\|\s*(\d+) \| podcast_video_factory$", run.stderr, re.M)
+    assert int(cumulative.group(1)) / 1000 < IMPORT_BUDGET_MS
+
+def test_registry_imports_on_first_use():
+    registry = Registry("widget", {"ok": "json:dumps"})
+    assert "ok" in registry and registry.names() == ["ok"]
+    assert registry.get("ok")([1]) == "[1]"
+    with pytest.raises(ValueError, match="Unknown widget: nope"):
+        registry.get("nope")
+    with pytest.raises(ValueError, match="module:attribute"):
+        registry.register("bad", "json.dumps")
+    assert set(TRANSCRIPT_FORMATS.names()) == {".srt", ".json", ".txt"}
+
+@needs_ffmpeg
+def test_transcript_runs_skip_heavy_backends(tmp_path):
+    audio = tmp_path / "episode.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=30", str(audio)], check=True)
+    # A fresh run from an SRT, then a resume served from the stage cache
+    run = _python(f"""
+        import sys
+        import podcast_video_factory as factory
+        from benchmarks.synthetic import write_srt
+        factory.OPENAI_API_KEY = "YOUR_KEY"
+        factory.PREVIEW_IMAGES = "cards"
+        write_srt({str(tmp_path / 'episode.srt')!r}, 30 / 3600)
+        args = factory.build_parser().parse_args(["--audio", {str(audio)!r}, "--srt", {str(tmp_path / 'episode.srt')!r},
+                                                  "--out", {str(tmp_path / 'out')!r}, "--preview"])
+        for _ in range(2):
+            factory.run_episode(args.audio, args.srt, args)
+        print(*sys.modules)
+    """)
+    assert (tmp_path / "out" / "episode" / "preview" / "preview.mp4").exists()
+    assert not _loaded(run.stdout)
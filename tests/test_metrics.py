@@ -0,0 +1,77 @@
+""" Run metrics: stage spans, external call latencies, Prometheus output and run.log handlers """
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from core.logging_utils import setup_logger
+from core.metrics import RunMetrics, activate, bind, timed_call
+
+def _events(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_spans_and_calls_are_written_as_jsonl(tmp_path):
+    metrics = RunMetrics(tmp_path / "metrics.jsonl", episode="ep1")
+    with activate(metrics):
+        with metrics.span("images") as span:
+            span.update(items=3, cache_hits=1)
+            with timed_call("comfyui", "view"):
+                pass
+        with pytest.raises(RuntimeError):
+            with metrics.span("video"):
+                with timed_call("ffmpeg", "encode"):
+                    raise RuntimeError("ffmpeg failed")
+    metrics.close()
+
+    events = _events(tmp_path / "metrics.jsonl")
+    spans = {e["stage"]: e for e in events if e["type"] == "span"}
+    assert spans["images"]["items"] == 3 and spans["images"]["cache_hits"] == 1
+    assert spans["video"]["status"] == "error"
+    calls = [e for e in events if e["type"] == "call"]
+    assert {(c["service"], c["operation"], c["stage"]) for c in calls} == {
+        ("comfyui", "view", "images"), ("ffmpeg", "encode", "video")}
+    assert events[-1]["type"] == "summary"
+    assert events[-1]["calls"]["ffmpeg.encode"]["errors"] == 1
+    assert all(e["episode"] == "ep1" and e["run"] == metrics.run_id for e in events)
+
+def test_bound_threads_report_to_the_callers_run(tmp_path):
+    metrics = RunMetrics(tmp_path / "metrics.jsonl")
+
+    def call():
+        with timed_call("openai", "chat.completions"):
+            pass
+
+    with activate(metrics), metrics.span("prompts"):
+        with ThreadPoolExecutor(2) as pool:
+            for future in [pool.submit(bind(call)) for _ in range(4)]:
+                future.result()
+            pool.submit(call).result()  # Not bound: no active run in the worker
+    assert metrics.summary()["calls"]["openai.chat.completions"]["count"] == 4
+    metrics.close()
+    with timed_call("openai", "chat.completions"):  # No active run: a no-op
+        pass
+
+def test_prometheus_textfile(tmp_path):
+    metrics = RunMetrics(tmp_path / "metrics.jsonl", episode='ep "1"')
+    with activate(metrics), metrics.span("video") as span:
+        span["items"] = 4
+        with timed_call("ffmpeg", "concat"):
+            pass
+    metrics.close()
+    metrics.write_prometheus(tmp_path / "prom" / "ep1.prom")
+
+    text = (tmp_path / "prom" / "ep1.prom").read_text()
+    assert '# TYPE podcast_stage_wall_seconds gauge' in text
+    assert 'podcast_stage_items{episode="ep \\"1\\"",stage="video"} 4' in text
+    assert 'podcast_external_calls{episode="ep \\"1\\"",service="ffmpeg",operation="concat"} 1' in text
+    assert not list((tmp_path / "prom").glob(".*.tmp"))
+
+def test_setup_logger_does_not_duplicate_handlers(tmp_path):
+    log_file = tmp_path / "run.log"
+    logger = setup_logger(log_file, "test_metrics.logger")
+    setup_logger(log_file, "test_metrics.logger")
+    logger.info("once")
+    for handler in logger.handlers[:]:
+        handler.close()
+        logger.removeHandler(handler)
+    assert log_file.read_text().count("once") == 1
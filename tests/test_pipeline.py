@@ -0,0 +1,150 @@
+""" Stage-graph executor and the streamed episode pipeline """
+
+import json
+import shutil
+import subprocess
+import time
+import pytest
+from config import FFMPEG_EXE
+from core.pipeline import Pipeline, Stage
+from core.segmenter import load_segments
+from core.video_assembler import assemble_video
+from benchmarks.synthetic import write_srt
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(FFMPEG_EXE) is None, reason="ffmpeg not installed")
+
+def _square(x):
+    return x * x
+
+def test_items_stream_between_stages():
+    started, finished = {}, {}
+
+    def slow(stage, sec):
+        def run(item):
+            started.setdefault(stage, time.monotonic())
+            time.sleep(sec)
+            finished[stage] = time.monotonic()
+            return item
+        return run
+
+    pipeline = Pipeline([Stage("a", slow("a", 0.05)), Stage("b", slow("b", 0.05), ("a",))])
+    t0 = time.monotonic()
+    out = pipeline.run(range(8))
+    assert sorted(out["b"]) == list(range(8)) and "a" not in out
+    assert started["b"] < finished["a"]
+    # Two 0.4 s stages overlap: close to one stage's cost, not the sum
+    assert time.monotonic() - t0 < 0.65
+
+def test_bounded_queues_hold_back_the_source():
+    pulled = []
+
+    def source():
+        for i in range(50):
+            pulled.append(i)
+            yield i
+
+    seen = []
+
+    def slow(item):
+        seen.append(len(pulled))
+        time.sleep(0.01)
+        return item
+
+    Pipeline([Stage("slow", slow)], queue_size=2).run(source())
+    assert max(n - k for k, n in enumerate(seen)) <= 4  # Queue slots, the item in hand and one being pushed
+
+def test_fan_out_multiple_inputs_and_process_stages():
+    stages = [Stage("split", lambda n: range(n), fan_out=True),
+              Stage("square", _square, ("split",), workers=2, executor="process"),
+              Stage("join", lambda event: [event], ("split", "square"), executor="inline", fan_out=True)]
+    out = Pipeline(stages).run([3])["join"]
+    assert sorted(x for source, x in out if source == "split") == [0, 1, 2]
+    assert sorted(x for source, x in out if source == "square") == [0, 1, 4]
+
+def test_first_error_cancels_the_run():
+    processed = []
+
+    def flaky(item):
+        if item == 2:
+            raise RuntimeError("boom")
+        processed.append(item)
+        return item
+
+    with pytest.raises(RuntimeError, match="boom"):
+        Pipeline([Stage("flaky", flaky), Stage("after", lambda x: x, ("flaky",))], queue_size=1).run(range(1000))
+    assert len(processed) < 10
+
+def test_stage_names_are_checked():
+    with pytest.raises(ValueError, match="unknown stages"):
+        Pipeline([Stage("a", _square, ("missing",))])
+    with pytest.raises(ValueError, match="Duplicate"):
+        Pipeline([Stage("a", _square), Stage("a", _square)])
+
+def _events(metrics_file):
+    return [json.loads(line) for line in metrics_file.read_text().splitlines()]
+
+@needs_ffmpeg
+def test_streamed_run_encodes_segments_before_the_video_stage(tmp_path, monkeypatch, fake_openai):
+    import podcast_video_factory as factory
+    monkeypatch.setattr(factory, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(factory, "PREVIEW_IMAGES", "cards")
+    monkeypatch.setattr(factory, "LLM_BATCH_TOKENS", 1)  # One segment per LLM request
+    monkeypatch.setattr(factory, "LLM_MAX_WORKERS", 1)
+    audio = tmp_path / "episode.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=60", str(audio)], check=True)
+    srt = tmp_path / "episode.srt"
+    write_srt(srt, 60 / 3600)
+    out = tmp_path / "out"
+
+    args = factory.build_parser().parse_args(["--audio", str(audio), "--srt", str(srt), "--out", str(out), "--preview",
+                                              "--encode-mode", "chunked", "--pipeline", "streamed"])
+    factory.run_episode(str(audio), str(srt), args)
+    episode = out / "episode"
+    events = _events(episode / "metrics.jsonl")
+    stages = events[-1]["stages"]
+    assert stages["prompts"]["items"] == stages["images"]["cards"] == stages["encode"]["encoded"] == 5
+    assert len(fake_openai.requests) == 5
+    # The first segment was encoded while the LLM was still answering later ones
+    calls = [e for e in events if e["type"] == "call"]
+    first_encode = min(e["ts"] for e in calls if e["operation"] == "encode_chunk")
+    assert first_encode < max(e["ts"] for e in calls if e["service"] == "openai")
+    assert (episode / "preview" / "preview.mp4").stat().st_size > 0
+    assert len(json.loads((episode / "prompts.json").read_text())["results"]) == 5
+
+    # Streamed chunks carry the keys a sequential chunked encode gives them
+    encoded = assemble_video(str(audio), episode / "preview" / "images", episode / "captions.ass",
+                             episode / "preview" / "preview.mp4", load_segments(episode / "segments.json"),
+                             mode="chunked", profile="preview")
+    assert encoded == 0
+
+    # A re-run is served from the stage cache
+    factory.run_episode(str(audio), str(srt), args)
+    stages = _events(episode / "metrics.jsonl")[-1]["stages"]
+    assert stages["prompts"]["cache_hits"] == 5 and stages["video"]["cache_hits"] == 5
+    assert len(fake_openai.requests) == 5
+
+@needs_ffmpeg
+def test_streamed_run_renders_repeated_prompts_once(tmp_path, monkeypatch, fake_openai, fake_comfy):
+    import podcast_video_factory as factory
+    from core.cards import write_card
+    monkeypatch.setattr(factory, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(factory, "LLM_BATCH_TOKENS", 1)  # One segment per LLM request, each rendered on its own
+    fake_openai.prompts = {i: f"prompt {i % 2}" for i in range(5)}
+    fake_comfy.render_sec = 0.3  # Repeats arrive while the first render is still in flight
+    write_card(tmp_path / "render.png", 320, 180, (40, 40, 40))
+    fake_comfy.png = (tmp_path / "render.png").read_bytes()
+    audio = tmp_path / "episode.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=60", str(audio)], check=True)
+    srt = tmp_path / "episode.srt"
+    write_srt(srt, 60 / 3600)
+    out = tmp_path / "out"
+
+    args = factory.build_parser().parse_args(["--audio", str(audio), "--srt", str(srt), "--out", str(out),
+                                              "--comfy-url", fake_comfy.url, "--pipeline", "streamed",
+                                              "--width", "320", "--height", "180"])
+    factory.run_episode(str(audio), str(srt), args)
+    assert fake_comfy.submitted == 2
+    stages = _events(out / "episode" / "metrics.jsonl")[-1]["stages"]
+    assert stages["images"]["rendered"] == 2 and stages["images"]["duplicates"] == 3
+    images = out / "episode" / "images"
+    assert all((images / f"seg_{i:03d}.png").read_bytes() == fake_comfy.png for i in range(5))
@@ -0,0 +1,61 @@
+""" --preview: placeholder cards, the preview encoder profile and a draft run sharing the stage cache """
+
+import json
+import re
+import shutil
+import subprocess
+import pytest
+from config import FFMPEG_EXE
+from core.cards import card_colour, write_card
+from core.video_assembler import encode_args, png_size
+from benchmarks.synthetic import write_srt
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(FFMPEG_EXE) is None, reason="ffmpeg not installed")
+
+def test_card_colour_depends_on_the_prompt():
+    assert card_colour("a forest") == card_colour("a forest")
+    assert card_colour("a forest") != card_colour("a desert")
+    assert all(0 <= c <= 255 for c in card_colour("x"))
+
+@needs_ffmpeg
+def test_write_card_is_a_valid_png(tmp_path):
+    path = tmp_path / "card.png"
+    write_card(path, 64, 36, (10, 200, 30))
+    assert png_size(path) == (64, 36)
+    raw = subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-i', str(path), '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'],
+                         capture_output=True, check=True).stdout
+    assert raw == bytes((10, 200, 30)) * 64 * 36
+
+def test_preview_profile_uses_ultrafast():
+    args = encode_args(5, "10M", "preview")
+    assert args[args.index('-preset') + 1] == "ultrafast" and '-b:v' not in args
+
+def _summary(metrics_file):
+    return [json.loads(line) for line in metrics_file.read_text().splitlines()][-1]
+
+@needs_ffmpeg
+def test_preview_run_shares_the_stage_cache(tmp_path, monkeypatch):
+    import podcast_video_factory as factory
+    monkeypatch.setattr(factory, "OPENAI_API_KEY", "YOUR_KEY")
+    monkeypatch.setattr(factory, "PREVIEW_IMAGES", "cards")
+    audio = tmp_path / "episode.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=60", str(audio)], check=True)
+    srt = tmp_path / "episode.srt"
+    write_srt(srt, 60 / 3600)
+    out = tmp_path / "out"
+
+    args = factory.build_parser().parse_args(["--audio", str(audio), "--srt", str(srt), "--out", str(out), "--preview"])
+    factory.run_episode(str(audio), str(srt), args)
+    preview = out / "episode" / "preview" / "preview.mp4"
+    err = subprocess.run([FFMPEG_EXE, '-i', str(preview)], capture_output=True, text=True).stderr
+    assert re.search(r"640x360.* 5 fps", err)
+    assert not (out / "episode" / "final.mp4").exists()
+    assert len(list((out / "episode" / "preview" / "images").glob("seg_*.png"))) == 5
+    stages = _summary(out / "episode" / "metrics.jsonl")["stages"]
+    assert stages["images"]["cards"] == 5
+
+    # Their keys do not depend on --preview, so any later run (preview or full) reuses them
+    factory.run_episode(str(audio), str(srt), args)
+    stages = _summary(out / "episode" / "metrics.jsonl")["stages"]
+    for stage in ("transcript", "segments", "prompts", "captions", "video"):
+        assert stages[stage]["cache_hits"] == stages[stage]["items"] > 0, stage
@@ -0,0 +1,75 @@
+""" Prompt generation against a local fake OpenAI-compatible server """
+
+import time
+import pytest
+from core.prompt_generator import generate_prompts, batch_segments
+from core.segmenter import Segment
+from core.prompt_cache import PromptCache
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr("core.prompt_generator.BACKOFF_SEC", 0.01)
+
+def _segments(n, text="word " * 100):
+    return [Segment(i, i * 12000, (i + 1) * 12000, text) for i in range(n)]
+
+def test_batch_segments_respects_token_budget():
+    batches = batch_segments(_segments(10), max_tokens=500)
+    assert [s.index for b in batches for s in b] == list(range(10))
+    assert [len(b) for b in batches] == [2, 2, 2, 2, 2]
+    # A single oversized segment still gets its own batch
+    assert len(batch_segments(_segments(1, "x" * 10000), max_tokens=100)) == 1
+
+def test_batches_run_concurrently_and_merge_by_index(fake_openai):
+    result = generate_prompts(_segments(12), "style", "neg", max_tokens=500, max_workers=3)
+    assert [r["segment_index"] for r in result["results"]] == list(range(12))
+    assert result["results"][5]["caption"] == "caption 5"
+    assert len(fake_openai.requests) == 6
+    assert fake_openai.max_in_flight == 3
+
+def test_only_missing_or_invalid_indices_are_retried(fake_openai):
+    fake_openai.drop_once = {3}
+    fake_openai.garbage_once = {7}
+    result = generate_prompts(_segments(10), "style", "neg", max_tokens=2000, max_workers=2)
+    assert [r["prompt"] for r in result["results"]] == [f"prompt {i}" for i in range(10)]
+    retried = fake_openai.requests[-1]["messages"][-1]["content"]
+    assert retried == "Segments:\n3: " + "word " * 100 + "\n7: " + "word " * 100
+
+def test_rate_limit_honors_retry_after(fake_openai):
+    fake_openai.rate_limit_first = 2
+    start = time.monotonic()
+    result = generate_prompts(_segments(4), "style", "neg", max_tokens=300, max_workers=2)
+    assert len(result["results"]) == 4
+    assert time.monotonic() - start >= 0.2
+
+def test_gives_up_after_retries(fake_openai):
+    fake_openai.rate_limit_first = 100
+    with pytest.raises(ValueError, match="4 segments"):
+        generate_prompts(_segments(4), "style", "neg", retry=1, max_tokens=300)
+
+def test_prompt_cache_skips_unchanged_segments(fake_openai, tmp_path):
+    cache = PromptCache(tmp_path / "prompts.sqlite")
+    segments = [Segment(i, i * 12000, (i + 1) * 12000, f"text {i}") for i in range(3)]
+    generate_prompts(segments, "style", "neg", cache=cache)
+    assert len(fake_openai.requests) == 1 and (cache.hits, cache.misses) == (0, 3)
+
+    # Re-cut episode: same texts at new indices, plus one new segment
+    segments = [Segment(i + 10, 0, 12000, f"text {i}") for i in range(3)] + [Segment(20, 0, 12000, "new text")]
+    result = generate_prompts(segments, "style", "neg", cache=cache)
+    assert [r["segment_index"] for r in result["results"]] == [10, 11, 12, 20]
+    assert fake_openai.requests[-1]["messages"][-1]["content"] == "Segments:\n20: new text"
+    assert cache.hits == 3
+
+    generate_prompts(_segments(1), "other style", "neg", cache=cache)
+    assert len(fake_openai.requests) == 3
+
+def test_prompt_cache_lru_eviction(tmp_path):
+    cache = PromptCache(tmp_path / "prompts.sqlite", max_entries=2)
+    cache.put_many({"a": {"prompt": "a"}})
+    cache.put_many({"b": {"prompt": "b"}})
+    cache.get_many(["a"])
+    cache.put_many({"c": {"prompt": "c"}})
+    assert len(cache) == 2
+    assert set(cache.get_many(["a", "b", "c"])) == {"a", "c"}
+    cache.close()
+    assert PromptCache(tmp_path / "prompts.sqlite", read=False).get_many(["a"]) == {}
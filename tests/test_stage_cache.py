@@ -0,0 +1,101 @@
+""" Stage cache tests """
+
+from core.stage_cache import StageCache
+
+def test_key_covers_inputs(tmp_path):
+    cache = StageCache(tmp_path)
+    assert cache.key("prompts", style="a", segments="x") == cache.key("prompts", segments="x", style="a")
+    assert cache.key("prompts", style="a", segments="x") != cache.key("prompts", style="b", segments="x")
+    assert cache.key("prompts", style="a") != cache.key("captions", style="a")
+
+def test_run_file_stage_reuses_only_matching_inputs(tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    dest = tmp_path / "out.txt"
+    calls = []
+
+    def build(text):
+        def _build():
+            calls.append(text)
+            dest.write_text(text)
+        return _build
+
+    assert not cache.run_file_stage("captions", cache.key("captions", style="a"), dest, build("A"))
+    assert cache.run_file_stage("captions", cache.key("captions", style="a"), dest, build("A"))
+    assert not cache.run_file_stage("captions", cache.key("captions", style="b"), dest, build("B"))
+    assert calls == ["A", "B"]
+    # Rebuilding into a hard-linked dest must not corrupt the cached entry
+    assert cache.run_file_stage("captions", cache.key("captions", style="a"), dest, build("A"))
+    assert dest.read_text() == "A"
+    assert (cache.hits, cache.misses) == (2, 2)
+
+def test_placeholder_outputs_are_not_cached_and_force_skips_reads(tmp_path):
+    cache = StageCache(tmp_path / "cache")
+    dest = tmp_path / "final.mp4"
+    key = cache.key("video", audio="x")
+    cache.run_file_stage("video", key, dest, lambda: dest.write_text("dummy") and False)
+    assert not cache.path("video", key, ".mp4").exists()
+
+    cache.run_file_stage("video", key, dest, lambda: dest.write_text("real"))
+    forced = StageCache(tmp_path / "cache", read=False)
+    assert not forced.run_file_stage("video", key, dest, lambda: dest.write_text("again"))
+    assert dest.read_text() == "again"
+
+def test_json_round_trip(tmp_path):
+    cache = StageCache(tmp_path)
+    key = cache.key("transcript", audio="abc")
+    assert cache.load_json("transcript", key) is None
+    cache.save_json("transcript", key, [[0, 1000, "hi"]])
+    assert cache.load_json("transcript", key) == [[0, 1000, "hi"]]
+
+def test_editable_outputs_are_copies_and_edits_are_kept(tmp_path):
+    run_dir = tmp_path / "out"
+    run_dir.mkdir()
+    dest = run_dir / "prompts.json"
+    key_a, key_b = StageCache(tmp_path).key("prompts", style="a"), StageCache(tmp_path).key("prompts", style="b")
+
+    def build(text):
+        return lambda: dest.write_text(text)
+
+    cache = StageCache(tmp_path / "cache", run_dir=run_dir)
+    cache.run_file_stage("prompts", key_a, dest, build("A"), editable=True)
+    cache.save_state()
+    # An in-place write never reaches the cache entry
+    with open(dest, 'w') as f:
+        f.write("in place")
+    assert cache.path("prompts", key_a, ".json").read_text() == "A"
+
+    # A later run keeps the edit, however it was saved
+    dest.with_name("edit.tmp").write_text("replaced")
+    dest.with_name("edit.tmp").replace(dest)
+    cache = StageCache(tmp_path / "cache", run_dir=run_dir)
+    assert cache.run_file_stage("prompts", key_a, dest, build("A"), editable=True)
+    assert dest.read_text() == "replaced" and cache.edited == {dest}
+    assert StageCache(tmp_path / "cache", run_dir=run_dir).fetch("prompts", key_b, dest, editable=True)
+    assert dest.read_text() == "replaced"
+
+    # --force discards the edit; outputs the pipeline wrote are replaced as before
+    forced = StageCache(tmp_path / "cache", read=False, run_dir=run_dir)
+    assert not forced.run_file_stage("prompts", key_b, dest, build("B"), editable=True)
+    forced.save_state()
+    cache = StageCache(tmp_path / "cache", run_dir=run_dir)
+    assert cache.run_file_stage("prompts", key_a, dest, build("A"), editable=True)
+    assert dest.read_text() == "A" and not cache.edited
+
+def test_transcript_key_covers_transcription_settings(tmp_path, monkeypatch):
+    import podcast_video_factory as factory
+    parser = factory.build_parser()
+    cache = StageCache(tmp_path)
+
+    def key(*flags):
+        args = parser.parse_args(["--audio", "a.mp3", *flags])
+        return cache.key("transcript", audio="x", **factory.transcription_settings(args))
+
+    keys = {key(), key("--whisper-mode", "parallel"), key("--whisper-mode", "batched"), key("--whisper-device", "cpu"),
+            key("--whisper-model", "tiny")}
+    assert len(keys) == 5
+    assert key("--whisper-mode", "parallel", "--whisper-workers", "3") == key("--whisper-mode", "parallel")
+    single, parallel, batched = key("--whisper-mode", "single"), key("--whisper-mode", "parallel"), key("--whisper-mode", "batched")
+    monkeypatch.setattr(factory, "TRANSCRIBE_VAD_MIN_SILENCE_MS", 250)
+    monkeypatch.setattr(factory, "TRANSCRIBE_BATCH_SIZE", 8)
+    assert key("--whisper-mode", "single") == single
+    assert key("--whisper-mode", "parallel") != parallel and key("--whisper-mode", "batched") != batched
@@ -0,0 +1,94 @@
+""" Streaming transcript parsers give the same Lines as whole-file parsing """
+
+import json
+import re
+import pytest
+from benchmarks.synthetic import write_json, write_srt, write_txt
+from core.transcript_parser import (Line, iter_json_transcript, iter_srt, iter_text_transcript, iter_transcript,
+                                    parse_transcript)
+
+def _pysrt_lines(path):
+    pysrt = pytest.importorskip("pysrt")
+    return [Line(sub.start.ordinal, sub.end.ordinal, sub.text.strip().replace('\n', ' ')) for sub in pysrt.open(str(path))]
+
+def _regex_lines(path):
+    """ The previous whole-file parser for speaker transcripts """
+    with open(path) as f:
+        content = f.read()
+    pattern = re.compile(r'\[([^\]]+)\]\s*-\s*(\d{1,2}):(\d{2}):(\d{2})\.(\d{3})\s*(.*?)(?=\n\[|\n$|$)', re.DOTALL)
+    lines = []
+    for speaker, hh, mm, ss, mmm, text_chunk in pattern.findall(content):
+        start_ms = ((int(hh) * 60 + int(mm)) * 60 + int(ss)) * 1000 + int(mmm)
+        text_lines = [line.strip() for line in text_chunk.split('\n') if line.strip()]
+        lines.extend(Line(start_ms + i * 3000, start_ms + (i + 1) * 3000, t) for i, t in enumerate(text_lines))
+    return lines
+
+SRT_EDGE_CASES = (
+    "\ufeff1\r\n00:00:01,000 --> 00:00:02,500\r\nFirst line\r\n  second line  \r\n\r\n"
+    "00:00:03.000 --> 00:00:04.000 X1:10 X2:20\nNo cue number, dot separators, position\n\n\n"
+    "3\nnot a timestamp\nskipped\n\n"
+    "4\n00:00:05,000 --> 00:00:06,000\n\n"
+    "5\n00:00:07,5 --> 00:00:08,12ms\n<i>Short</i> fields\n"
+)
+
+def test_srt_matches_pysrt(tmp_path):
+    path = tmp_path / "edge.srt"
+    path.write_bytes(SRT_EDGE_CASES.encode('utf-8'))
+    assert list(iter_srt(path)) == _pysrt_lines(path)
+    assert list(iter_srt(path))[0] == Line(1000, 2500, "First line   second line")
+
+    path.write_bytes(SRT_EDGE_CASES.encode('utf-16'))
+    assert list(iter_srt(path)) == _pysrt_lines(path)
+
+    write_srt(path, hours=0.5)
+    assert list(iter_srt(path)) == _pysrt_lines(path)
+
+def test_text_transcript_matches_regex_parser(tmp_path):
+    path = tmp_path / "episode.txt"
+    path.write_text("preamble [not a turn]\n[SPEAKER_00] - 00:00:01.000\nHello\n\n  there  \n"
+                    "[SPEAKER_01]-1:02:03.004 Same line text\n[laughs] cuts the turn\n"
+                    "[SPEAKER_00] - 00:05:00.000\n[music]\nintro\n\n"
+                    "[SPEAKER_00] - 00:10:00.000\nLast turn without newline")
+    assert list(iter_text_transcript(path)) == _regex_lines(path)
+    assert list(iter_text_transcript(path))[2] == Line(3723004, 3726004, "Same line text")
+
+    write_txt(path, hours=0.5)
+    assert list(iter_text_transcript(path)) == _regex_lines(path)
+    path.write_text("")
+    assert list(iter_text_transcript(path)) == []
+
+@pytest.mark.parametrize("read_chars", [7, 64, 1 << 16])
+def test_json_matches_json_load(tmp_path, read_chars):
+    path = tmp_path / "episode.json"
+    write_json(path, hours=0.2)
+    items = json.loads(path.read_text())
+    expected = [Line(round(i['start'] * 1000), round(i['end'] * 1000), i['text'].strip()) for i in items]
+    assert list(iter_json_transcript(path, read_chars)) == expected
+
+    path.write_text(' [ {"start": 1.5, "end": 2.25, "text": " a [b], {c}\\n", "words": [{"w": 1e3}]} ,\n'
+                    '{"start": 12345678.9, "end": 12345679, "text": "\\u00e9"} ] ')
+    assert list(iter_json_transcript(path, read_chars)) == [Line(1500, 2250, "a [b], {c}"),
+                                                            Line(12345678900, 12345679000, "é")]
+
+def test_json_timestamps_are_rounded_to_the_millisecond(tmp_path):
+    path = tmp_path / "episode.json"
+    path.write_text('[{"start": 64.731, "end": 70.557, "text": "a"}]')
+    assert list(iter_json_transcript(path)) == [Line(64731, 70557, "a")]
+
+def test_json_rejects_malformed_lists(tmp_path):
+    path = tmp_path / "bad.json"
+    path.write_text("[]")
+    assert list(iter_json_transcript(path)) == []
+    for content in ('{"segments": []}', '[{"start": 1, "end": 2, "text": "a"} {"start": 3}]',
+                    '[{"start": 1, "end": 2, "text": "a"},', ''):
+        path.write_text(content)
+        with pytest.raises(ValueError):
+            list(iter_json_transcript(path, read_chars=8))
+
+def test_iter_transcript_is_lazy(tmp_path):
+    path = tmp_path / "episode.srt"
+    write_srt(path, hours=1)
+    lines = iter_transcript(path)
+    assert next(lines) == parse_transcript(None, str(path))[0]
+    with pytest.raises(ValueError, match="Unsupported"):
+        iter_transcript(tmp_path / "episode.vtt")
@@ -0,0 +1,85 @@
+""" In-memory transcription and checkpoint/resume (with a stand-in Whisper model) """
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from core import parallel_transcribe
+from core.parallel_transcribe import plan_chunks
+from core.transcript_parser import transcribe_audio, Line
+
+class FakeModel:
+    def __init__(self, segments, crash_after=None):
+        self.segments = segments
+        self.crash_after = crash_after
+        self.clips = []
+
+    def transcribe(self, audio, clip_timestamps="0"):
+        self.clips.append(clip_timestamps)
+        start = 0 if clip_timestamps == "0" else clip_timestamps[0]
+
+        def gen():
+            for n, (s, e, text) in enumerate(seg for seg in self.segments if seg[0] >= start):
+                if self.crash_after is not None and n == self.crash_after:
+                    raise RuntimeError("power cut")
+                yield SimpleNamespace(start=s, end=e, text=text)
+        return gen(), None
+
+SEGMENTS = [(0.0, 2.5, " Hello there."), (2.5, 5.0004, " Second\nline "), (5.1, 7.25, " Third."), (7.3, 9.0, " Last.")]
+
+def test_lines_built_directly_without_srt(tmp_path):
+    audio = tmp_path / "ep.mp3"
+    audio.write_bytes(b"audio")
+    lines = transcribe_audio(audio, model=FakeModel(SEGMENTS))
+    assert lines[:2] == [Line(0, 2500, "Hello there."), Line(2500, 5000, "Second line")]
+    assert list(tmp_path.iterdir()) == [audio]
+
+def test_resume_from_checkpoint(tmp_path):
+    audio = tmp_path / "ep.mp3"
+    audio.write_bytes(b"audio")
+    checkpoint = tmp_path / "out" / "transcript.partial.jsonl"
+    with pytest.raises(RuntimeError):
+        transcribe_audio(audio, model=FakeModel(SEGMENTS, crash_after=2), checkpoint=checkpoint)
+    assert checkpoint.exists()
+
+    model = FakeModel(SEGMENTS)
+    lines = transcribe_audio(audio, model=model, checkpoint=checkpoint)
+    assert model.clips == [[5.0]]
+    assert lines == transcribe_audio(audio, model=FakeModel(SEGMENTS))
+    assert not checkpoint.exists()
+
+def test_checkpoint_for_other_audio_is_ignored(tmp_path):
+    audio = tmp_path / "ep.mp3"
+    audio.write_bytes(b"audio")
+    checkpoint = tmp_path / "transcript.partial.jsonl"
+    with pytest.raises(RuntimeError):
+        transcribe_audio(audio, model=FakeModel(SEGMENTS, crash_after=2), checkpoint=checkpoint)
+    audio.write_bytes(b"re-exported audio")
+    model = FakeModel(SEGMENTS)
+    assert len(transcribe_audio(audio, model=model, checkpoint=checkpoint)) == 4
+    assert model.clips == ["0"]
+
+def test_plan_chunks_cuts_only_in_silence():
+    speech = [{"start": 0, "end": 90}, {"start": 110, "end": 190}, {"start": 230, "end": 400}, {"start": 420, "end": 500}]
+    assert plan_chunks(speech, 520, 150) == [(0, 210), (210, 410), (410, 520)]
+    assert plan_chunks([], 100, 150) == [(0, 100)]
+    assert plan_chunks(speech, 520, 10_000) == [(0, 520)]
+
+def test_parallel_chunks_stitched_in_order(tmp_path, monkeypatch):
+    audio_path = tmp_path / "ep.mp3"
+    audio_path.write_bytes(b"audio")
+    audio = np.zeros(16000 * 30, dtype=np.float32)
+    # Speech from 0-9s, 11-19s, 21-30s: cuts at 10s and 20s for 10s target chunks
+    speech = [{"start": 0, "end": 9 * 16000}, {"start": 11 * 16000, "end": 19 * 16000}, {"start": 21 * 16000, "end": 30 * 16000}]
+    monkeypatch.setattr(parallel_transcribe, "decode_audio", lambda path, sampling_rate: audio)
+    monkeypatch.setattr(parallel_transcribe, "get_speech_timestamps", lambda audio, options, sampling_rate: speech)
+
+    class ChunkModel:
+        def transcribe(self, chunk):
+            seconds = len(chunk) / 16000
+            return iter([SimpleNamespace(start=1.0, end=seconds + 5, text=f" chunk of {seconds:.0f}s")]), None
+
+    monkeypatch.setattr(parallel_transcribe, "_CHUNK_MODEL", ChunkModel())
+    with ThreadPoolExecutor(2) as pool:
+        lines = list(parallel_transcribe.iter_transcription_parallel(audio_path, "tiny", workers=2, chunk_sec=10, executor=pool))
+    assert lines == [Line(1000, 10000, "chunk of 10s"), Line(11000, 20000, "chunk of 10s"), Line(21000, 30000, "chunk of 10s")]
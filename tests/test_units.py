@@ -3,9 +3,12 @@
 
 import pytest
 from core.transcript_parser import parse_transcript, Line
-from core.segmenter import segment_transcript
+from core.segmenter import adaptive_segments, adjacent_similarity, segment_transcript, iter_segments, Segment
 from pathlib import Path
 import tempfile
+import json
+import math
+import random
 
 def test_parse_srt():
     with tempfile.NamedTemporaryFile(suffix=".srt", mode="w", delete=False) as f:
@@ -28,6 +31,126 @@ def test_segment_transcript():
     assert segments[0].start_ms == 0
     assert segments[1].start_ms == 3000
 
+def _legacy_segment_transcript(lines, segment_seconds, max_chars):
+    """ The original O(lines * windows) segmenter, kept as a reference """
+    total_duration = lines[-1].end_ms if lines else 0
+    segment_ms = segment_seconds * 1000
+    segments = []
+    for i in range(0, total_duration, segment_ms):
+        start_ms = i
+        end_ms = min(i + segment_ms, total_duration)
+        if end_ms - start_ms < 3000 and i > 0:
+            prev = segments[-1]
+            segments[-1] = Segment(index=prev.index, start_ms=prev.start_ms, end_ms=end_ms, text=prev.text)
+            continue
+        text_parts = []
+        for line in lines:
+            if line.start_ms < end_ms and line.end_ms > start_ms:
+                if min(end_ms, line.end_ms) > max(start_ms, line.start_ms):
+                    text_parts.append(line.text)
+        full_text = ' '.join(text_parts)[:max_chars]
+        segments.append(Segment(index=i//segment_ms, start_ms=start_ms, end_ms=end_ms, text=full_text))
+    return segments
+
+def _random_lines(rng, n, ordered=True):
+    lines = []
+    t = 0
+    for i in range(n):
+        t += rng.randint(0, 4000)
+        start = t if ordered else rng.randint(0, n * 2000)
+        lines.append(Line(start, start + rng.choice([0, 1, 500, 2999, 3000, 12000, 30000]), f"w{i}"))
+    return lines
+
+def test_segment_transcript_matches_legacy_output(tmp_path):
+    rng = random.Random(1234)
+    for case in range(200):
+        lines = _random_lines(rng, rng.randint(0, 60), ordered=case % 3 != 0)
+        seg_sec = rng.choice([1, 2, 3, 5, 12])
+        max_chars = rng.choice([5, 40, 900])
+        out = tmp_path / "segments.json"
+        segments = segment_transcript(lines, seg_sec, max_chars, out)
+        expected = _legacy_segment_transcript(lines, seg_sec, max_chars)
+        assert segments == expected
+        data = [{"index": s.index, "start_ms": s.start_ms, "end_ms": s.end_ms, "text": s.text} for s in expected]
+        assert out.read_text() == json.dumps(data, indent=2)
+
+def test_iter_segments_matches_batch():
+    rng = random.Random(99)
+    for _ in range(200):
+        lines = sorted(_random_lines(rng, rng.randint(0, 60)), key=lambda l: l.start_ms)
+        seg_sec = rng.choice([1, 3, 4, 12])
+        assert list(iter_segments(iter(lines), seg_sec, 900)) == segment_transcript(lines, seg_sec, 900)
+
+def test_iter_segments_yields_before_input_ends():
+    def feed():
+        yield Line(0, 5000, "a")
+        yield Line(30000, 35000, "b")
+        raise RuntimeError("stream still open")
+    stream = iter_segments(feed(), 12, 900)
+    assert next(stream) == Segment(0, 0, 12000, "a")
+    assert next(stream) == Segment(1, 12000, 24000, "")
+
+def _topic_lines(topics, lines_per_topic=32):
+    """ 3 s lines every 3.5 s, one sentence each, lines_per_topic lines on each topic in turn """
+    return [Line(k * 3500, k * 3500 + 3000, f"We talk about {topics[k // lines_per_topic]} again, part {k}.")
+            for k in range(len(topics) * lines_per_topic)]
+
+def test_adjacent_similarity():
+    scores = adjacent_similarity(["quantum physics lecture", "more quantum physics", "pasta recipes", ""])
+    assert scores[0] > 0.3 and scores[1] == 0 and scores[2] == 0
+    assert len(adjacent_similarity([])) == 0 and len(adjacent_similarity(["one text"])) == 0
+
+def test_adaptive_segments_merge_similar_neighbours(tmp_path):
+    lines = _topic_lines(["galaxies telescope orbits", "bread flour yeast", "guitar chords melody"])
+    out = tmp_path / "segments.json"
+    segments = adaptive_segments(lines, 12, 900, max_seconds=60, output_file=out)
+    assert len(segments) < len(segment_transcript(lines, 12, 900)) / 3
+    assert [s.index for s in segments] == list(range(len(segments)))
+    # Contiguous, cut on line starts, within max_seconds, and never across a topic change
+    assert segments[0].start_ms == 0 and segments[-1].end_ms == lines[-1].end_ms
+    assert all(a.end_ms == b.start_ms for a, b in zip(segments, segments[1:]))
+    assert all(s.start_ms % 3500 == 0 and s.end_ms - s.start_ms <= 60000 for s in segments)
+    assert {s.start_ms for s in segments} >= {32 * 3500, 64 * 3500}
+    assert all(s.text.endswith('.') for s in segments)
+    assert json.loads(out.read_text())[1]["text"] == segments[1].text
+
+def test_adaptive_segments_cut_on_pauses_without_merging():
+    lines = [Line(0, 9000, "first thought"), Line(9100, 13000, "still going"), Line(14000, 15000, "new idea"),
+             Line(15100, 28000, "and on"), Line(29000, 42000, "last")]
+    segments = adaptive_segments(lines, 12, 900, similarity=1.1)
+    assert [(s.start_ms, s.end_ms, s.text) for s in segments] == [
+        (0, 14000, "first thought still going"), (14000, 29000, "new idea and on"), (29000, 42000, "last")]
+    assert adaptive_segments([], 12, 900) == []
+
+def test_images_per_hour_budget():
+    lines = _topic_lines(["alpha beta gamma", "delta epsilon zeta", "theta iota kappa", "lambda sigma omega"])
+    free = adaptive_segments(lines, 12, 900, similarity=1.1)
+    hours = lines[-1].end_ms / 3_600_000
+    budget = adaptive_segments(lines, 12, 900, similarity=1.1, images_per_hour=120)
+    assert len(free) > len(budget) and len(budget) <= math.ceil(120 * hours)
+    # max_seconds wins over the budget
+    capped = adaptive_segments(lines, 12, 900, max_seconds=20, similarity=1.1, images_per_hour=1)
+    assert all(s.end_ms - s.start_ms <= 21000 for s in capped[:-1])
+
+def test_caption_timestamps_are_centiseconds():
+    from core.captions import format_ms
+    assert format_ms(5017) == "0:00:05.01"
+    assert format_ms(3723450) == "1:02:03.45"
+
+def test_visible_events_matches_a_scan_of_every_event():
+    from core.captions import AssEvent, visible_events
+    rng = random.Random(5)
+    events = []
+    for i in range(300):
+        start = rng.randrange(0, 60000, 10)
+        events.append(AssEvent(start, start + rng.randrange(0, 5000, 10), f"Dialogue: {i}"))
+    # Back-to-back windows, the chunks of an episode, and zero-length ones at frame boundaries
+    edges = sorted({0, 60000, *(rng.randrange(0, 60000) for _ in range(40))})
+    windows = list(zip(edges, edges[1:])) + [(t, t) for t in edges]
+    expected = [[i for i, e in enumerate(events) if e.start_ms < end and e.end_ms > start] for start, end in windows]
+    assert visible_events(events, windows) == expected
+    assert visible_events([], windows) == [[] for _ in windows] and visible_events(events, []) == []
+
 def test_prompt_generator_no_api():
     # Skip without key
     import os
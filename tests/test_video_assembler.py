@@ -0,0 +1,198 @@
+""" Video assembly: frame planning, and single vs chunked encodes when ffmpeg is installed """
+
+import json
+import re
+import shutil
+import subprocess
+import pytest
+from config import FFMPEG_EXE
+from core.captions import build_captions, read_ass
+from core.cards import write_card
+from core.segmenter import Segment
+from core.video_assembler import VideoChunk, assemble_video, plan_chunks, png_size
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which(FFMPEG_EXE) is None, reason="ffmpeg not installed")
+
+def test_plan_chunks_rounds_on_the_episode_timeline(tmp_path):
+    segments = [Segment(0, 0, 1010, "a"), Segment(1, 1010, 2020, "b"), Segment(2, 2020, 3030, "c")]
+    chunks = plan_chunks(segments, tmp_path, fps=30)
+    assert chunks[1] == VideoChunk(1, tmp_path / "seg_001.png", 30, 31)
+    # Per-segment rounding would give 30 + 30 + 30; the timeline total is 91 frames
+    assert sum(c.frames for c in chunks) == round(3030 * 30 / 1000)
+    assert [c.start_frame for c in chunks] == [0, 30, 61]
+
+def _probe(path):
+    """ (video frame count, container duration) """
+    err = subprocess.run([FFMPEG_EXE, '-i', str(path), '-map', '0:v', '-f', 'null', '-'],
+                         capture_output=True, text=True).stderr
+    h, m, s = re.search(r"Duration: (\d+):(\d+):([\d.]+)", err).groups()
+    return int(re.findall(r"frame=\s*(\d+)", err)[-1]), int(h) * 3600 + int(m) * 60 + float(s)
+
+def _image(path, color):
+    subprocess.run([FFMPEG_EXE, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f"color=c={color}:s=320x180",
+                    '-frames:v', '1', str(path)], check=True)
+
+@pytest.fixture
+def episode(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    for i, color in enumerate(("red", "green", "blue")):
+        _image(images / f"seg_{i:03d}.png", color)
+    audio = tmp_path / "audio.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=6.5", str(audio)], check=True)
+    segments = [Segment(0, 0, 2000, "a"), Segment(1, 2000, 5017, "b"), Segment(2, 5017, 6500, "c")]
+    captions = tmp_path / "captions.ass"
+    build_captions(segments, [{"caption": f"caption {i}"} for i in range(3)], captions)
+    return audio, images, captions, segments
+
+@needs_ffmpeg
+def test_encode_modes_match(episode, tmp_path):
+    audio, images, captions, segments = episode
+    results = {}
+    for mode in ("single", "pipe", "chunked"):
+        out = tmp_path / f"{mode}.mp4"
+        assemble_video(str(audio), images, captions, out, segments, fps=30, mode=mode, workers=2)
+        results[mode] = _probe(out)
+    assert results["chunked"][0] == results["pipe"][0] == results["single"][0] == 195
+    assert results["pipe"][1] == pytest.approx(6.5, abs=0.05)
+    assert results["chunked"][1] == pytest.approx(6.5, abs=0.05)
+    assert results["single"][1] == pytest.approx(6.5, abs=0.05)
+
+@needs_ffmpeg
+def test_only_changed_chunks_are_reencoded(episode, tmp_path):
+    audio, images, captions, segments = episode
+    out = tmp_path / "final.mp4"
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked") == 3
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked") == 0
+
+    build_captions(segments, [{"caption": "new caption" if i == 1 else f"caption {i}"} for i in range(3)], captions)
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked") == 1
+    _image(images / "seg_002.png", "white")
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked") == 1
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, bitrate="2M", mode="chunked") == 3
+
+    assert _probe(out) == (195, pytest.approx(6.5, abs=0.05))
+    assert len(list((tmp_path / "chunks").glob("chunk_*.mp4"))) == 3
+
+@needs_ffmpeg
+def test_still_profile_encodes_few_frames(episode, tmp_path):
+    audio, images, captions, segments = episode
+    out = tmp_path / "still.mp4"
+    assemble_video(str(audio), images, captions, out, segments, mode="chunked", profile="still")
+    frames, duration = _probe(out)
+    assert frames == sum(c.frames for c in plan_chunks(segments, images, fps=5)) == 32
+    assert duration == pytest.approx(6.5, abs=0.05)
+
+@needs_ffmpeg
+def test_pipe_scales_images_to_the_first(episode, tmp_path):
+    audio, images, captions, segments = episode
+    subprocess.run([FFMPEG_EXE, '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', "color=c=white:s=64x64",
+                    '-frames:v', '1', str(images / "seg_001.png")], check=True)
+    assert png_size(images / "seg_001.png") == (64, 64)
+    out = tmp_path / "pipe.mp4"
+    assemble_video(str(audio), images, captions, out, segments, fps=30, mode="pipe")
+    assert _probe(out)[0] == 195
+
+def _frame(path, seconds):
+    """ One rgb24 frame of a video as a flat byte array """
+    import numpy as np
+    raw = subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-ss', str(seconds), '-i', str(path), '-frames:v', '1',
+                          '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-'], capture_output=True, check=True).stdout
+    return np.frombuffer(raw, dtype=np.uint8).astype(int)
+
+def test_unmix_recovers_colour_and_alpha():
+    import numpy as np
+    from core.caption_overlay import _unmix
+    colour, alpha = np.array([200, 100, 50]), 128
+    on_black = np.rint(colour * alpha / 255).reshape(1, 1, 3)
+    on_white = np.rint(colour * alpha / 255 + 255 * (1 - alpha / 255)).reshape(1, 1, 3)
+    rgba = _unmix(on_black, on_white)[0, 0].astype(int)
+    assert rgba[3] == alpha and abs(rgba[:3] - colour).max() <= 2
+    assert _unmix(np.zeros((1, 1, 3)), np.full((1, 1, 3), 255))[0, 0, 3] == 0
+
+def test_overlays_sample_captions_at_each_chunks_first_frame(tmp_path):
+    from core.caption_overlay import _visible_captions
+    # Segments 1010 ms apart at 30 fps: chunk starts fall between, and sometimes on, caption boundaries
+    segments = [Segment(i, i * 1010, (i + 1) * 1010, f"s{i}") for i in range(40)]
+    build_captions(segments, [{"segment_index": i, "caption": f"Caption {i}"} for i in range(40)], tmp_path / "c.ass")
+    chunks = plan_chunks(segments, tmp_path, fps=30)
+    header, visible = _visible_captions(tmp_path / "c.ass", chunks, 30)
+    _, events = read_ass(tmp_path / "c.ass")
+    for chunk in chunks:
+        t = chunk.start_frame * 1000 / 30
+        assert visible[chunk.index] == [e.line.split(',', 3)[::3] for e in events if e.start_ms <= t < e.end_ms]
+    assert visible[0] == [["Dialogue: 0", "Default,,0,0,0,,Caption 0"]]
+
+@needs_ffmpeg
+def test_overlay_captions_match_libass(episode, tmp_path):
+    audio, images, captions, segments = episode
+    reference = tmp_path / "ass.mp4"
+    assemble_video(str(audio), images, captions, reference, segments, fps=30, mode="pipe", profile="still")
+    for mode in ("single", "pipe", "chunked"):
+        out = tmp_path / mode / "final.mp4"
+        out.parent.mkdir()
+        assemble_video(str(audio), images, captions, out, segments, fps=30, mode=mode, profile="still",
+                       caption_render="overlay")
+        assert _probe(out)[0] == 195
+        for seconds in (1, 3.5, 6):
+            assert abs(_frame(out, seconds) - _frame(reference, seconds)).mean() < 1
+    # One overlay per distinct caption, one composited frame per segment
+    assert len(list((tmp_path / "chunked" / "overlays").glob("overlay_*.png"))) == 3
+    assert len(list((tmp_path / "chunked" / "frames").glob("seg_*.png"))) == 3
+    assert not (tmp_path / "pipe" / "frames").exists()
+
+@needs_ffmpeg
+def test_overlays_are_reused(episode, tmp_path):
+    audio, images, captions, segments = episode
+    out = tmp_path / "final.mp4"
+    assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked", caption_render="overlay")
+    overlays = set((tmp_path / "overlays").glob("overlay_*.png"))
+    frames = {path: path.stat().st_mtime_ns for path in (tmp_path / "frames").glob("seg_*.png")}
+
+    build_captions(segments, [{"caption": "new caption" if i == 1 else f"caption {i}"} for i in range(3)], captions)
+    assert assemble_video(str(audio), images, captions, out, segments, fps=30, mode="chunked",
+                          caption_render="overlay") == 1
+    assert len(set((tmp_path / "overlays").glob("overlay_*.png")) - overlays) == 1
+    kept = {path: path.stat().st_mtime_ns for path in (tmp_path / "frames").glob("seg_*.png") if path in frames}
+    assert kept == {path: mtime for path, mtime in frames.items() if path in kept} and len(kept) == 2
+
+@needs_ffmpeg
+def test_cli_rerun_reencodes_only_edited_chunks(tmp_path, monkeypatch, fake_comfy):
+    import podcast_video_factory as factory
+    from benchmarks.synthetic import write_srt
+    monkeypatch.setattr(factory, "OPENAI_API_KEY", "YOUR_KEY")
+    write_card(tmp_path / "render.png", 320, 180, (40, 40, 40))
+    fake_comfy.png = (tmp_path / "render.png").read_bytes()
+    audio = tmp_path / "episode.wav"
+    subprocess.run([FFMPEG_EXE, '-loglevel', 'error', '-f', 'lavfi', '-i', "sine=d=60", str(audio)], check=True)
+    srt = tmp_path / "episode.srt"
+    write_srt(srt, 60 / 3600)
+    out = tmp_path / "out"
+    episode = out / "episode"
+    args = factory.build_parser().parse_args(["--audio", str(audio), "--srt", str(srt), "--out", str(out),
+                                              "--comfy-url", fake_comfy.url, "--encode-mode", "chunked",
+                                              "--video-profile", "still", "--width", "320", "--height", "180"])
+
+    def encoded():
+        """ Segments the last run re-encoded """
+        factory.run_episode(str(audio), str(srt), args)
+        return int(re.findall(r"Assembled video \((\d+) of 5", (episode / "run.log").read_text())[-1])
+
+    assert encoded() == 5
+    cached = next((out / ".cache" / "prompts").glob("*.json")).read_text()
+
+    # One caption edited in prompts.json (written in place), one image replaced
+    prompts = json.loads((episode / "prompts.json").read_text())
+    prompts["results"][1]["caption"] = "Edited Caption"
+    with open(episode / "prompts.json", 'w') as f:
+        json.dump(prompts, f)
+    write_card(episode / "images" / "seg_003.png", 320, 180, (200, 200, 200))
+    assert encoded() == 2
+    assert "Edited Caption" in (episode / "captions.ass").read_text()
+    # Both edits survive, and the cache entry is untouched
+    assert json.loads((episode / "prompts.json").read_text()) == prompts
+    assert next((out / ".cache" / "prompts").glob("*.json")).read_text() == cached
+    assert fake_comfy.submitted == 5
+    # Nothing changed since: the video comes from the cache
+    factory.run_episode(str(audio), str(srt), args)
+    assert (episode / "run.log").read_text().rstrip().splitlines()[-2].endswith("Reusing video")
@@ -0,0 +1,59 @@
+""" Whisper worker daemon tests (with a stand-in model loader) """
+
+import threading
+import pytest
+from core import transcript_parser
+from core.transcript_parser import Line
+from core.whisper_worker import ModelPool, make_server, submit_transcription, worker_available
+
+def test_model_pool_lru():
+    loads = []
+    pool = ModelPool(max_models=2, loader=lambda *key: loads.append(key) or object())
+    a, _ = pool.get(("tiny", "cpu", "int8"))
+    pool.get(("base", "cpu", "int8"))
+    assert pool.get(("tiny", "cpu", "int8"))[0] is a
+    pool.get(("small", "cpu", "int8"))
+    assert pool.keys() == [("tiny", "cpu", "int8"), ("small", "cpu", "int8")]
+    pool.get(("base", "cpu", "int8"))
+    assert loads == [("tiny", "cpu", "int8"), ("base", "cpu", "int8"), ("small", "cpu", "int8"), ("base", "cpu", "int8")]
+
+def test_device_probe_is_cached(monkeypatch):
+    probes = []
+
+    def fake_model(size, device, compute_type):
+        probes.append(size)
+        raise RuntimeError("no cuda")
+
+    monkeypatch.setattr(transcript_parser, "WhisperModel", fake_model)
+    monkeypatch.setattr(transcript_parser, "_DEVICE_PROBE", {})
+    assert transcript_parser.resolve_device("auto") == ("cpu", "int8")
+    assert transcript_parser.resolve_device("auto") == ("cpu", "int8")
+    assert probes == ["tiny"]
+
+@pytest.fixture
+def worker():
+    calls = []
+
+    def transcribe(pool, audio_path, model_size, device, checkpoint=None):
+        model, lock = pool.get((model_size, device, "int8"))
+        calls.append((audio_path, model_size, device))
+        return [[0, 1500, f"hello from {model_size}"]]
+
+    pool = ModelPool(loader=lambda *key: object())
+    server = make_server(pool=pool, transcribe=transcribe)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", calls, pool
+    server.shutdown()
+    server.server_close()
+
+def test_worker_round_trip(worker, tmp_path):
+    url, calls, pool = worker
+    assert worker_available(url)
+    lines = submit_transcription(tmp_path / "ep.mp3", "base", "cpu", url=url)
+    assert lines == [Line(0, 1500, "hello from base")]
+    submit_transcription(tmp_path / "ep2.mp3", "base", "cpu", url=url)
+    assert calls[0] == (str((tmp_path / "ep.mp3").resolve()), "base", "cpu")
+    assert pool.keys() == [("base", "cpu", "int8")]
+
+def test_worker_unavailable():
+    assert not worker_available("http://127.0.0.1:9")